@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+Name                 : Band math
+Description          : Compile expression of bands(B1, B2, ...) for arrays
+Arguments            : Expression. Ex.: (B4-B3)/(B4+B3+0.5)*1.5
+
+                       -------------------
+begin                : 2016-08-11
+copyright            : (C) 2016 by Luiz Motta
+email                : motta dot luiz at gmail.com
+
+ ***************************************************************************/
+"""
+
+import ast, re, __future__
+
+import numpy as np
+
+class BandMath():
+  # Values of bands are float(like Python float of scalar algorithms)
+  # Conditional: 'a if condition else b' or where(condition, a, b)
+  # Logical: and, or, not; comparisons: <, <=, >, >=, ==, !=
+  # Numbers are float64 of numpy(ex.: 9**9**9 is inf, not a big integer of Python)
+  functions = {
+    'where': np.where, 'abs': np.abs, 'sqrt': np.sqrt,
+    'exp': np.exp, 'log': np.log, 'log10': np.log10,
+    'min': np.minimum, 'max': np.maximum, 'clip': np.clip,
+    'logical_and': np.logical_and, 'logical_or': np.logical_or, 'logical_not': np.logical_not
+  }
+  constants = { 'pi': np.pi, 'e': np.e }
+  nodes = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.IfExp,
+    ast.Call, ast.Num, ast.Name, ast.Load,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.Mod,
+    ast.UAdd, ast.USub, ast.Not, ast.And, ast.Or,
+    ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.Eq, ast.NotEq
+  )
+  nodesBoolean = ( ast.Compare, ast.BoolOp )
+  reBand = re.compile( '^B([1-9][0-9]*)$' )
+
+  class _Vectorize(ast.NodeTransformer):
+    # Python conditionals and logical operators to functions of arrays
+    # Numbers to float64(not folded by compiler)
+    def _call(self, name, args, node):
+      call = ast.Call( func=ast.Name( id=name, ctx=ast.Load() ), args=args, keywords=[], starargs=None, kwargs=None )
+      return ast.copy_location( call, node )
+
+    def visit_Num(self, node):
+      return self._call( 'float64', [ ast.copy_location( ast.Num( n=float( node.n ) ), node ) ], node )
+
+    def visit_IfExp(self, node):
+      self.generic_visit( node )
+      return self._call( 'where', [ node.test, node.body, node.orelse ], node )
+
+    def visit_BoolOp(self, node):
+      self.generic_visit( node )
+      name = 'logical_and' if isinstance( node.op, ast.And ) else 'logical_or'
+      value = node.values[0]
+      for v in node.values[1:]:
+        value = self._call( name, [ value, v ], node )
+      return value
+
+    def visit_UnaryOp(self, node):
+      self.generic_visit( node )
+      if isinstance( node.op, ast.Not ):
+        return self._call( 'logical_not', [ node.operand ], node )
+      return node
+
+    def visit_Compare(self, node):
+      # a < b < c => logical_and( a < b, b < c )
+      self.generic_visit( node )
+      if len( node.ops ) == 1:
+        return node
+      left, value = node.left, None
+      for i in xrange( len( node.ops ) ):
+        compare = ast.copy_location( ast.Compare( left=left, ops=[ node.ops[ i ] ], comparators=[ node.comparators[ i ] ] ), node )
+        value = compare if value is None else self._call( 'logical_and', [ value, compare ], node )
+        left = node.comparators[ i ]
+      return value
+
+  def __init__(self):
+    self.expression, self.code, self.bandNumbers = None, None, None
+    self.isBoolean = False
+
+  def compile(self, expression):
+    def checkNodes(tree):
+      funcs = [ node.func for node in ast.walk( tree ) if isinstance( node, ast.Call ) ]
+      for node in ast.walk( tree ):
+        if not isinstance( node, self.nodes ):
+          return { 'isOk': False, 'msg': "Expression '%s': '%s' is not permited" % ( expression, node.__class__.__name__ ) }
+        if isinstance( node, ast.Call ):
+          if not isinstance( node.func, ast.Name ) or not node.func.id in self.functions:
+            return { 'isOk': False, 'msg': "Expression '%s': function not permited" % expression }
+          if len( node.keywords ) > 0 or not node.starargs is None or not node.kwargs is None:
+            return { 'isOk': False, 'msg': "Expression '%s': only positional arguments for functions" % expression }
+        if isinstance( node, ast.Name ) and node.id in self.functions and not node in funcs:
+          return { 'isOk': False, 'msg': "Expression '%s': function '%s' without arguments" % ( expression, node.id ) }
+        if isinstance( node, ast.Name ) and not node.id in self.functions:
+          if self.reBand.match( node.id ) is None and not node.id in self.constants:
+            return { 'isOk': False, 'msg': "Expression '%s': name '%s' is not a band(B1, B2, ...) or constant" % ( expression, node.id ) }
+          m = self.reBand.match( node.id )
+          if not m is None and not int( m.group( 1 ) ) in bandNumbers:
+            bandNumbers.append( int( m.group( 1 ) ) )
+        if isinstance( node, ast.Num ):
+          if isinstance( node.n, complex ):
+            return { 'isOk': False, 'msg': "Expression '%s': complex number is not permited" % expression }
+          try:
+            float( node.n )
+          except OverflowError:
+            return { 'isOk': False, 'msg': "Expression '%s': number out of range" % expression }
+      return { 'isOk': True }
+
+    try:
+      tree = ast.parse( expression.strip(), mode='eval' )
+    except SyntaxError as e:
+      return { 'isOk': False, 'msg': "Expression '%s': %s" % ( expression, e.msg ) }
+    bandNumbers = []
+    vreturn = checkNodes( tree )
+    if not vreturn['isOk']:
+      return vreturn
+    if len( bandNumbers ) == 0:
+      return { 'isOk': False, 'msg': "Expression '%s' not have bands(B1, B2, ...)" % expression }
+
+    self.isBoolean = isinstance( tree.body, self.nodesBoolean ) or \
+                     ( isinstance( tree.body, ast.UnaryOp ) and isinstance( tree.body.op, ast.Not ) )
+    tree = ast.fix_missing_locations( self._Vectorize().visit( tree ) )
+    self.code = compile( tree, '<expression>', 'eval', __future__.division.compiler_flag, True ) # 1/2 = 0.5
+    self.expression, self.bandNumbers = expression, sorted( bandNumbers )
+    return { 'isOk': True }
+
+  def evaluate(self, values):
+    # values: [ array band, ... ] in order of self.bandNumbers
+    namespace = { '__builtins__': {} }
+    namespace.update( self.functions )
+    namespace.update( self.constants )
+    namespace['float64'] = np.float64
+    for i in xrange( len( self.bandNumbers ) ):
+      namespace[ "B%d" % self.bandNumbers[ i ] ] = values[ i ].astype( np.float64 )
+    with np.errstate( divide='ignore', invalid='ignore', over='ignore' ):
+      result = eval( self.code, namespace )
+    shape = values[0].shape
+    return np.broadcast_to( np.asarray( result, np.float64 ), shape )
@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+Name                 : Batch processing image
+Description          : Run many jobs(scene x algorithm) of processing image
+Arguments            : Manifest(JSON or CSV) of jobs
+
+                       -------------------
+begin                : 2016-08-11
+copyright            : (C) 2016 by Luiz Motta
+email                : motta dot luiz at gmail.com
+
+ ***************************************************************************/
+"""
+
+import os, sys, argparse, json, csv, re, math, datetime, multiprocessing
+
+from processingimage import RegionImage, CollectionAlgorithms, ProcessingImage, LocalImage, RemoteImage, PLScene
+from consoleprocessingimage import addArgumentsOutput, getOptionsOutput, addArgumentsCache, getOptionsCache, addArgumentsQualityMask, getOptionsQualityMask
+
+processing_types = { 'local': LocalImage, 'remote': RemoteImage, 'pl': PLScene }
+manifest_fields = ( 'type', 'name', 'algorithm', 'bands', 'wkt', 'product_type', 'expression', 'datatype', 'nodata', 'quality_mask' )
+
+def getSeconds(t1):
+  return ( datetime.datetime.now() - t1 ).total_seconds()
+
+def getAlgorithm(job):
+  # job from checkJob
+  if job['algorithm'] == 'expr':
+    return { 'name': 'expr', 'expression': job['expression'], 'datatype': job['datatype'], 'nodata': job['nodata'] }
+  return { 'name': job['algorithm'], 'bandNumbers': job['bands'] }
+
+def checkJob(job):
+  # Return the job with types of values for processing
+  # For 'expr', the bands are from 'expression', datatype and nodata from algorithm(default infered)
+  isExpression = job.get( 'algorithm' ) == 'expr'
+  for key in ( 'type', 'name', 'algorithm', 'expression' if isExpression else 'bands' ):
+    if job.get( key ) in ( None, '' ):
+      return { 'isOk': False, 'msg': "Missing '%s'" % key }
+  if not job['type'] in processing_types.keys():
+    msg = "Type of processing '%s' not valid. Valids types: %s" % ( job['type'], " or ".join( processing_types.keys() ) )
+    return { 'isOk': False, 'msg': msg }
+  if isExpression:
+    datatype, nodata = job.get( 'datatype' ), job.get( 'nodata' )
+    if datatype == '':
+      datatype = None
+    if nodata == '':
+      nodata = None
+    if not nodata is None:
+      try:
+        nodata = float( nodata )
+      except ( TypeError, ValueError ):
+        return { 'isOk': False, 'msg': "No data '%s' is not a number." % nodata }
+    algorithm = { 'name': 'expr', 'expression': job['expression'], 'datatype': datatype, 'nodata': nodata }
+  else:
+    values = job['bands']
+    if isinstance( values, basestring ):
+      values = filter( lambda v: v != '', re.split( '[,; ]+', values ) )
+    for v in values:
+      if not str( v ).isdigit():
+        return { 'isOk': False, 'msg': "Band '%s' is not a number." % v }
+    algorithm = { 'name': job['algorithm'], 'bandNumbers': map( lambda v: int( v ), values ) }
+  vreturn = CollectionAlgorithms().checkAlgorithm( algorithm )
+  if not vreturn['isOk']:
+    return vreturn
+  algorithm = vreturn['algorithm']
+  nodata = algorithm.get( 'nodata' )
+  if not nodata is None and math.isnan( nodata ): # Default of float, NaN is not equal in grouping of jobs
+    nodata = None
+  wkt = job.get( 'wkt' )
+  if wkt == '':
+    wkt = None
+  if not wkt is None and not RegionImage.isValidGeom( wkt ):
+    return { 'isOk': False, 'msg': "The WKT '%s' not valid." % wkt }
+  product_type = job.get( 'product_type' )
+  if product_type in ( None, '' ):
+    product_type = "analytic"
+
+  quality_mask = job.get( 'quality_mask' )
+  if quality_mask == '':
+    quality_mask = None
+
+  job = {
+    'id': job['id'], 'type': job['type'], 'name': job['name'], 'product_type': product_type,
+    'algorithm': job['algorithm'], 'bands': algorithm['bandNumbers'], 'wkt': wkt,
+    'expression': job.get( 'expression' ) if isExpression else None,
+    'datatype': algorithm.get( 'datatype' ), 'nodata': nodata,
+    'quality_mask': quality_mask
+  }
+  return { 'isOk': True, 'job': job }
+
+def readManifest(filename):
+  # JSON: [ { job }, ... ] or { "jobs": [ { job }, ... ] }
+  # CSV: header with names of manifest_fields
+  msg = None
+  try:
+    with open( filename ) as f:
+      if os.path.splitext( filename )[1].lower() == '.csv':
+        jobs = [ dict( row ) for row in csv.DictReader( f ) ]
+      else:
+        jobs = json.load( f )
+        if isinstance( jobs, dict ):
+          jobs = jobs.get( 'jobs', [] )
+  except ( IOError, ValueError, csv.Error ) as e:
+    msg = str( e )
+  if not msg is None:
+    return { 'isOk': False, 'msg': "Reading manifest '%s': %s" % ( filename, msg ) }
+  for i in xrange( len( jobs ) ):
+    if not isinstance( jobs[ i ], dict ):
+      return { 'isOk': False, 'msg': "Job '%d' of manifest '%s' is not a object" % ( i + 1, filename ) }
+    jobs[ i ]['id'] = i + 1
+  return { 'isOk': True, 'jobs': jobs }
+
+# Worker of pool, each process keep one ProcessingImage by processing type
+_worker = { 'idWorker': 1, 'images': {} }
+
+def _initWorker(counter):
+  with counter.get_lock():
+    counter.value += 1
+    _worker['idWorker'] = counter.value
+
+def runScene(task):
+  # task: { 'jobs': [ job, ... ](same scene), 'options': options }
+  # Open dataset one time for all jobs, and subset and read of bands one time for each WKT
+  def getRecord(job, isOk, msg, filename, times, stats=None):
+    record = job.copy()
+    record.update( {
+      'isOk': isOk, 'msg': msg, 'filename': filename,
+      'idWorker': _worker['idWorker'], 'times': times, 'stats': stats
+    } )
+    return record
+
+  def getImageProcessing(processing_type):
+    images = _worker['images']
+    if not processing_type in images:
+      images[ processing_type ] = processing_types[ processing_type ]( _worker['idWorker'] )
+    return images[ processing_type ]
+
+  def runAlgorithms(algorithms):
+    # algorithms: list(one read of bands for all) or one algorithm
+    try:
+      vreturn = imageProcessing.run( algorithms, options )
+    except Exception as e:
+      vreturn = { 'isOk': False, 'msg': str( e ) }
+    return vreturn
+
+  jobs = task['jobs']
+  scene = jobs[0]
+  options = task['options'].copy()
+  if not scene['quality_mask'] is None: # Bits and band of quality mask from options
+    options['qualityMask'] = dict( options['qualityMask'], name=scene['quality_mask'] )
+  else:
+    options['qualityMask'] = None
+  imageProcessing = getImageProcessing( scene['type'] )
+  image = { 'name': scene['name'], 'PRODUCT_TYPE': scene['product_type'] }
+  t1 = datetime.datetime.now()
+  try:
+    vreturn = imageProcessing.setImage( image, None )
+  except Exception as e:
+    vreturn = { 'isOk': False, 'msg': str( e ) }
+  timeOpen = getSeconds( t1 )
+  if not vreturn['isOk']:
+    return [ getRecord( job, False, vreturn['msg'], None, { 'open': timeOpen } ) for job in jobs ]
+
+  records = []
+  wkts = []
+  for job in jobs:
+    if not job['wkt'] in wkts:
+      wkts.append( job['wkt'] )
+  for wkt in wkts:
+    t1 = datetime.datetime.now()
+    try:
+      vreturn = imageProcessing.setSubset( wkt )
+    except Exception as e: # Ex.: WKT not valid
+      vreturn = { 'isOk': False, 'msg': str( e ) }
+    times = { 'open': timeOpen, 'subset': getSeconds( t1 ) }
+    jobsWkt = filter( lambda j: j['wkt'] == wkt, jobs )
+    if not vreturn['isOk']:
+      records.extend( [ getRecord( job, False, vreturn['msg'], None, times ) for job in jobsWkt ] )
+      continue
+    # All algorithms of subset in one run(bands are read one time)
+    algorithms = []
+    for job in jobsWkt:
+      algorithm = getAlgorithm( job )
+      if not algorithm in algorithms:
+        algorithms.append( algorithm )
+    t1 = datetime.datetime.now()
+    vreturn = runAlgorithms( algorithms )
+    if vreturn['isOk']:
+      # Statistics of run are shared by algorithms of subset
+      vreturns = map( lambda f: { 'isOk': True, 'filename': f, 'stats': vreturn['stats'] }, vreturn['filenames'] )
+    elif len( algorithms ) > 1:
+      # Run each algorithm, the error of one job not fail the others
+      vreturns = map( lambda a: runAlgorithms( a ), algorithms )
+    else:
+      vreturns = [ vreturn ]
+    times['run'] = getSeconds( t1 )
+    for job in jobsWkt:
+      algorithm = getAlgorithm( job )
+      vreturn = vreturns[ algorithms.index( algorithm ) ]
+      if not vreturn['isOk']:
+        records.append( getRecord( job, False, vreturn['msg'], None, times ) )
+        continue
+      records.append( getRecord( job, True, None, vreturn['filename'], times, vreturn['stats'] ) )
+  return records
+
+def run(jobs, workers, options, fileOut):
+  def writeRecords(records):
+    for record in records:
+      fileOut.write( "%s\n" % json.dumps( record ) )
+      total[ 'ok' if record['isOk'] else 'failed' ] += 1
+    fileOut.flush()
+
+  t1 = datetime.datetime.now()
+  total = { 'ok': 0, 'failed': 0 }
+  scenes, keys = {}, []
+  for job in jobs:
+    vreturn = checkJob( job )
+    if not vreturn['isOk']:
+      record = dict( ( k, job.get( k ) ) for k in manifest_fields )
+      record.update( { 'id': job['id'], 'isOk': False, 'msg': vreturn['msg'], 'filename': None } )
+      writeRecords( [ record ] )
+      continue
+    job = vreturn['job']
+    key = ( job['type'], job['name'], job['product_type'], job['quality_mask'] )
+    if not key in scenes:
+      scenes[ key ] = []
+      keys.append( key )
+    scenes[ key ].append( job )
+  tasks = [ { 'jobs': scenes[ key ], 'options': options } for key in keys ]
+
+  if workers > 1:
+    counter = multiprocessing.Value( 'i', 0 )
+    pool = multiprocessing.Pool( workers, _initWorker, ( counter, ) )
+    for records in pool.imap_unordered( runScene, tasks ):
+      writeRecords( records )
+    pool.close()
+    pool.join()
+  else:
+    for task in tasks:
+      writeRecords( runScene( task ) )
+
+  data = ( total['ok'] + total['failed'], len( tasks ), total['ok'], total['failed'], str( datetime.datetime.now() - t1 ) )
+  sys.stderr.write( "Jobs: %d(scenes %d) Ok: %d Failed: %d Time: %s\n" % data )
+  return 0 if total['failed'] == 0 else 1
+
+def main():
+  d = "Batch of image processing local, remote(HTTP GeoTIFF) or server(Planet Labs)."
+  parser = argparse.ArgumentParser(description=d )
+  d = "Manifest of jobs, JSON(list of jobs) or CSV(header: %s)" % ','.join( manifest_fields )
+  parser.add_argument('manifest', metavar='manifest', type=str, help=d )
+  d = "Total of processes for jobs (default 1)"
+  parser.add_argument('-j', metavar='workers', dest='workers', type=int, default=1, help=d)
+  d = "Engine of processing: %s (default '%s')" % ( " or ".join( ProcessingImage.engines ), ProcessingImage.defaultOptions['engine'] )
+  parser.add_argument('-e', metavar='engine', dest='engine', type=str, default=ProcessingImage.defaultOptions['engine'], help=d)
+  d = "Read mode for 'array' engine: %s (default '%s')" % ( " or ".join( ProcessingImage.readModes ), ProcessingImage.defaultOptions['read'] )
+  parser.add_argument('-r', metavar='read_mode', dest='read', type=str, default=ProcessingImage.defaultOptions['read'], help=d)
+  d = "Pixels outside of WKT region are nodata, not read and not calculated (only for 'array' engine)"
+  parser.add_argument('-m', dest='cutline', action='store_true', help=d)
+  d = "File for results of jobs (JSON lines), default is standard output"
+  parser.add_argument('-o', metavar='results', dest='results', type=str, help=d)
+  d = "Factor of reduction of resolution(ex.: 4 is 1/4), read from overviews if exists (default 1)"
+  parser.add_argument('--reduction', metavar='factor', dest='reduction', type=int, default=ProcessingImage.defaultOptions['reduction'], help=d)
+  d = "Tiles in queues of threads of read and write, overlap with calculation, 0 is sequential (only for 'array' engine, default 0)"
+  parser.add_argument('--pipeline', metavar='depth', dest='pipeline', type=int, default=ProcessingImage.defaultOptions['pipeline'], help=d)
+  d = "Record tiles written, a job canceled is resumed by run with same parameters (only for 'array' engine)"
+  parser.add_argument('--checkpoint', dest='checkpoint', action='store_true', help=d)
+  addArgumentsOutput( parser )
+  addArgumentsCache( parser )
+  addArgumentsQualityMask( parser, False )
+
+  args = parser.parse_args()
+  if not os.path.exists( args.manifest ):
+    print "Not found '%s'" % args.manifest
+    return 1
+  if args.workers < 1:
+    print "Total of workers '%d' need be greater than 0" % args.workers
+    return 1
+  if not args.engine in ProcessingImage.engines:
+    print "Engine '%s' not valid. Valids engines: %s" % ( args.engine, " or ".join( ProcessingImage.engines ) )
+    return 1
+  if args.reduction < 1:
+    print "Reduction '%d' need be greater than 0" % args.reduction
+    return 1
+  if args.pipeline < 0:
+    print "Pipeline '%d' need be greater or equal than 0" % args.pipeline
+    return 1
+  if not args.read in ProcessingImage.readModes:
+    print "Read mode '%s' not valid. Valids modes: %s" % ( args.read, " or ".join( ProcessingImage.readModes ) )
+    return 1
+  vreturn = readManifest( args.manifest )
+  if not vreturn['isOk']:
+    print vreturn['msg']
+    return 1
+
+  options = getOptionsOutput( args )
+  if options is None:
+    return 1
+  optionsCache = getOptionsCache( args )
+  if optionsCache is None:
+    return 1
+  options.update( optionsCache )
+  optionsQualityMask = getOptionsQualityMask( args, '' ) # Name from 'quality_mask' of job
+  if optionsQualityMask is None:
+    return 1
+  options.update( optionsQualityMask )
+  options.update( { 'engine': args.engine, 'read': args.read, 'cutline': args.cutline, 'reduction': args.reduction, 'pipeline': args.pipeline, 'checkpoint': args.checkpoint } )
+  fileOut = sys.stdout if args.results is None else open( args.results, 'w' )
+  vreturn = run( vreturn['jobs'], args.workers, options, fileOut )
+  if not args.results is None:
+    fileOut.close()
+  return vreturn
+
+if __name__ == "__main__":
+    sys.exit( main() )
@@ -4,7 +4,7 @@
 /***************************************************************************
 Name                 : Bounding box from GeoJson
 Description          : Get region of scene
-Arguments            : GeoJson of regin polygon(EPSG 4326)
+Arguments            : GeoJson of regin polygon(EPSG 4326) or features(file or standard input)
 
                        -------------------
 begin                : 2016-08-28
@@ -14,12 +14,15 @@ email                : motta dot luiz at gmail.com
  ***************************************************************************/
 """
 
-import sys, argparse
+import os, sys, argparse, json
 
 from osgeo import gdal, ogr
 gdal.UseExceptions()
 gdal.PushErrorHandler('CPLQuietErrorHandler')
 
+from footprintindex import FootprintIndex
+from geojsonstream import openInput, openOutput, readFeatures
+
 def run(geojson):
   geom = ogr.CreateGeometryFromJson( geojson )
   if geom is None:
@@ -36,15 +39,49 @@ def run(geojson):
   print '{ "isOk": 1, "bbox": %s }' % bbox
   
   return 0
-  
+
+def runStream(filenameIn, filenameOut):
+  # One line by feature: { "isOk", "id", "bbox" or "msg" }, bounding box from coordinates
+  fileIn, fileOut = openInput( filenameIn ), openOutput( filenameOut )
+  total, totalError = 0, 0
+  try:
+    for feature in readFeatures( fileIn ):
+      total += 1
+      record = { 'id': feature.get( 'id', ( feature.get( 'properties' ) or {} ).get( 'id', total ) ) }
+      bbox = FootprintIndex.getBBox( feature.get( 'geometry' ) or {} )
+      if bbox is None:
+        record.update( { 'isOk': 0, 'msg': "Geometry not valid" } )
+        totalError += 1
+      else:
+        #-projwin ulx uly lrx lry
+        record.update( { 'isOk': 1, 'bbox': "%f %f %f %f" % ( bbox[0], bbox[3], bbox[2], bbox[1] ) } )
+      fileOut.write( "%s\n" % json.dumps( record ) )
+  except ValueError as e:
+    fileOut.write( "%s\n" % json.dumps( { 'isOk': 0, 'msg': "Geojson item '%d': %s" % ( total + 1, str( e ) ) } ) )
+    totalError += 1
+  fileOut.flush()
+  if not filenameIn in ( None, '-' ):
+    fileIn.close()
+  if not filenameOut in ( None, '-' ):
+    fileOut.close()
+  return 0 if totalError == 0 else 1
 
 def main():
   d = 'Print bounding box of Geojson({ "isOk": 1, "bbox": "ulx uly lrx lry"}).'
   parser = argparse.ArgumentParser(description=d )
-  d = "Geojson of geometry"
-  parser.add_argument('geojson', metavar='geojson', type=str, help=d )
+  d = "Geojson of geometry, without it, features are read from input(newline-delimited GeoJSON or FeatureCollection)"
+  parser.add_argument('geojson', metavar='geojson', type=str, nargs='?', help=d )
+  d = "File of features, '-' is standard input"
+  parser.add_argument('-i', metavar='input', dest='input', type=str, help=d)
+  d = "File of bounding boxes(one line by feature), default is standard output"
+  parser.add_argument('-o', metavar='output', dest='output', type=str, help=d)
 
   args = parser.parse_args()
+  if args.geojson is None:
+    if not args.input in ( None, '-' ) and not os.path.exists( args.input ):
+      print '{ "isOk": 0, "msg": "Not found \'%s\'" }' % args.input
+      return 1
+    return runStream( args.input, args.output )
   return run( args.geojson )
 
 if __name__ == "__main__":
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+Name                 : Benchmark processing image
+Description          : Benchmark of ProcessingImage with synthetic images
+                       (sizes, data types, total of bands and layouts)
+Arguments            : File for results(JSON)
+
+                       -------------------
+begin                : 2016-08-11
+copyright            : (C) 2016 by Luiz Motta
+email                : motta dot luiz at gmail.com
+
+ ***************************************************************************/
+"""
+
+import os, sys, argparse, json, datetime, platform, resource, subprocess, multiprocessing, itertools, Queue
+
+import numpy as np
+
+from osgeo import gdal, osr
+
+from processingimage import ProcessingImage, LocalImage, gdal_numpy_types
+
+# Synthetic images, all have EPSG 4326 for subset by WKT
+fixture_sizes = { 'small': 1024, 'medium': 4096, 'large': 8192 }
+fixture_datatypes = { 'Byte': gdal.GDT_Byte, 'UInt16': gdal.GDT_UInt16, 'Float32': gdal.GDT_Float32 }
+fixture_layouts = {
+  'striped': [],
+  'tiled': [ 'TILED=YES', 'BLOCKXSIZE=256', 'BLOCKYSIZE=256' ],
+  'striped-deflate': [ 'COMPRESS=DEFLATE' ],
+  'tiled-deflate': [ 'TILED=YES', 'BLOCKXSIZE=256', 'BLOCKYSIZE=256', 'COMPRESS=DEFLATE' ]
+}
+fixture_transform = ( -45.0, 0.0001, 0.0, -10.0, 0.0, -0.0001 )
+benchmark_algorithms = {
+  'mask': { 'name': 'mask', 'bandNumbers': [ 1 ] },
+  'norm-diff': { 'name': 'norm-diff', 'bandNumbers': [ 2, 1 ] },
+  'expr': { 'name': 'expr', 'expression': "(B2-B1)/(B2+B1+0.5)*1.5" }
+}
+
+def createFixture(dirFixtures, size, datatype, bands, layout):
+  # Same parameters, same image(the file is reused)
+  name = "fixture_%s_%s_%db_%s.tif" % ( size, datatype, bands, layout )
+  filename = os.path.join( dirFixtures, name )
+  if os.path.exists( filename ):
+    return filename
+
+  xsize = ysize = fixture_sizes[ size ]
+  filenameWork = "%s.tmp" % filename
+  ds = gdal.GetDriverByName('GTiff').Create( filenameWork, xsize, ysize, bands, fixture_datatypes[ datatype ], options=fixture_layouts[ layout ] )
+  sr = osr.SpatialReference()
+  sr.ImportFromEPSG( 4326 )
+  ds.SetProjection( sr.ExportToWkt() )
+  ds.SetGeoTransform( fixture_transform )
+  maxValue = { 'Byte': 255, 'UInt16': 10000, 'Float32': 1.0 }[ datatype ]
+  dtype = gdal_numpy_types[ fixture_datatypes[ datatype ] ]
+  rows = 256
+  for b in xrange( 1, bands + 1 ):
+    band = ds.GetRasterBand( b )
+    random = np.random.RandomState( b )
+    for y in xrange( 0, ysize, rows ):
+      values = random.uniform( 0, maxValue, ( min( rows, ysize - y ), xsize ) )
+      band.WriteArray( values.astype( dtype ), 0, y )
+    band.FlushCache()
+    band = None
+  ds = None
+  os.rename( filenameWork, filename )
+  return filename
+
+def getWktSubset(size):
+  # Center of image, half of width and height
+  side = fixture_sizes[ size ] * fixture_transform[1]
+  x1, y1 = fixture_transform[0] + side / 4, fixture_transform[3] - side / 4
+  x2, y2 = x1 + side / 2, y1 - side / 2
+  coords = [ ( x1, y1 ), ( x2, y1 ), ( x2, y2 ), ( x1, y2 ), ( x1, y1 ) ]
+  return "POLYGON (( %s ))" % ','.join( map( lambda c: "%f %f" % c, coords ) )
+
+def runCase(case):
+  # Run in own process(runCaseProcess), peak RSS is only of case
+  os.chdir( case['dirOut'] )
+  gdal.SetCacheMax( case['cacheMax'] )
+  worker = LocalImage( 1 )
+  t1 = datetime.datetime.now()
+  vreturn = worker.setImage( { 'name': case['filename'] }, case['wkt'] )
+  if not vreturn['isOk']:
+    return vreturn
+  vreturn = worker.run( case['algorithm'], case['options'] )
+  seconds = ( datetime.datetime.now() - t1 ).total_seconds()
+  if not vreturn['isOk']:
+    return vreturn
+  os.remove( vreturn['filename'] )
+  pixels = worker.metadata['xsize'] * worker.metadata['ysize']
+  del worker
+  return {
+    'isOk': True, 'seconds': seconds, 'pixels': pixels, 'stats': vreturn['stats'],
+    'peakRSS': resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss # KB in Linux
+  }
+
+def _runCaseTarget(case, queue):
+  try:
+    vreturn = runCase( case )
+  except Exception as e:
+    vreturn = { 'isOk': False, 'msg': str( e ) }
+  queue.put( vreturn )
+
+def runCaseProcess(case):
+  # Process not daemonic, the case can create the pool of tiles('workers' > 1)
+  queue = multiprocessing.Queue()
+  process = multiprocessing.Process( target=_runCaseTarget, args=( case, queue ) )
+  process.start()
+  vreturn = None
+  while vreturn is None:
+    try:
+      vreturn = queue.get( timeout=1 )
+    except Queue.Empty:
+      if not process.is_alive() and queue.empty():
+        vreturn = { 'isOk': False, 'msg': "Process of case finished with exit code %s" % process.exitcode }
+  process.join()
+  return vreturn
+
+def getCases(args):
+  def split(value):
+    return filter( lambda v: v != '', value.split(',') )
+
+  params = ( split( args.sizes ), split( args.datatypes ), split( args.bands ), split( args.layouts ), split( args.algorithms ), ( False, True ) )
+  valids = ( fixture_sizes, fixture_datatypes, None, fixture_layouts, benchmark_algorithms, None )
+  for i in xrange( len( params ) ):
+    if valids[ i ] is None:
+      continue
+    for v in params[ i ]:
+      if not v in valids[ i ]:
+        return { 'isOk': False, 'msg': "Value '%s' not valid. Valids values: %s" % ( v, " or ".join( valids[ i ].keys() ) ) }
+  for v in params[2]:
+    if not v.isdigit() or int( v ) < 2:
+      return { 'isOk': False, 'msg': "Total of bands '%s' need be greater than 1" % v }
+
+  cases = []
+  for ( size, datatype, bands, layout, algorithm, isSubset ) in itertools.product( *params ):
+    cases.append( {
+      'size': size, 'datatype': datatype, 'bands': int( bands ), 'layout': layout,
+      'algorithm': algorithm, 'subset': isSubset, 'engine': args.engine, 'workers': args.workers
+    } )
+  return { 'isOk': True, 'cases': cases }
+
+def getKey(result):
+  keys = ( 'size', 'datatype', 'bands', 'layout', 'algorithm', 'subset', 'engine', 'workers' )
+  return tuple( result[ k ] for k in keys )
+
+def getCommit():
+  # Commit of source code, None if not is a repository of git
+  dirCode = os.path.dirname( os.path.abspath( __file__ ) )
+  try:
+    commit = subprocess.check_output( [ 'git', 'rev-parse', '--short', 'HEAD' ], cwd=dirCode, stderr=subprocess.STDOUT )
+  except ( OSError, subprocess.CalledProcessError ):
+    return None
+  return commit.strip()
+
+def run(cases, args):
+  def printResult(result, baseline):
+    subset = "subset" if result['subset'] else "full"
+    d = ( result['size'], result['datatype'], result['bands'], result['layout'], result['algorithm'], subset )
+    title = "%-7s %-8s %2db %-16s %-10s %-7s" % d
+    if not result['isOk']:
+      print "%s Error: %s" % ( title, result['msg'] )
+      return
+    d = ( title, result['seconds'], result['pixelsPerSecond'], result['peakRSS'] / 1024.0 )
+    line = "%s %9.3f s %14.0f pixels/s %9.1f MB" % d
+    if not baseline is None and baseline.get( 'isOk' ) and result['seconds'] > 0:
+      line = "%s %6.2fx" % ( line, baseline['seconds'] / result['seconds'] )
+    print line
+
+  baselines = {}
+  if not args.compare is None:
+    with open( args.compare ) as f:
+      for result in json.load( f )['results']:
+        baselines[ getKey( result ) ] = result
+
+  dirOut = os.path.abspath( os.path.join( args.dirFixtures, 'out' ) )
+  if not os.path.exists( dirOut ):
+    os.makedirs( dirOut )
+  results = []
+  for case in cases:
+    filename = createFixture( args.dirFixtures, case['size'], case['datatype'], case['bands'], case['layout'] )
+    task = {
+      'filename': os.path.abspath( filename ), 'dirOut': dirOut, 'cacheMax': args.cacheMax * 1048576,
+      'wkt': getWktSubset( case['size'] ) if case['subset'] else None,
+      'algorithm': benchmark_algorithms[ case['algorithm'] ],
+      'options': { 'engine': case['engine'], 'workers': case['workers'] }
+    }
+    # Best of repeats
+    result = None
+    for i in xrange( args.repeat ):
+      vreturn = runCaseProcess( task )
+      if not vreturn['isOk']:
+        result = vreturn
+        break
+      if result is None or vreturn['seconds'] < result['seconds']:
+        result = vreturn
+    case.update( result )
+    if result['isOk']:
+      case['pixelsPerSecond'] = result['pixels'] / result['seconds'] if result['seconds'] > 0 else 0.0
+    printResult( case, baselines.get( getKey( case ) ) )
+    results.append( case )
+
+  data = {
+    'commit': getCommit(), 'date': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    'host': platform.node(), 'cpus': multiprocessing.cpu_count(),
+    'python': platform.python_version(), 'gdal': gdal.__version__, 'numpy': np.__version__,
+    'repeat': args.repeat, 'results': results
+  }
+  with open( args.results, 'w' ) as f:
+    json.dump( data, f, indent=1 )
+  print "Results in '%s'" % args.results
+  return 0 if all( map( lambda r: r['isOk'], results ) ) else 1
+
+def main():
+  d = "Benchmark of image processing with synthetic images(created in fixtures directory)."
+  parser = argparse.ArgumentParser(description=d )
+  d = "File for results(JSON)"
+  parser.add_argument('results', metavar='results', type=str, help=d )
+  d = "Directory of synthetic images (default 'benchmark_fixtures')"
+  parser.add_argument('-f', metavar='dir_fixtures', dest='dirFixtures', type=str, default='benchmark_fixtures', help=d)
+  d = "Sizes: %s (default 'small')" % ",".join( sorted( fixture_sizes.keys() ) )
+  parser.add_argument('-s', metavar='sizes', dest='sizes', type=str, default='small', help=d)
+  d = "Data types: %s (default all)" % ",".join( sorted( fixture_datatypes.keys() ) )
+  parser.add_argument('-d', metavar='datatypes', dest='datatypes', type=str, default=",".join( sorted( fixture_datatypes.keys() ) ), help=d)
+  d = "Total of bands of images (default '4')"
+  parser.add_argument('-b', metavar='bands', dest='bands', type=str, default='4', help=d)
+  d = "Layouts: %s (default all)" % ",".join( sorted( fixture_layouts.keys() ) )
+  parser.add_argument('-l', metavar='layouts', dest='layouts', type=str, default=",".join( sorted( fixture_layouts.keys() ) ), help=d)
+  d = "Algorithms: %s (default all)" % ",".join( sorted( benchmark_algorithms.keys() ) )
+  parser.add_argument('-a', metavar='algorithms', dest='algorithms', type=str, default=",".join( sorted( benchmark_algorithms.keys() ) ), help=d)
+  d = "Engine of processing: %s (default '%s')" % ( " or ".join( ProcessingImage.engines ), ProcessingImage.defaultOptions['engine'] )
+  parser.add_argument('-e', metavar='engine', dest='engine', type=str, default=ProcessingImage.defaultOptions['engine'], help=d)
+  d = "Total of processes for tiles (default %d)" % ProcessingImage.defaultOptions['workers']
+  parser.add_argument('-p', metavar='workers', dest='workers', type=int, default=ProcessingImage.defaultOptions['workers'], help=d)
+  d = "Repeat of each case, the best time is used (default 3)"
+  parser.add_argument('-n', metavar='repeat', dest='repeat', type=int, default=3, help=d)
+  d = "Cache of GDAL in MB (default 64)"
+  parser.add_argument('-m', metavar='cache_max', dest='cacheMax', type=int, default=64, help=d)
+  d = "File of results(JSON) for comparing, print the speedup"
+  parser.add_argument('-c', metavar='compare', dest='compare', type=str, help=d)
+
+  args = parser.parse_args()
+  if not args.engine in ProcessingImage.engines:
+    print "Engine '%s' not valid. Valids engines: %s" % ( args.engine, " or ".join( ProcessingImage.engines ) )
+    return 1
+  if args.workers < 1 or args.repeat < 1:
+    print "Total of workers and repeat need be greater than 0"
+    return 1
+  if not args.compare is None and not os.path.exists( args.compare ):
+    print "Not found '%s'" % args.compare
+    return 1
+  vreturn = getCases( args )
+  if not vreturn['isOk']:
+    print vreturn['msg']
+    return 1
+  if not os.path.exists( args.dirFixtures ):
+    os.makedirs( args.dirFixtures )
+
+  return run( vreturn['cases'], args )
+
+if __name__ == "__main__":
+    sys.exit( main() )
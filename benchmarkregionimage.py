@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+Name                 : Benchmark region image
+Description          : Cost by call of RegionImage.getSubset, without cache
+                       (SRS, transformations and footprint by call) and with cache
+Arguments            : Total of calls
+
+                       -------------------
+begin                : 2016-08-11
+copyright            : (C) 2016 by Luiz Motta
+email                : motta dot luiz at gmail.com
+
+ ***************************************************************************/
+"""
+
+import sys, argparse, datetime, random
+
+from osgeo import gdal, osr
+
+from processingimage import RegionImage
+
+def createDataset():
+  # Image in memory with UTM(EPSG 32722), 10000 x 10000 pixels of 5 meters
+  ds = gdal.GetDriverByName('MEM').Create( '', 10000, 10000, 1, gdal.GDT_Byte )
+  sr = osr.SpatialReference()
+  sr.ImportFromEPSG( 32722 )
+  ds.SetProjection( sr.ExportToWkt() )
+  ds.SetGeoTransform( ( 500000.0, 5.0, 0.0, 8400000.0, 0.0, -5.0 ) )
+  return ds
+
+def getWkts(total):
+  # Squares in EPSG 4326 inside of image(center about -51.0, -14.5)
+  random.seed( 1 )
+  wkts = []
+  for i in xrange( total ):
+    x, y, side = random.uniform( -50.99, -50.60 ), random.uniform( -14.88, -14.50 ), random.uniform( 0.001, 0.05 )
+    coords = [ ( x, y ), ( x + side, y ), ( x + side, y - side ), ( x, y - side ), ( x, y ) ]
+    wkts.append( "POLYGON (( %s ))" % ','.join( map( lambda c: "%f %f" % c, coords ) ) )
+  return wkts
+
+def runSubsets(ds, wkts, useCache):
+  # Without cache: new RegionImage by call(as one subset by job)
+  RegionImage.useCache = useCache
+  RegionImage.srsCache.clear()
+  RegionImage.transformCache.clear()
+  ri = RegionImage( ds )
+  t1 = datetime.datetime.now()
+  errors = 0
+  for wkt in wkts:
+    if not useCache:
+      ri = RegionImage( ds )
+    vreturn = ri.getSubset( wkt )
+    if not vreturn['isOk']:
+      errors += 1
+  seconds = ( datetime.datetime.now() - t1 ).total_seconds()
+  return { 'seconds': seconds, 'errors': errors }
+
+def main():
+  d = "Benchmark of RegionImage.getSubset without and with cache of SRS, transformations and footprint."
+  parser = argparse.ArgumentParser(description=d )
+  d = "Total of calls (default 5000)"
+  parser.add_argument('-n', metavar='total', dest='total', type=int, default=5000, help=d)
+  args = parser.parse_args()
+  if args.total < 1:
+    print "Total of calls '%d' need be greater than 0" % args.total
+    return 1
+
+  ds = createDataset()
+  wkts = getWkts( args.total )
+  results = {}
+  for ( name, useCache ) in ( ( 'without', False ), ( 'with', True ) ):
+    results[ name ] = runSubsets( ds, wkts, useCache )
+    d = ( name, results[ name ]['seconds'], 1000000.0 * results[ name ]['seconds'] / args.total, results[ name ]['errors'] )
+    print "%-8s cache %9.3f s %10.1f us/call (errors %d)" % d
+  RegionImage.useCache = True
+  if results['with']['seconds'] > 0:
+    print "Speedup: %.2f" % ( results['without']['seconds'] / results['with']['seconds'] )
+  return 0
+
+if __name__ == "__main__":
+    sys.exit( main() )
@@ -4,7 +4,7 @@
 /***************************************************************************
 Name                 : Processing image framework
 Description          : Processing image framework
-Arguments            : Georeferencing Image local or Planet Labs
+Arguments            : Georeferencing Image local, remote(HTTP) or Planet Labs
 
                        -------------------
 begin                : 2016-08-11
@@ -14,9 +14,9 @@ email                : motta dot luiz at gmail.com
  ***************************************************************************/
 """
 
-import os, sys, argparse, datetime
+import os, sys, argparse, datetime, json, signal
 
-from processingimage import RegionImage, CollectionAlgorithms, LocalImage, PLScene
+from processingimage import RegionImage, CollectionAlgorithms, ProcessingImage, LocalImage, RemoteImage, PLScene
 
 def setPLScene(name_image):
   PLScene.isKilled = False
@@ -35,7 +35,98 @@ def setLocal(name_image):
   idWorker = 1
   return ( LocalImage( idWorker ), image )
 
-def run(processing_type, name_image, name_algorithm, band_numbers, wkt):
+def setRemote(name_image):
+  RemoteImage.isKilled = False
+  image = {
+    'name': name_image
+  }
+  idWorker = 1
+  return ( RemoteImage( idWorker ), image )
+
+def addArgumentsOutput(parser):
+  # Creation options of output image
+  o_d = ProcessingImage.defaultOptions
+  d = "Compress of output: %s (default not compress)" % " or ".join( ProcessingImage.compressions )
+  parser.add_argument('-c', metavar='compress', dest='compress', type=str, help=d)
+  d = "Predictor for compress (default 3 for float and 2 for integer output)"
+  parser.add_argument('--predictor', metavar='predictor', dest='predictor', type=int, help=d)
+  d = "Tiled output"
+  parser.add_argument('-t', dest='tiled', action='store_true', help=d)
+  d = "Size of block for tiled output and COG (default %d)" % o_d['blockSize']
+  parser.add_argument('-b', metavar='block_size', dest='blockSize', type=int, default=o_d['blockSize'], help=d)
+  d = "BIGTIFF of output: %s" % " or ".join( ProcessingImage.bigtiffs )
+  parser.add_argument('--bigtiff', metavar='bigtiff', dest='bigtiff', type=str, help=d)
+  d = "Number of threads for compress(number or ALL_CPUS)"
+  parser.add_argument('--threads', metavar='threads', dest='compressThreads', type=str, help=d)
+  d = "Cloud Optimized GeoTIFF output with overviews"
+  parser.add_argument('--cog', dest='cog', action='store_true', help=d)
+  d = "Creation option of output(NAME=VALUE), can be repeated"
+  parser.add_argument('--co', metavar='option', dest='creationOptions', action='append', default=[], help=d)
+
+def getOptionsOutput(args):
+  # Return None if options not valid
+  if not args.compress is None and not args.compress in ProcessingImage.compressions:
+    print "Compress '%s' not valid. Valids compress: %s" % ( args.compress, " or ".join( ProcessingImage.compressions ) )
+    return None
+  if not args.bigtiff is None and not args.bigtiff in ProcessingImage.bigtiffs:
+    print "BIGTIFF '%s' not valid. Valids values: %s" % ( args.bigtiff, " or ".join( ProcessingImage.bigtiffs ) )
+    return None
+  if args.blockSize < 16 or not args.blockSize % 16 == 0:
+    print "Block size '%d' need be multiple of 16" % args.blockSize
+    return None
+  keys = ( 'compress', 'predictor', 'tiled', 'blockSize', 'bigtiff', 'compressThreads', 'cog', 'creationOptions' )
+  return dict( ( k, getattr( args, k ) ) for k in keys )
+
+def addArgumentsCache(parser):
+  # Cache of blocks of source image
+  o_d = ProcessingImage.defaultOptions
+  d = "Directory of cache of blocks of bands(shared by runs and processes), only for 'array' engine"
+  parser.add_argument('--cache', metavar='dir_cache', dest='tileCache', type=str, help=d)
+  d = "Max size of cache in MB (default %d)" % o_d['tileCacheSize']
+  parser.add_argument('--cache-size', metavar='size', dest='tileCacheSize', type=int, default=o_d['tileCacheSize'], help=d)
+  d = "Directory of cache of outputs, runs with same inputs and parameters restore the outputs (not for regions)"
+  parser.add_argument('--result-cache', metavar='dir_cache', dest='resultCache', type=str, help=d)
+  d = "Max size of cache of outputs in MB (default %d)" % o_d['resultCacheSize']
+  parser.add_argument('--result-cache-size', metavar='size', dest='resultCacheSize', type=int, default=o_d['resultCacheSize'], help=d)
+
+def getOptionsCache(args):
+  # Return None if options not valid
+  if args.tileCacheSize < 1:
+    print "Size of tile cache '%d' need be greater than 0" % args.tileCacheSize
+    return None
+  if args.resultCacheSize < 1:
+    print "Size of result cache '%d' need be greater than 0" % args.resultCacheSize
+    return None
+  keys = ( 'tileCache', 'tileCacheSize', 'resultCache', 'resultCacheSize' )
+  return dict( ( k, getattr( args, k ) ) for k in keys )
+
+def addArgumentsQualityMask(parser, withFile=True):
+  # Bitmask band(ex.: UDM), masked pixels are nodata of outputs
+  if withFile:
+    d = "Image of quality mask(ex.: UDM), masked pixels are nodata (only for 'array' engine)"
+    parser.add_argument('-q', metavar='quality_mask', dest='qualityMask', type=str, help=d)
+  d = "Band of quality mask (default 1)"
+  parser.add_argument('--q-band', metavar='band', dest='qualityMaskBand', type=int, default=1, help=d)
+  d = "Bits of quality mask for masking(ex.: 3 or 0x03), default any bit"
+  parser.add_argument('--q-bits', metavar='bits', dest='qualityMaskBits', type=str, help=d)
+
+def getOptionsQualityMask(args, name):
+  # Return { 'qualityMask': None or { 'name', 'band', 'bits' } }, None if options not valid
+  bits = args.qualityMaskBits
+  if not bits is None:
+    try:
+      bits = int( bits, 0 )
+    except ValueError:
+      print "Bits '%s' of quality mask not valid" % bits
+      return None
+  if args.qualityMaskBand < 1:
+    print "Band '%d' of quality mask need be greater than 0" % args.qualityMaskBand
+    return None
+  if name is None:
+    return { 'qualityMask': None }
+  return { 'qualityMask': { 'name': name, 'band': args.qualityMaskBand, 'bits': bits } }
+
+def run(processing_type, name_image, algorithm, wkt, options):
   def printTime(title, t1=None):
     tn =datetime.datetime.now() 
     st = tn.strftime('%Y-%m-%d %H:%M:%S')
@@ -45,49 +136,140 @@ def run(processing_type, name_image, name_algorithm, band_numbers, wkt):
 
   def runAlgorithm(algorithm):
     t1 = printTime( "Running '%s'" % algorithm['name'] ) 
-    vreturn = imageProcessing.run( algorithm )
+    vreturn = imageProcessing.run( algorithm, options )
     isOk, msg = True, None
     if not vreturn['isOk']:
       msg = vreturn['msg']
       isOk = False
+    elif 'regions' in vreturn:
+      for region in vreturn['regions']:
+        if not region['isOk']:
+          print "Region '%s' Error: %s" % ( region['id'], region['msg'] )
+          continue
+        for filename in region['filenames']:
+          print "Create '%s'" % filename
+      printTime( "Regions %d" % len( vreturn['regions'] ), t1 )
+      printStats( vreturn['stats'] )
     else:
       printTime( "Create '%s'" % vreturn['filename'], t1 )
+      printStats( vreturn['stats'] )
     
     return { 'isOk': isOk, 'msg': msg }
 
-  set_processing = { 'local': setLocal, 'pl': setPLScene }
+  def printProgress(progress):
+    d = ( progress['tiles'], progress['totalTiles'], progress['pixelsPerSecond'], progress['eta'] )
+    sys.stderr.write( "\rTiles %d/%d - Pixels/s: %.0f - ETA: %.0f s " % d )
+    if progress['tiles'] == progress['totalTiles']:
+      sys.stderr.write( "\n" )
+
+  def kill(signum, frame):
+    # Outputs are kept for resume with checkpoint
+    print "Canceling..."
+    imageProcessing.kill()
+
+  def printStats(stats):
+    # Seconds of stages, read/compute/pack are sum of workers when 'workers' > 1
+    keys = ( 'open', 'subset', 'create', 'read', 'compute', 'pack', 'write', 'finish' )
+    print "Seconds: %s" % " ".join( map( lambda k: "%s %.3f" % ( k, stats[ k ] ), keys ) )
+    d = ( stats['bytesRead'] / 1048576.0, stats['bytesWritten'] / 1048576.0, stats['bytesFiles'] / 1048576.0, stats['pixelsPerSecond'] )
+    print "MBytes: read %.1f written %.1f files %.1f - Pixels/s: %.0f" % d
+    if stats['cacheHits'] + stats['cacheMisses'] > 0:
+      print "Tile cache: hits %d misses %d" % ( stats['cacheHits'], stats['cacheMisses'] )
+    if stats['resultCached'] > 0:
+      print "Result cache: outputs restored"
+    if stats['tilesResumed'] > 0:
+      print "Checkpoint: tiles resumed %d" % stats['tilesResumed']
+    if stats['tilesMasked'] > 0:
+      print "Quality mask: tiles masked %d" % stats['tilesMasked']
+    if stats['requests'] > 0:
+      print "Fetch: seconds %.3f requests %d MBytes %.1f" % ( stats['fetch'], stats['requests'], stats['bytesFetched'] / 1048576.0 )
+
+  set_processing = { 'local': setLocal, 'remote': setRemote, 'pl': setPLScene }
   ( imageProcessing, image ) = set_processing[ processing_type ]( name_image )
+  signal.signal( signal.SIGINT, kill )
+  signal.signal( signal.SIGTERM, kill ) # Preemption of node
+  if options['progress']:
+    options['progress'] = printProgress
+  else:
+    options['progress'] = None
 
   printTime( "Setting Dataset '%s'('%s')" % ( image['name'], processing_type ) )
   vreturn = imageProcessing.setImage( image, wkt )
   if not vreturn['isOk']:
     print "Error: %s" % vreturn['msg']
     return
-  vreturn = runAlgorithm( { 'name': name_algorithm, 'bandNumbers': band_numbers } )
+  vreturn = runAlgorithm( algorithm )
   if not vreturn['isOk']:
     print "Error: %s" % vreturn['msg']
     return
 
 def main():
-  processing_types = ( 'local', 'pl' )
+  processing_types = ( 'local', 'remote', 'pl' )
   a_d = CollectionAlgorithms.descriptions
-  d = "Image processing local or server(Planet Labs)."
+  d = "Image processing local, remote(HTTP GeoTIFF) or server(Planet Labs)."
   parser = argparse.ArgumentParser(description=d )
   d = "Type of process: %s" % " or ".join( processing_types )
   parser.add_argument('processing_type', metavar='processing_type', type=str, help=d )
-  d = 'Name of scene(add extension for local)'
+  d = 'Name of scene(add extension for local, URL for remote)'
   parser.add_argument('namescene', metavar='name_scene', type=str, help=d )
   d = "Name of algorithm: %s" % ','.join( a_d.keys() )
   parser.add_argument('algorithm', metavar='algorithm', type=str, help=d )
-  d = "Number of bands(separated by comma and no spaces). Ex.: 1,2"
+  d = "Number of bands(separated by comma and no spaces). Ex.: 1,2. For 'expr', the expression(between double quotes). Ex.: \"(B4-B3)/(B4+B3+0.5)*1.5\""
   parser.add_argument('bands', metavar='bands', type=str, help=d )
   d = "WKT(between double quotes) for region. Use EPSG 4326 for SRS" 
   parser.add_argument('-w', metavar='WKT_Region', dest='wkt4326', type=str, help=d)
+  d = "Engine of processing: %s (default '%s', 'scalar' is pixel by pixel for verification)" % ( " or ".join( ProcessingImage.engines ), ProcessingImage.defaultOptions['engine'] )
+  parser.add_argument('-e', metavar='engine', dest='engine', type=str, default=ProcessingImage.defaultOptions['engine'], help=d)
+  d = "Read mode for 'array' engine: %s (default '%s')" % ( " or ".join( ProcessingImage.readModes ), ProcessingImage.defaultOptions['read'] )
+  parser.add_argument('-r', metavar='read_mode', dest='read', type=str, default=ProcessingImage.defaultOptions['read'], help=d)
+  d = "Total of processes for tiles, only for 'array' engine (default %d)" % ProcessingImage.defaultOptions['workers']
+  parser.add_argument('-p', metavar='workers', dest='workers', type=int, default=ProcessingImage.defaultOptions['workers'], help=d)
+  d = "Data type of output for 'expr'(Byte, UInt16, Int16, UInt32, Int32, Float32, Float64), default infered from expression"
+  parser.add_argument('-d', metavar='datatype', dest='datatype', type=str, help=d)
+  d = "No data of output for 'expr', default infered from data type"
+  parser.add_argument('-n', metavar='nodata', dest='nodata', type=float, help=d)
+  d = "GeoJSON(FeatureCollection, EPSG 4326) of regions, one output by feature with one read of image (only for 'array' engine)"
+  parser.add_argument('-g', metavar='regions', dest='regions', type=str, help=d)
+  d = "Pixels outside of WKT region are nodata, not read and not calculated (only for 'array' engine)"
+  parser.add_argument('-m', dest='cutline', action='store_true', help=d)
+  d = "Total of parallel range requests for remote image (default %d)" % ProcessingImage.defaultOptions['fetchWorkers']
+  parser.add_argument('-f', metavar='fetch_workers', dest='fetchWorkers', type=int, default=ProcessingImage.defaultOptions['fetchWorkers'], help=d)
+  d = "File for append the statistics of running (JSON lines)"
+  parser.add_argument('-s', metavar='stats_file', dest='statsFile', type=str, help=d)
+  d = "Factor of reduction of resolution(ex.: 4 is 1/4), read from overviews if exists (default 1)"
+  parser.add_argument('--reduction', metavar='factor', dest='reduction', type=int, default=ProcessingImage.defaultOptions['reduction'], help=d)
+  d = "Tiles in queues of threads of read and write, overlap with calculation, 0 is sequential (only for 'array' engine, default 0)"
+  parser.add_argument('--pipeline', metavar='depth', dest='pipeline', type=int, default=ProcessingImage.defaultOptions['pipeline'], help=d)
+  d = "Record tiles written, a run canceled(Ctrl+C or SIGTERM) is resumed with same parameters (only for 'array' engine)"
+  parser.add_argument('--checkpoint', dest='checkpoint', action='store_true', help=d)
+  d = "Show progress of tiles, pixels/s and ETA"
+  parser.add_argument('--progress', dest='progress', action='store_true', help=d)
+  addArgumentsOutput( parser )
+  addArgumentsCache( parser )
+  addArgumentsQualityMask( parser )
 
   args = parser.parse_args()
   if not args.processing_type in processing_types:
     print "Type of processing '%s' not valid. Valids types: %s" % ( args.processing_type, " or ".join( processing_types ) )
     return 1
+  if not args.engine in ProcessingImage.engines:
+    print "Engine '%s' not valid. Valids engines: %s" % ( args.engine, " or ".join( ProcessingImage.engines ) )
+    return 1
+  if args.reduction < 1:
+    print "Reduction '%d' need be greater than 0" % args.reduction
+    return 1
+  if args.pipeline < 0:
+    print "Pipeline '%d' need be greater or equal than 0" % args.pipeline
+    return 1
+  if not args.read in ProcessingImage.readModes:
+    print "Read mode '%s' not valid. Valids modes: %s" % ( args.read, " or ".join( ProcessingImage.readModes ) )
+    return 1
+  if args.workers < 1:
+    print "Total of workers '%d' need be greater than 0" % args.workers
+    return 1
+  if args.fetchWorkers < 1:
+    print "Total of workers for fetch '%d' need be greater than 0" % args.fetchWorkers
+    return 1
   if not args.algorithm in a_d.keys():
     print "Type of algorithm '%s' not valid." % args.algorithm 
     descs = []
@@ -96,25 +278,50 @@ def main():
       descs.append( desc )
     print  'Valids types:\n'.join(descs)
     return 1
-  values = args.bands.split(',')
-  for i in xrange( len( values ) ):
-    if not values[ i ].isdigit():
-      print "Band '%s' is not a number." % values[ i ]
-      return 1
-  band_numbers = map( lambda s: int(s), values )
-  
-  t1 = len( band_numbers )
-  t2 = a_d[args.algorithm]['bandsRead']
-  if not t1 == t2:
-    msg = "Total of bands '%d' is different of permited by algorithm '%s' '%d'." % ( t1, args.algorithm, t2 )
-    print msg
+  if args.algorithm == 'expr':
+    algorithm = { 'name': 'expr', 'expression': args.bands, 'datatype': args.datatype, 'nodata': args.nodata }
+  else:
+    values = args.bands.split(',')
+    for i in xrange( len( values ) ):
+      if not values[ i ].isdigit():
+        print "Band '%s' is not a number." % values[ i ]
+        return 1
+    band_numbers = map( lambda s: int(s), values )
+    algorithm = { 'name': args.algorithm, 'bandNumbers': band_numbers }
+  # Total of bands(from expression for 'expr')
+  vreturn = CollectionAlgorithms().checkAlgorithm( algorithm )
+  if not vreturn['isOk']:
+    print vreturn['msg']
     return 1
       
   if not args.wkt4326 is None and not RegionImage.isValidGeom( args.wkt4326 ): 
     print "The WKT '%s' not valid." % args.wkt4326
     return 1
+  regions = None
+  if not args.regions is None:
+    if not args.wkt4326 is None:
+      print "Use WKT or regions, not both"
+      return 1
+    try:
+      with open( args.regions ) as f:
+        regions = json.load( f )
+    except ( IOError, ValueError ) as e:
+      print "Reading regions '%s': %s" % ( args.regions, str( e ) )
+      return 1
 
-  return run( args.processing_type, args.namescene, args.algorithm, band_numbers, args.wkt4326 )
+  options = getOptionsOutput( args )
+  if options is None:
+    return 1
+  optionsCache = getOptionsCache( args )
+  if optionsCache is None:
+    return 1
+  options.update( optionsCache )
+  optionsQualityMask = getOptionsQualityMask( args, args.qualityMask )
+  if optionsQualityMask is None:
+    return 1
+  options.update( optionsQualityMask )
+  options.update( { 'engine': args.engine, 'read': args.read, 'workers': args.workers, 'reduction': args.reduction, 'pipeline': args.pipeline, 'checkpoint': args.checkpoint, 'progress': args.progress, 'fetchWorkers': args.fetchWorkers, 'statsFile': args.statsFile, 'cutline': args.cutline, 'regions': regions } )
+  return run( args.processing_type, args.namescene, algorithm, args.wkt4326, options )
 
 if __name__ == "__main__":
     sys.exit( main() )
@@ -4,7 +4,7 @@
 /***************************************************************************
 Name                 : Cut GeoJsons
 Description          : Cut Geojsons with mold(other Geojson)
-Arguments            : List of geoJsons an mold
+Arguments            : Molds(geoJson or file) and features(file or standard input)
 
                        -------------------
 begin                : 2016-08-28
@@ -14,61 +14,94 @@ email                : motta dot luiz at gmail.com
  ***************************************************************************/
 """
 
-import sys, argparse, json
+import os, sys, argparse, json, StringIO
 
-from osgeo import gdal, ogr
+from osgeo import gdal
 gdal.UseExceptions()
 gdal.PushErrorHandler('CPLQuietErrorHandler')
 
-def run(geojsons, geojson_mold):
-  def getGeom(geojson):
-    geom = ogr.CreateGeometryFromJson( geojson )
-    if geom is None:
-      msg = gdal.GetLastErrorMsg()
-      return { 'isOk': False, 'msg': msg }
-    return { 'isOk': True, 'geom': geom }
-  
-  def cutGeometry(geojson):
-    vreturn = getGeom( geojson )
-    if not vreturn['isOk']:
-      return vreturn
-    geom = vreturn['geom']
-    geomInter = geom_mold.Intersection( geom )
-    geom.Destroy()
-    geojsonInter = json.loads( geomInter.ExportToJson() )
-    geomInter.Destroy()
-    return { 'isOk': True, 'geojson': geojsonInter }
+from footprintindex import FootprintIndex
+from geojsonstream import openInput, openOutput, readFeatures, FeatureWriter
 
-  vreturn = getGeom( geojson_mold )
+crs84 = { "type": "name", "properties": { "name": "urn:ogc:def:crs:OGC:1.3:CRS84" } }
+
+def run(molds, filenameIn, filenameOut, isCollection):
+  # Molds are indexed, the features are read, cutted and writed one by one
+  # Feature that intersect many molds is writed for each mold('mold_id' in properties)
+  def printError(msg):
+    sys.stderr.write( "%s\n" % json.dumps( { 'isOk': 0, 'msg': msg } ) )
+
+  def getMolds():
+    # molds: GeoJSON(Geometry, Feature or FeatureCollection) or file
+    try:
+      if os.path.exists( molds ):
+        with open( molds ) as f:
+          features = list( readFeatures( f ) )
+      else:
+        features = list( readFeatures( StringIO.StringIO( molds ) ) )
+    except ValueError as e:
+      return { 'isOk': False, 'msg': "Geojson Mold: %s" % str( e ) }
+    if len( features ) == 0:
+      return { 'isOk': False, 'msg': "Geojson Mold: without geometry" }
+    return { 'isOk': True, 'features': features }
+
+  vreturn = getMolds()
   if not vreturn['isOk']:
-    msg = "Geojson Mold: %s" % vreturn['msg']
-    print '{ "isOk": 0, "msg": "%s" }' % msg
+    printError( vreturn['msg'] )
+    return 1
+  features = vreturn['features']
+  index = FootprintIndex( features )
+  if len( index.errors ) > 0:
+    printError( "Geojson Mold: %s" % index.errors[0][1] )
+    return 1
+  ids = [ f.get( 'id', ( f.get( 'properties' ) or {} ).get( 'id', i + 1 ) ) for ( i, f ) in enumerate( features ) ]
+
+  fileIn, fileOut = openInput( filenameIn ), openOutput( filenameOut )
+  writer = FeatureWriter( fileOut, isCollection, crs84 )
+  total, msg = 0, None
+  try:
+    for feature in readFeatures( fileIn ):
+      total += 1
+      geom = FootprintIndex.toOgr( feature.get( 'geometry' ) or {} )
+      if geom is None:
+        msg = "Geojson item '%d': geometry not valid" % total
+        break
+      for i in index.query( geom ):
+        featureCut = feature.copy()
+        featureCut['geometry'] = index.getIntersection( i, geom )
+        if len( features ) > 1:
+          featureCut['properties'] = dict( feature.get( 'properties' ) or {}, mold_id=ids[ i ] )
+        writer.write( featureCut )
+      geom.Destroy()
+  except ValueError as e:
+    msg = "Geojson item '%d': %s" % ( total + 1, str( e ) )
+  writer.close()
+  if not filenameIn in ( None, '-' ):
+    fileIn.close()
+  if not filenameOut in ( None, '-' ):
+    fileOut.close()
+  if not msg is None:
+    printError( msg )
     return 1
-  geom_mold = vreturn['geom']
-  
-  geoms_json = json.loads( geojsons )
-  for id in xrange( len( geoms_json ) ):
-    vreturn = cutGeometry( json.dumps( geoms_json[id]["geometry"] ) )
-    if not vreturn['isOk']:
-      msg = "Geojson item '%d': %s" % ( id+1, vreturn['msg'] )
-      print '{ "isOk": 0, "msg": "%s" }' % msg
-      return 1
-    geoms_json[id]["geometry"] = vreturn['geojson']
-  
-  geom_mold.Destroy()
-  print '{ "isOk": 1, "geojsons": %s }' % json.dumps( geoms_json )
   return 0
 
 def main():
-  d = 'Print List Geojsons with cut from mold({ "isOk": 1, "geojsons": "geojsons"}).'
+  d = "Cut features(newline-delimited GeoJSON or FeatureCollection) with molds, write the features that intersect(newline-delimited GeoJSON)."
   parser = argparse.ArgumentParser(description=d )
-  d = "List of Geojsons"
-  parser.add_argument('geojsons', metavar='geojsons', type=str, help=d )
-  d = "Geojson(mold)"
-  parser.add_argument('geojson_mold', metavar='geojson_mold', type=str, help=d )
+  d = "Geojson(mold): Geometry, Feature or FeatureCollection(many molds), or file"
+  parser.add_argument('molds', metavar='molds', type=str, help=d )
+  d = "File of features, default is standard input"
+  parser.add_argument('-i', metavar='input', dest='input', type=str, help=d)
+  d = "File of cutted features, default is standard output"
+  parser.add_argument('-o', metavar='output', dest='output', type=str, help=d)
+  d = "Write FeatureCollection(CRS84) instead of newline-delimited"
+  parser.add_argument('-f', dest='isCollection', action='store_true', help=d)
 
   args = parser.parse_args()
-  return run( args.geojsons, args.geojson_mold )
+  if not args.input in ( None, '-' ) and not os.path.exists( args.input ):
+    sys.stderr.write( "%s\n" % json.dumps( { 'isOk': 0, 'msg': "Not found '%s'" % args.input } ) )
+    return 1
+  return run( args.molds, args.input, args.output, args.isCollection )
 
 if __name__ == "__main__":
     sys.exit( main() )
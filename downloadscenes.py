@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+Name                 : Download scenes
+Description          : Download assets(udm and analytic) of scenes of Planet Labs
+                       with limit of downloads, activation of assets, resume of
+                       partial files and state of download
+Arguments            : GeoJSON of scenes(from pl_get_geojson_scenes.sh)
+
+                       -------------------
+begin                : 2016-08-11
+copyright            : (C) 2016 by Luiz Motta
+email                : motta dot luiz at gmail.com
+
+ ***************************************************************************/
+"""
+
+import os, sys, argparse, json, time, threading, Queue, httplib, urlparse, socket, base64, hashlib, re
+
+from geojsonstream import openInput, readFeatures
+
+pl1_catalog = "https://api.planet.com/v1/catalogs/grid-utm-25km/items/"
+
+class HttpClient():
+  # Connections are kept by host(keep-alive), one client by thread
+  sizeChunk = 1048576
+
+  def __init__(self, apiKey, timeout):
+    self.timeout = timeout
+    self.headers = {}
+    if not apiKey is None:
+      self.headers['Authorization'] = "Basic %s" % base64.b64encode( "%s:" % apiKey )
+    self.connections = {}
+
+  def close(self):
+    for conn in self.connections.values():
+      conn.close()
+    self.connections.clear()
+
+  def _getConnection(self, url):
+    u = urlparse.urlsplit( url )
+    key = ( u.scheme, u.netloc )
+    if not key in self.connections:
+      http = httplib.HTTPSConnection if u.scheme == 'https' else httplib.HTTPConnection
+      self.connections[ key ] = http( u.netloc, timeout=self.timeout )
+    path = u.path if u.query == '' else "%s?%s" % ( u.path, u.query )
+    return ( key, self.connections[ key ], path )
+
+  def request(self, method, url, headers=None, maxRedirects=5):
+    # Return { 'isOk', 'status', 'response' } or { 'isOk', 'msg' }, follow redirections
+    # The response need be read for reusing the connection
+    h = self.headers.copy()
+    if not headers is None:
+      h.update( headers )
+    for i in xrange( maxRedirects + 1 ):
+      response, msg = None, None
+      for retry in ( 1, 2 ): # Connection closed by server(keep-alive)
+        ( key, conn, path ) = self._getConnection( url )
+        try:
+          conn.request( method, path, headers=h )
+          response = conn.getresponse()
+          break
+        except ( httplib.HTTPException, socket.error ) as e:
+          conn.close()
+          del self.connections[ key ]
+          msg = "%s %s: %s" % ( method, url, str( e ) )
+      if response is None:
+        return { 'isOk': False, 'msg': msg }
+      if not response.status in ( 301, 302, 303, 307, 308 ):
+        return { 'isOk': True, 'status': response.status, 'response': response }
+      location = response.getheader( 'location' )
+      response.read()
+      url = urlparse.urljoin( url, location )
+      if response.status == 303:
+        method = 'GET'
+      if urlparse.urlsplit( url ).netloc != key[1]:
+        h.pop( 'Authorization', None ) # Credentials only for catalog
+    return { 'isOk': False, 'msg': "%s %s: many redirections" % ( method, url ) }
+
+  def getJson(self, url, method='GET'):
+    vreturn = self.request( method, url )
+    if not vreturn['isOk']:
+      return vreturn
+    data = vreturn['response'].read()
+    if not vreturn['status'] in ( 200, 201, 202, 204 ):
+      return { 'isOk': False, 'msg': "%s %s: status %d" % ( method, url, vreturn['status'] ) }
+    try:
+      value = json.loads( data ) if data.strip() != '' else None
+    except ValueError:
+      return { 'isOk': False, 'msg': "%s %s: response is not JSON" % ( method, url ) }
+    return { 'isOk': True, 'json': value }
+
+  def download(self, url, filename, size=None, md5=None):
+    # Partial file(filename.part) is resumed with Range
+    # size and md5 of asset are verified, if exists
+    def getHash(filenamePart):
+      h = hashlib.md5()
+      with open( filenamePart, 'rb' ) as f:
+        for data in iter( lambda: f.read( self.sizeChunk ), '' ):
+          h.update( data )
+      return h.hexdigest()
+
+    filenamePart = "%s.part" % filename
+    offset = os.path.getsize( filenamePart ) if os.path.exists( filenamePart ) else 0
+    headers = {}
+    if offset > 0:
+      headers['Range'] = "bytes=%d-" % offset
+    vreturn = self.request( 'GET', url, headers )
+    if not vreturn['isOk']:
+      return vreturn
+    response, status = vreturn['response'], vreturn['status']
+    if status == 416: # Range not satisfiable, the partial file is complete or wrong
+      response.read()
+      if not size is None and offset == size:
+        status = None
+      else:
+        os.remove( filenamePart )
+        return self.download( url, filename, size, md5 )
+    elif status == 200: # Server not accept Range
+      offset = 0
+    elif not status == 206:
+      response.read()
+      return { 'isOk': False, 'msg': "GET %s: status %d" % ( url, status ) }
+    bytesRead = 0
+    if not status is None:
+      total = response.getheader( 'content-length' )
+      total = None if total is None else int( total ) + offset
+      if size is None:
+        size = total
+      try:
+        with open( filenamePart, 'ab' if offset > 0 else 'wb' ) as f:
+          for data in iter( lambda: response.read( self.sizeChunk ), '' ):
+            f.write( data )
+            bytesRead += len( data )
+      except ( httplib.HTTPException, socket.error ) as e:
+        return { 'isOk': False, 'msg': "GET %s: %s(partial file is kept)" % ( url, str( e ) ) }
+    sizePart = os.path.getsize( filenamePart )
+    if not size is None and not sizePart == size:
+      return { 'isOk': False, 'msg': "Size of '%s' is %d, expected %d(partial file is kept)" % ( filename, sizePart, size ) }
+    if not md5 is None and not getHash( filenamePart ) == md5:
+      os.remove( filenamePart )
+      return { 'isOk': False, 'msg': "MD5 of '%s' not valid" % filename }
+    os.rename( filenamePart, filename )
+    return { 'isOk': True, 'size': sizePart, 'bytesRead': bytesRead, 'resumed': offset > 0 }
+
+class DownloadState():
+  # State of assets: { 'scene_id': { 'asset': { 'status', 'filename', 'size', 'msg' } } }
+  # For region, the key of asset is '<asset>_geom<geom_id>' and filename is the region
+  # Saved after each change(temporary file and rename), 'done' assets are not downloaded again
+  def __init__(self, filename):
+    self.filename = filename
+    self.lock = threading.Lock()
+    self.scenes = {}
+    if os.path.exists( filename ):
+      with open( filename ) as f:
+        self.scenes = json.load( f )
+
+  def isDone(self, scene, asset):
+    with self.lock:
+      value = self.scenes.get( scene, {} ).get( asset )
+    if value is None or not value['status'] == 'done':
+      return False
+    return os.path.exists( value['filename'] ) and os.path.getsize( value['filename'] ) == value['size']
+
+  def set(self, scene, asset, value):
+    with self.lock:
+      self.scenes.setdefault( scene, {} )[ asset ] = value
+      filenameWork = "%s.tmp" % self.filename
+      with open( filenameWork, 'w' ) as f:
+        json.dump( self.scenes, f, indent=1 )
+      os.rename( filenameWork, self.filename )
+
+def downloadScene(client, task, state, options):
+  # task: { 'scene', 'geometry'(for region) }
+  # Return { 'isOk', 'msg', 'assets': [ ... ] }
+  def getAssets():
+    return client.getJson( "%s%s/assets/" % ( options['catalog'], scene ) )
+
+  def getHttp(assets, asset):
+    return assets[ asset ]['files']['http']
+
+  def activate(assets, asset):
+    # Activate and poll until 'active', return assets
+    http = getHttp( assets, asset )
+    if http.get( 'status', 'active' ) == 'active':
+      return { 'isOk': True, 'assets': assets }
+    vreturn = client.getJson( http['_links']['activate'], 'POST' )
+    if not vreturn['isOk']:
+      return vreturn
+    t1 = time.time()
+    while time.time() - t1 < options['timeoutActivate']:
+      time.sleep( options['poll'] )
+      vreturn = getAssets()
+      if not vreturn['isOk']:
+        return vreturn
+      assets = vreturn['json']
+      if getHttp( assets, asset ).get( 'status' ) == 'active':
+        return { 'isOk': True, 'assets': assets }
+    return { 'isOk': False, 'msg': "Asset '%s' of '%s' not activated" % ( asset, scene ) }
+
+  def cropRegion(url, filename):
+    # Read only the blocks of region(/vsicurl/), the scene is not downloaded
+    # Credentials only for host of catalog(as redirections of HttpClient)
+    from footprintindex import FootprintIndex
+    from osgeo import gdal
+    bbox = FootprintIndex.getBBox( task['geometry'] or {} )
+    if bbox is None:
+      return { 'isOk': False, 'msg': "Geometry of region not valid" }
+    isCatalog = urlparse.urlsplit( url ).netloc == urlparse.urlsplit( options['catalog'] ).netloc
+    userpwd = "%s:" % options['apiKey'] if isCatalog and not options['apiKey'] is None else None
+    filenameWork = "%s.part.tif" % os.path.splitext( filename )[0]
+    gdal.SetThreadLocalConfigOption( 'GDAL_HTTP_USERPWD', userpwd )
+    try:
+      gdal.UseExceptions()
+      ds = gdal.Translate( filenameWork, "/vsicurl/%s" % url, projWin=[ bbox[0], bbox[3], bbox[2], bbox[1] ], projWinSRS='EPSG:4326' )
+      ds = None
+    except RuntimeError as e:
+      if os.path.exists( filenameWork ):
+        os.remove( filenameWork )
+      return { 'isOk': False, 'msg': "Region of '%s': %s" % ( url, str( e ) ) }
+    finally:
+      gdal.SetThreadLocalConfigOption( 'GDAL_HTTP_USERPWD', None )
+    os.rename( filenameWork, filename )
+    return { 'isOk': True, 'size': os.path.getsize( filename ) }
+
+  scene = task['scene']
+  isRegion = not task.get( 'geometry' ) is None and not options['geomId'] is None
+  vreturn = getAssets()
+  if not vreturn['isOk']:
+    return vreturn
+  assets = vreturn['json']
+  analytic = 'analytic_dn' if 'analytic_dn' in assets else 'analytic'
+  results = []
+  for asset in ( 'udm', analytic ):
+    if isRegion: # Same name of pl_download_region_scene.sh
+      key = "%s_geom%s" % ( asset, options['geomId'] )
+      filename = os.path.join( options['dir'], "%s_geom%s_%s.tif" % ( scene, options['geomId'], asset ) )
+    else:
+      key = asset
+      filename = os.path.join( options['dir'], "%s_%s.tif" % ( scene, asset ) )
+    if state.isDone( scene, key ):
+      results.append( { 'asset': asset, 'filename': filename, 'skipped': True } )
+      continue
+    if not asset in assets:
+      return { 'isOk': False, 'msg': "Scene '%s' not have asset '%s'" % ( scene, asset ) }
+    vreturn = activate( assets, asset )
+    if not vreturn['isOk']:
+      state.set( scene, key, { 'status': 'failed', 'filename': filename, 'size': None, 'msg': vreturn['msg'] } )
+      return vreturn
+    assets = vreturn['assets']
+    http = getHttp( assets, asset )
+    if isRegion:
+      vreturn = cropRegion( http['location'], filename )
+      if not vreturn['isOk']:
+        state.set( scene, key, { 'status': 'failed', 'filename': filename, 'size': None, 'msg': vreturn['msg'] } )
+        return vreturn
+      result = { 'asset': asset, 'filename': filename, 'skipped': False, 'resumed': False, 'bytesRead': None }
+    else:
+      vreturn = client.download( http['location'], filename, http.get( 'size' ), http.get( 'md5_digest' ) )
+      if not vreturn['isOk']:
+        state.set( scene, key, { 'status': 'partial', 'filename': filename, 'size': None, 'msg': vreturn['msg'] } )
+        return vreturn
+      result = { 'asset': asset, 'filename': filename, 'skipped': False, 'resumed': vreturn['resumed'], 'bytesRead': vreturn['bytesRead'] }
+    state.set( scene, key, { 'status': 'done', 'filename': filename, 'size': vreturn['size'], 'msg': None } )
+    results.append( result )
+  return { 'isOk': True, 'assets': results }
+
+def run(tasks, workers, options):
+  # Threads with one HttpClient each(connections reused between scenes)
+  def worker():
+    client = HttpClient( options['apiKey'], options['timeout'] )
+    while True:
+      task = queue.get()
+      if task is None:
+        break
+      try:
+        vreturn = downloadScene( client, task, state, options )
+      except Exception as e:
+        vreturn = { 'isOk': False, 'msg': str( e ) }
+      with lock:
+        printResult( task, vreturn )
+    client.close()
+
+  def printResult(task, vreturn):
+    if not vreturn['isOk']:
+      total['failed'] += 1
+      print "%-40s Error: %s" % ( task['scene'], vreturn['msg'] )
+      return
+    total['ok'] += 1
+    for r in vreturn['assets']:
+      status = 'skipped' if r['skipped'] else ( 'resumed' if r['resumed'] else 'downloaded' )
+      print "%-40s %-12s %-10s %s" % ( task['scene'], r['asset'], status, r['filename'] )
+    sys.stdout.flush()
+
+  state = DownloadState( options['state'] )
+  queue, lock = Queue.Queue(), threading.Lock()
+  total = { 'ok': 0, 'failed': 0 }
+  threads = [ threading.Thread( target=worker ) for i in xrange( workers ) ]
+  for thread in threads:
+    thread.daemon = True
+    thread.start()
+  for task in tasks:
+    queue.put( task )
+  for thread in threads:
+    queue.put( None )
+  for thread in threads:
+    thread.join()
+  print "Scenes: %d Ok: %d Failed: %d" % ( total['ok'] + total['failed'], total['ok'], total['failed'] )
+  return 0 if total['failed'] == 0 else 1
+
+def main():
+  d = "Download assets(udm and analytic) of scenes of GeoJSON(from pl_get_geojson_scenes.sh)."
+  parser = argparse.ArgumentParser(description=d )
+  d = "GeoJSON of scenes(FeatureCollection or newline-delimited), '-' is standard input"
+  parser.add_argument('geojson', metavar='geojson', type=str, help=d )
+  d = "ID of geometry, only the region of feature is read and saved(as pl_download_region_scene.sh)"
+  parser.add_argument('-g', metavar='geom_id', dest='geomId', type=str, help=d)
+  d = "Total of simultaneous downloads (default 4)"
+  parser.add_argument('-j', metavar='workers', dest='workers', type=int, default=4, help=d)
+  d = "Directory of downloads (default current)"
+  parser.add_argument('-d', metavar='dir', dest='dir', type=str, default='.', help=d)
+  d = "File of state of downloads (default '<dir>/download_state.json')"
+  parser.add_argument('-s', metavar='state', dest='state', type=str, help=d)
+  d = "URL of catalog (default '%s')" % pl1_catalog
+  parser.add_argument('-c', metavar='catalog', dest='catalog', type=str, default=pl1_catalog, help=d)
+  d = "Seconds between polls of activation (default 10)"
+  parser.add_argument('--poll', metavar='seconds', dest='poll', type=float, default=10.0, help=d)
+  d = "Max seconds for activation (default 1800)"
+  parser.add_argument('--timeout-activate', metavar='seconds', dest='timeoutActivate', type=float, default=1800.0, help=d)
+
+  args = parser.parse_args()
+  if not args.geojson == '-' and not os.path.exists( args.geojson ):
+    print "Not found '%s'" % args.geojson
+    return 1
+  if args.workers < 1:
+    print "Total of workers '%d' need be greater than 0" % args.workers
+    return 1
+  apiKey = os.environ.get('PL_API_KEY')
+  if apiKey is None and args.catalog == pl1_catalog:
+    print "API KEY for Planet Labs is not defined in host"
+    return 1
+  if not os.path.exists( args.dir ):
+    os.makedirs( args.dir )
+
+  tasks, scenes = [], []
+  f = openInput( args.geojson )
+  try:
+    for feature in readFeatures( f ):
+      scene = ( feature.get( 'properties' ) or {} ).get( 'id', feature.get( 'id' ) )
+      if scene is None or scene in scenes:
+        continue
+      scenes.append( scene )
+      tasks.append( { 'scene': re.sub( '[^0-9A-Za-z_.-]', '_', str( scene ) ), 'geometry': feature.get( 'geometry' ) } )
+  except ValueError as e:
+    print "Reading '%s': %s" % ( args.geojson, str( e ) )
+    return 1
+  options = {
+    'apiKey': apiKey, 'catalog': args.catalog if args.catalog.endswith( '/' ) else "%s/" % args.catalog,
+    'dir': args.dir, 'geomId': args.geomId,
+    'state': args.state if not args.state is None else os.path.join( args.dir, 'download_state.json' ),
+    'poll': args.poll, 'timeoutActivate': args.timeoutActivate, 'timeout': 60
+  }
+  return run( tasks, args.workers, options )
+
+if __name__ == "__main__":
+    sys.exit( main() )
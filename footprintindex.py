@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+Name                 : Footprint index
+Description          : Spatial index of footprints of scenes(GeoJSON features)
+                       for query of scenes that intersect regions
+Arguments            : List of features(GeoJSON as dictionary)
+
+                       -------------------
+begin                : 2016-08-11
+copyright            : (C) 2016 by Luiz Motta
+email                : motta dot luiz at gmail.com
+
+ ***************************************************************************/
+"""
+
+from osgeo import ogr
+
+from spatialindex import SpatialIndex
+
+ogr_types = {
+  'Point': ogr.wkbPoint, 'MultiPoint': ogr.wkbMultiPoint,
+  'LineString': ogr.wkbLineString, 'MultiLineString': ogr.wkbMultiLineString,
+  'Polygon': ogr.wkbPolygon, 'MultiPolygon': ogr.wkbMultiPolygon,
+  'GeometryCollection': ogr.wkbGeometryCollection
+}
+geojson_types = dict( ( v, k ) for ( k, v ) in ogr_types.items() )
+
+class FootprintIndex():
+  # Bounding boxes from coordinates(without OGR), geometries of OGR are created
+  # only for candidates(bounding box intersect) and kept for others queries
+  def __init__(self, features):
+    self.features = features
+    self.geoms = len( features ) * [ None ]
+    self.errors = [] # [ ( index, msg ), ... ]
+    items = []
+    for i in xrange( len( features ) ):
+      bbox = None
+      geometry = features[ i ].get( 'geometry' ) if isinstance( features[ i ], dict ) else None
+      if isinstance( geometry, dict ):
+        bbox = self.getBBox( geometry )
+      if bbox is None:
+        self.errors.append( ( i, "Geometry of feature '%d' not valid" % ( i + 1 ) ) )
+        continue
+      items.append( ( bbox, i ) )
+    self.index = SpatialIndex( items )
+
+  def __del__(self):
+    for geom in self.geoms:
+      if not geom is None:
+        geom.Destroy()
+
+  @staticmethod
+  def getBBox(geometry):
+    # Return ( minX, minY, maxX, maxY ) or None(empty or not valid)
+    def getPoints(coordinates):
+      if len( coordinates ) > 0 and isinstance( coordinates[0], ( int, long, float ) ):
+        points.append( coordinates )
+        return
+      for c in coordinates:
+        getPoints( c )
+
+    points = []
+    try:
+      if geometry['type'] == 'GeometryCollection':
+        bboxes = filter( lambda b: not b is None, map( FootprintIndex.getBBox, geometry['geometries'] ) )
+        if len( bboxes ) == 0:
+          return None
+        return (
+          min( b[0] for b in bboxes ), min( b[1] for b in bboxes ),
+          max( b[2] for b in bboxes ), max( b[3] for b in bboxes )
+        )
+      getPoints( geometry['coordinates'] )
+      if len( points ) == 0:
+        return None
+      xs, ys = [ p[0] for p in points ], [ p[1] for p in points ]
+    except ( KeyError, TypeError, IndexError ):
+      return None
+    return ( min( xs ), min( ys ), max( xs ), max( ys ) )
+
+  @staticmethod
+  def toOgr(geometry):
+    # GeoJSON(dictionary) to OGR geometry, without serialization, None if not valid
+    def addPoints(geom, coordinates):
+      for c in coordinates:
+        geom.AddPoint_2D( float( c[0] ), float( c[1] ) )
+
+    def getPolygon(rings):
+      polygon = ogr.Geometry( ogr.wkbPolygon )
+      for coordinates in rings:
+        ring = ogr.Geometry( ogr.wkbLinearRing )
+        addPoints( ring, coordinates )
+        polygon.AddGeometry( ring )
+      return polygon
+
+    def getGeom(geometry):
+      name = geometry['type']
+      if name == 'Polygon':
+        return getPolygon( geometry['coordinates'] )
+      geom = ogr.Geometry( ogr_types[ name ] )
+      if name == 'GeometryCollection':
+        for g in geometry['geometries']:
+          geom.AddGeometry( getGeom( g ) )
+      elif name == 'Point':
+        geom.AddPoint_2D( float( geometry['coordinates'][0] ), float( geometry['coordinates'][1] ) )
+      elif name == 'LineString':
+        addPoints( geom, geometry['coordinates'] )
+      else: # Multi
+        for coordinates in geometry['coordinates']:
+          if name == 'MultiPoint':
+            part = ogr.Geometry( ogr.wkbPoint )
+            part.AddPoint_2D( float( coordinates[0] ), float( coordinates[1] ) )
+          elif name == 'MultiLineString':
+            part = ogr.Geometry( ogr.wkbLineString )
+            addPoints( part, coordinates )
+          else:
+            part = getPolygon( coordinates )
+          geom.AddGeometry( part )
+      return geom
+
+    try:
+      return getGeom( geometry )
+    except ( KeyError, TypeError, IndexError, ValueError ):
+      return None
+
+  @staticmethod
+  def toDict(geom):
+    # OGR geometry to GeoJSON(dictionary), without serialization
+    def getCoordinates(g):
+      points = g.GetPoints()
+      if points is None:
+        return []
+      return [ [ p[0], p[1] ] for p in points ]
+
+    def getParts(g):
+      return [ g.GetGeometryRef( i ) for i in xrange( g.GetGeometryCount() ) ]
+
+    name = geojson_types[ ogr.GT_Flatten( geom.GetGeometryType() ) ]
+    if name == 'GeometryCollection':
+      return { 'type': name, 'geometries': [ FootprintIndex.toDict( g ) for g in getParts( geom ) ] }
+    if name == 'Point':
+      coordinates = [] if geom.IsEmpty() else [ geom.GetX(), geom.GetY() ]
+    elif name == 'LineString':
+      coordinates = getCoordinates( geom )
+    elif name == 'Polygon':
+      coordinates = [ getCoordinates( r ) for r in getParts( geom ) ]
+    elif name == 'MultiPolygon':
+      coordinates = [ [ getCoordinates( r ) for r in getParts( p ) ] for p in getParts( geom ) ]
+    elif name == 'MultiLineString':
+      coordinates = [ getCoordinates( l ) for l in getParts( geom ) ]
+    else: # MultiPoint
+      coordinates = [ [ p.GetX(), p.GetY() ] for p in getParts( geom ) ]
+    return { 'type': name, 'coordinates': coordinates }
+
+  def getGeometry(self, i):
+    # OGR geometry of feature(created one time)
+    if self.geoms[ i ] is None:
+      self.geoms[ i ] = self.toOgr( self.features[ i ]['geometry'] )
+    return self.geoms[ i ]
+
+  def query(self, geom):
+    # geom: OGR geometry or GeoJSON(dictionary)
+    # Return the indexes of features that intersect(sorted)
+    if isinstance( geom, dict ):
+      geom = self.toOgr( geom )
+      if geom is None:
+        return []
+    ( minX, maxX, minY, maxY ) = geom.GetEnvelope()
+    indexes = []
+    for i in sorted( self.index.query( ( minX, minY, maxX, maxY ) ) ):
+      geomFeature = self.getGeometry( i )
+      if not geomFeature is None and geomFeature.Intersects( geom ):
+        indexes.append( i )
+    return indexes
+
+  def queryRegions(self, geoms):
+    # Return [ [ indexes of features ], ... ] for each geometry
+    return [ self.query( geom ) for geom in geoms ]
+
+  def getIntersection(self, i, geom):
+    # Return GeoJSON(dictionary) of intersection of feature and geom(OGR)
+    geomInter = self.getGeometry( i ).Intersection( geom )
+    geometry = self.toDict( geomInter )
+    geomInter.Destroy()
+    return geometry
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+Name                 : GeoJSON stream
+Description          : Read and write features one by one, newline-delimited
+                       GeoJSON or FeatureCollection(read by parts)
+Arguments            : File(or standard input/output)
+
+                       -------------------
+begin                : 2016-08-11
+copyright            : (C) 2016 by Luiz Motta
+email                : motta dot luiz at gmail.com
+
+ ***************************************************************************/
+"""
+
+import sys, json, re
+
+reSpaces = re.compile( r'[\s,\x1e]*' ) # Separators of features(RS of GeoJSON text sequences)
+reFeatures = re.compile( r'"features"\s*:\s*\[' )
+sizeChunk = 65536
+
+def openInput(filename):
+  return sys.stdin if filename in ( None, '-' ) else open( filename )
+
+def openOutput(filename):
+  return sys.stdout if filename in ( None, '-' ) else open( filename, 'w' )
+
+def readFeatures(f):
+  # Generator of features: newline-delimited(Feature or Geometry by line) or FeatureCollection
+  # Geometry is returned as Feature without properties
+  def getFeature(value):
+    if value.get( 'type' ) == 'Feature':
+      return value
+    return { 'type': 'Feature', 'properties': {}, 'geometry': value }
+
+  def readCollection(buffer):
+    # Read features of FeatureCollection by parts(raw_decode of each feature)
+    decoder = json.JSONDecoder()
+    m = reFeatures.search( buffer )
+    while m is None:
+      chunk = f.read( sizeChunk )
+      if chunk == '':
+        raise ValueError( "FeatureCollection without 'features'" )
+      buffer += chunk
+      m = reFeatures.search( buffer )
+    buffer = buffer[ m.end(): ]
+    while True:
+      pos = reSpaces.match( buffer ).end()
+      if pos < len( buffer ) and buffer[ pos ] == ']':
+        return
+      try:
+        ( value, end ) = decoder.raw_decode( buffer, pos )
+      except ValueError: # Feature incomplete
+        chunk = f.read( sizeChunk )
+        if chunk == '':
+          raise ValueError( "FeatureCollection incomplete" )
+        buffer += chunk
+        continue
+      yield getFeature( value )
+      buffer = buffer[ end: ]
+
+  line = f.readline()
+  while line.strip( ' \t\r\n\x1e' ) == '':
+    if line == '':
+      return
+    line = f.readline()
+  try:
+    value = json.loads( line.strip( ' \t\r\n\x1e' ) )
+  except ValueError: # FeatureCollection in many lines
+    value = None
+  if value is None or value.get( 'type' ) == 'FeatureCollection':
+    for feature in readCollection( line ):
+      yield feature
+    return
+  yield getFeature( value )
+  for line in f:
+    line = line.strip( ' \t\r\n\x1e' )
+    if line == '':
+      continue
+    yield getFeature( json.loads( line ) )
+
+class FeatureWriter():
+  # Newline-delimited GeoJSON or FeatureCollection(header and features writed one by one)
+  def __init__(self, f, isCollection=False, crs=None):
+    self.f, self.isCollection = f, isCollection
+    self.total = 0
+    if isCollection:
+      header = '{ "type": "FeatureCollection", '
+      if not crs is None:
+        header += '"crs": %s, ' % json.dumps( crs )
+      self.f.write( '%s"features": [\n' % header )
+
+  def write(self, feature):
+    if self.isCollection and self.total > 0:
+      self.f.write( ',\n' )
+    self.f.write( json.dumps( feature ) )
+    if not self.isCollection:
+      self.f.write( '\n' )
+    self.total += 1
+
+  def close(self):
+    if self.isCollection:
+      self.f.write( '\n] }\n' )
+    self.f.flush()
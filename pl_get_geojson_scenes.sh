@@ -51,33 +51,33 @@ create_search_json(){
   echo "curl --silent --show-error -X POST $headers -u $PL_API_KEY: -d '$data' '$http'" | bash - > $search_json
 }
 add_features(){
-  # External: search_json,features, PL_API_KEY
+  # External: search_json, features_ndjson, PL_API_KEY
+  # Features are appended in file(one by line)
   local total=$(jq '.["features"] | length' $search_json)
-  if [ $total -ne 0 ] ; then
+  while [ $total -ne 0 ] ; do
     local properties='id: .id'
     properties+=',satellite_id: .properties["catalog::satellite_id"],grid_cell: .properties["catalog::grid_cell"],provider: .properties["catalog::provider"]'
     properties+=',resolution: .properties["catalog::resolution"],acquired: .properties["catalog::acquired"]'
     properties+=',cloud_cover: .properties["catalog::cloud_cover"],usable_data: .properties["catalog::usable_data"]'
     properties+=',view_angle: .properties["catalog::view_angle"],sun_elevation: .properties["catalog::sun_elevation"],sun_azimuth: .properties["catalog::sun_azimuth"]'
     local filter='{ "type": "Feature", "properties": {'$properties'}, geometry: .geometry }'  
-    local features_tmp=$(echo "jq '[.[\"features\"][] | $filter ]' $search_json" | bash -)
-    if [ -z "$features" ] ; then
-      features=${features_tmp:1:-1}
-    else
-      features+=","${features_tmp:1:-1}
-    fi
+    echo "jq -c '.[\"features\"][] | $filter' $search_json" | bash - >> $features_ndjson
     local link=$(jq '.["_links"]["_next"]' $search_json | sed 's/"//g')
     curl --silent --show-error -G $link -u $PL_API_KEY: > $search_json
-    add_features
-  else
-    features="["$features"]"
-  fi
+    total=$(jq '.["features"] | length' $search_json)
+  done
 }
 create_scenes_geojson(){
-  # External: geom_id, date1, date2, features
+  # External: geom_id, date1, date2, geojson, features_ndjson
+  # Cut features with geometry, FeatureCollection(CRS84) writed by feature
   scenes_geojson="scenes_geom"$geom_id"_"$date1"_"$date2".geojson"
-  local header='"type": "FeatureCollection", "crs": { "type": "name", "properties": { "name": "urn:ogc:def:crs:OGC:1.3:CRS84" } }'
-  echo '{ '$header',"features": '$features' }' > $scenes_geojson
+  local msg=$(cut_geojsons.py "$geojson" -i $features_ndjson -o $scenes_geojson -f 2>&1 >/dev/null)
+  if [ -n "$msg" ] ; then
+    rm -f $features_ndjson
+    printf "\rError: "
+    echo $msg | jq '.["msg"]'
+    exit 1
+  fi
 }
 msg_error(){
   local name_script=$(basename $0)
@@ -117,19 +117,11 @@ if [ $(jq '.["features"] | length' $search_json) -eq 0 ] ; then
   exit 1
 fi
 #
-features=""
+features_ndjson=$(mktemp)
 add_features
 rm $search_json
-vresult=$(echo "cut_geojsons.py '$features' '$geojson'" | bash -)
-isok=$(echo $vresult | jq '.["isOk"]')
-if [ $isok -eq 0 ] ; then
-  msg=$(echo $vresult | jq '.["msg"]')
-  printf "\rError: "
-  echo $msg
-  exit 1
-fi
-features=$(echo $vresult | jq '.["geojsons"]')
 create_scenes_geojson
+rm $features_ndjson
 #
 total=$(jq '.["features"] | length' $scenes_geojson)
 printf "\rCreated '%s'(total %d features)\n" $scenes_geojson $total
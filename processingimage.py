@@ -3,7 +3,7 @@
 /***************************************************************************
 Name                 : Processing image framework
 Description          : Processing image framework
-Arguments            : Georeferencing Image local or Planet Labs
+Arguments            : Georeferencing Image local, remote(HTTP) or Planet Labs
 
                        -------------------
 begin                : 2016-08-11
@@ -13,79 +13,127 @@ email                : motta dot luiz at gmail.com
  ***************************************************************************/
 """
 
-import os, struct, math
+import os, math, multiprocessing, itertools, hashlib, time, json, re, tempfile, threading, Queue
+from xml.sax.saxutils import escape
+
+import numpy as np
 
 from osgeo import gdal, ogr, osr
-from gdalconst import GA_ReadOnly
+from bandmath import BandMath
+from tilecache import TileCache
+from resultcache import ResultCache
+from spatialindex import SpatialIndex
+from rangereader import RangeReader
+from gdalconst import GA_ReadOnly, GA_Update
 gdal.UseExceptions()
 gdal.PushErrorHandler('CPLQuietErrorHandler')
-gdal_sctruct_types = {
-  gdal.GDT_Byte: 'B',
-  gdal.GDT_UInt16: 'H',
-  gdal.GDT_Int16: 'h',
-  gdal.GDT_UInt32: 'I',
-  gdal.GDT_Int32: 'i',
-  gdal.GDT_Float32: 'f',
-  gdal.GDT_Float64: 'd'
+gdal_numpy_types = {
+  gdal.GDT_Byte: np.uint8,
+  gdal.GDT_UInt16: np.uint16,
+  gdal.GDT_Int16: np.int16,
+  gdal.GDT_UInt32: np.uint32,
+  gdal.GDT_Int32: np.int32,
+  gdal.GDT_Float32: np.float32,
+  gdal.GDT_Float64: np.float64
 }
 
 class RegionImage():
+  # SRS and transformations are cached by WKT of SRS(shared by instances)
+  # Footprint of image is calculated one time by instance
+  useCache = True
+  srsCache, transformCache = {}, {}
+  wkt4326 = 'EPSG:4326'
+
   def __init__(self, ds):
     self.ds = ds
     self.ulImage, self.resImage = None, None
+    self.geomImg, self.wktSRS = None, None
+
+  def __del__(self):
+    if not self.geomImg is None:
+      self.geomImg.Destroy()
+
+  @classmethod
+  def getSRS(cls, wktSRS):
+    # wktSRS: WKT or wkt4326
+    if cls.useCache and wktSRS in cls.srsCache:
+      return cls.srsCache[ wktSRS ]
+    sr = osr.SpatialReference()
+    if hasattr( osr, 'OAMS_TRADITIONAL_GIS_ORDER' ): # GDAL 3, keep longitude, latitude
+      sr.SetAxisMappingStrategy( osr.OAMS_TRADITIONAL_GIS_ORDER )
+    r = sr.ImportFromEPSG( 4326 ) if wktSRS == cls.wkt4326 else sr.ImportFromWkt( wktSRS )
+    if not r == 0:
+      return None
+    if cls.useCache:
+      cls.srsCache[ wktSRS ] = sr
+    return sr
+
+  @classmethod
+  def getTransformation(cls, wktSource, wktTarget):
+    key = ( wktSource, wktTarget )
+    if cls.useCache and key in cls.transformCache:
+      return cls.transformCache[ key ]
+    srSource, srTarget = cls.getSRS( wktSource ), cls.getSRS( wktTarget )
+    if srSource is None or srTarget is None:
+      return None
+    ct = osr.CoordinateTransformation( srSource, srTarget )
+    if cls.useCache:
+      cls.transformCache[ key ] = ct
+    return ct
   
   def _getGeom(self):
-    def getWktBBox( UL, BR):
-      coords = [ ( UL['x'], UL['y'] ), ( BR['x'], UL['y'] ), ( BR['x'], BR['y'] ), ( UL['x'], BR['y'] ), ( UL['x'], UL['y'] ) ]
-      coords = map( lambda c: "%f %f" % ( c[0], c[1] ), coords)
-      return "POLYGON (( %s ))" % ','.join( coords )
+    if self.useCache and not self.geomImg is None:
+      return { 'isOk': True, 'geom': self.geomImg }
 
     transform = self.ds.GetGeoTransform()
     self.ulImage  = { 'x': transform[0], 'y': transform[3] }
     self.resImage = { 'x': transform[1], 'y': transform[5] }
     xsize, ysize = self.ds.RasterXSize, self.ds.RasterYSize
     BR = { 'x': self.ulImage['x'] + transform[1] * xsize, 'y': self.ulImage['y'] + transform[5] * ysize }
-    wktGeom = getWktBBox( self.ulImage, BR )
     
-    wktSRS = self.ds.GetProjectionRef()
-    if wktSRS == '':
+    self.wktSRS = self.ds.GetProjectionRef()
+    if self.wktSRS == '':
       return { 'isOk': False, 'msg': "Image not have Spatial Reference" }
+    sr = self.getSRS( self.wktSRS )
+    if sr is None:
+      return { 'isOk': False, 'msg': "Fail when creating SRS from '%s'" % self.wktSRS }
 
-    sr = osr.SpatialReference()
-    if not sr.ImportFromWkt( wktSRS ) == 0:
-      return { 'isOk': False, 'msg': "Fail when creating SRS from '%s'" % wktSRS }
-    geom = ogr.CreateGeometryFromWkt( wktGeom )
+    ring = ogr.Geometry( ogr.wkbLinearRing )
+    for ( x, y ) in ( ( self.ulImage['x'], self.ulImage['y'] ), ( BR['x'], self.ulImage['y'] ), ( BR['x'], BR['y'] ), ( self.ulImage['x'], BR['y'] ), ( self.ulImage['x'], self.ulImage['y'] ) ):
+      ring.AddPoint_2D( x, y )
+    geom = ogr.Geometry( ogr.wkbPolygon )
+    geom.AddGeometry( ring )
     geom.AssignSpatialReference( sr )
+    if not self.geomImg is None:
+      self.geomImg.Destroy()
+    self.geomImg = geom
     
     return { 'isOk': True, 'geom': geom }
 
   def getSubset(self, wkt4326):
     def getGeomWkt4326():
       geom = ogr.CreateGeometryFromWkt( wkt4326 )
-      sr = osr.SpatialReference()
-      if not sr.ImportFromEPSG( 4326 ) == 0:
+      ct = self.getTransformation( self.wkt4326, self.wktSRS )
+      if ct is None:
         return { 'isOk': False, 'msg': "Fail when creating SRS with EPSG 4326" }
-      geom.AssignSpatialReference( sr )
-      srImg = geomImg.GetSpatialReference()
-      if not geom.TransformTo( srImg ) == 0:
-        return { 'isOk': False, 'msg': "Fail when transforming SRS 'EPSG 4326' using Image SRS '%s'" % srImg.ExportToWkt() }
+      if not geom.Transform( ct ) == 0:
+        return { 'isOk': False, 'msg': "Fail when transforming SRS 'EPSG 4326' using Image SRS '%s'" % self.wktSRS }
+      geom.AssignSpatialReference( geomImg.GetSpatialReference() )
 
       return { 'isOk': True, 'geom': geom }
     
-    def getWkt4326Img():
+    def getMessageNotIntersect():
+      # Only for error
       geom = geomImg.Clone()
-      sr = osr.SpatialReference()
-      if not sr.ImportFromEPSG( 4326 ) == 0:
-        return { 'isOk': False, 'msg': "Error create SRS with EPSG 4326" }
-      if not geom.TransformTo( sr ) == 0:
-        return { 'isOk': False, 'msg': "Error transform SRS using EPSG 4326" }
-      wkt = geom.ExportToWkt()
+      ct = self.getTransformation( self.wktSRS, self.wkt4326 )
+      wkt = "Error transform SRS using EPSG 4326"
+      if not ct is None and geom.Transform( ct ) == 0:
+        wkt = geom.ExportToWkt()
       geom.Destroy()
-
-      return { 'isOk': True, 'wkt': wkt }
+      data = ( wkt4326, self.ds.GetDescription(), wkt )
+      return "Wkt Geom not intersect with image:\nWkt '%s'\nImage = '%s'\nWkt Image:\n%s" % data
 
     def getPixelCoordinate(x, y):
-      self.ulImage, self.resImage
       xCell = ( x - self.ulImage['x'] ) / self.resImage['x'] 
       yCell = ( y - self.ulImage['y'] ) / self.resImage['y']
       
@@ -100,23 +148,17 @@ class RegionImage():
       return vreturn
     geomRegion = vreturn['geom']
     
-    vreturn = getWkt4326Img()
-    if not vreturn['isOk']:
-      return vreturn
-    data = ( wkt4326, self.ds.GetDescription(), vreturn['wkt'] )
-    msg = "Wkt Geom not intersect with image:\nWkt '%s'\nImage = '%s'\nWkt Image:\n%s" % data
     if not geomImg.Intersect( geomRegion ):
-      geomImg.Destroy()
       geomRegion.Destroy()
-      return { 'isOk': False, 'msg': msg }
+      return { 'isOk': False, 'msg': getMessageNotIntersect() }
     geomInstersection = geomImg.Intersection( geomRegion )
-    geomImg.Destroy()
     geomRegion.Destroy()
     if not geomInstersection.GetDimension() == 2:
       geomInstersection.Destroy()
-      return { 'isOk': False, 'msg': msg }
+      return { 'isOk': False, 'msg': getMessageNotIntersect() }
 
     ( minX, maxX, minY, maxY )= geomInstersection.GetEnvelope()
+    wktIntersection = geomInstersection.ExportToWkt() # SRS of image, for cutline
     geomInstersection.Destroy()
     
     ul = getPixelCoordinate( minX, maxY )
@@ -124,6 +166,7 @@ class RegionImage():
     subset = {
       'x_UL': ul['x'], 'y_UL': ul['y'],
       'x_BR': br['x'], 'y_BR': br['y'],
+      'wkt': wktIntersection
     }
 
     return { 'isOk': True, 'subset': subset }
@@ -140,41 +183,140 @@ class RegionImage():
     return True
 
 class ImageLineValues():
+  # Rows are read in buffers created one time and reused by each row(GDAL read in the buffer)
+  # Buffers are Float64, the same values of Python float from struct of source
   def __init__(self, p ):
-    band = p['ds'].GetRasterBand( p['bandNumbers'][0] ) # See self.src
-    datatype = band.DataType
-    self.dataRead = [ p['xoff'],  None, p['xsize'], 1, p['xsize'], 1, datatype ]
-    self.yoff = p['yoff'] # Subset
-    self.fs = gdal_sctruct_types[ datatype ] * p['xsize']
-    self.isSrcBand, self.src, self._getValues = False, None, None
-    bandTotal = len( p['bandNumbers'] )
-    if bandTotal > 1:
-      self.src = p['ds']
-      self.dataRead += [  p['bandNumbers'] ]
-      self.fs *= bandTotal
-      self._getValues = self._getValues2d
-      band = None
+    # p['xsize'], p['ysize']: window of source, p['xsizeOut']: row of output
+    # With reduction, one row of output is read from 'reduction' rows of source(decimated by GDAL)
+    self.bands = map( lambda b: p['ds'].GetRasterBand( b ), p['bandNumbers'] )
+    self.xoff, self.yoff, self.xsize, self.ysize = p['xoff'], p['yoff'], p['xsize'], p['ysize'] # Subset
+    self.xsizeOut, self.reduction = p['xsizeOut'], p['reduction']
+    self.buffers = [ np.empty( ( 1, self.xsizeOut ), np.float64 ) for b in self.bands ]
+    self.values = [ buf[0] for buf in self.buffers ] # [ row band1, ..., row bandN ], views of buffers
+    self.bytesRead = self.xsizeOut * sum( map( lambda b: np.dtype( gdal_numpy_types[ b.DataType ] ).itemsize, self.bands ) )
+
+  def __del__(self):
+    for b in xrange( len( self.bands ) ):
+      self.bands[ b ] = None
+
+  def getValues(self, row):
+    # Return the same list(views of buffers) for all rows
+    y = row * self.reduction
+    ysize = min( self.reduction, self.ysize - y )
+    for i in xrange( len( self.bands ) ):
+      self.bands[ i ].ReadAsArray( self.xoff, self.yoff + y, self.xsize, ysize, buf_xsize=self.xsizeOut, buf_ysize=1, buf_obj=self.buffers[ i ] )
+    return self.values
+
+class ImageArrayValues():
+  def __init__(self, ds, bandNumbers):
+    self.bands = map( lambda b: ds.GetRasterBand( b ), bandNumbers )
+    self.counters = {} # Of last getValues
+
+  def __del__(self):
+    for b in xrange( len( self.bands ) ):
+      self.bands[ b ] = None
+
+  def getValues(self, tile):
+    d = ( tile['xoff'], tile['yoff'], tile['xsize'], tile['ysize'] ) # Window of image(tile from ProcessingImage._getTiles)
+    if 'xsizeRead' in tile: # Reduction, GDAL read from overviews or decimate
+      d = ( tile['xoff'], tile['yoff'], tile['xsizeRead'], tile['ysizeRead'], tile['xsize'], tile['ysize'] )
+    return [ b.ReadAsArray( *d ) for b in self.bands ] # [ array band1, ..., array bandN ]
+
+class ImageArrayValuesCache(ImageArrayValues):
+  # Read blocks of bands from TileCache, missing blocks are read from dataset and put in cache
+  # The tile is mounted with the blocks that intersect it
+  def __init__(self, ds, bandNumbers, cache, source):
+    ImageArrayValues.__init__( self, ds, bandNumbers )
+    self.bandNumbers, self.cache, self.source = bandNumbers, cache, source
+    self.blockSize = self.bands[0].GetBlockSize()
+    self.xsize, self.ysize = ds.RasterXSize, ds.RasterYSize
+
+  def _getBlock(self, i, xBlock, yBlock):
+    ( xBlockSize, yBlockSize ) = self.blockSize
+    key = TileCache.getKey( self.source, self.bandNumbers[ i ], ( xBlock, yBlock ), self.blockSize )
+    values = self.cache.get( key )
+    if values is None:
+      self.counters['cacheMisses'] += 1
+      x, y = xBlock * xBlockSize, yBlock * yBlockSize
+      d = ( x, y, min( xBlockSize, self.xsize - x ), min( yBlockSize, self.ysize - y ) ) # Partial blocks in edges
+      values = self.bands[ i ].ReadAsArray( *d )
+      self.cache.put( key, values )
     else:
-      self.src = band
-      self._getValues = self._getValues1d
-      self.isSrcBand = True
+      self.counters['cacheHits'] += 1
+    return values
+
+  def getValues(self, tile):
+    ( xBlockSize, yBlockSize ) = self.blockSize
+    xoff, yoff, xsize, ysize = tile['xoff'], tile['yoff'], tile['xsize'], tile['ysize']
+    self.counters = { 'cacheHits': 0, 'cacheMisses': 0 }
+    if 'xsizeRead' in tile: # Reduction, the cache is of blocks of full resolution
+      return ImageArrayValues.getValues( self, tile )
+    imgValues = []
+    for i in xrange( len( self.bands ) ):
+      values = None
+      for yBlock in xrange( yoff // yBlockSize, ( yoff + ysize - 1 ) // yBlockSize + 1 ):
+        for xBlock in xrange( xoff // xBlockSize, ( xoff + xsize - 1 ) // xBlockSize + 1 ):
+          block = self._getBlock( i, xBlock, yBlock )
+          if values is None:
+            values = np.empty( ( ysize, xsize ), block.dtype )
+          # Intersection of block and tile
+          x1, y1 = max( xBlock * xBlockSize, xoff ), max( yBlock * yBlockSize, yoff )
+          x2, y2 = min( ( xBlock + 1 ) * xBlockSize, xoff + xsize ), min( ( yBlock + 1 ) * yBlockSize, yoff + ysize )
+          bx, by = x1 - xBlock * xBlockSize, y1 - yBlock * yBlockSize
+          values[ y1 - yoff : y2 - yoff, x1 - xoff : x2 - xoff ] = block[ by : by + y2 - y1, bx : bx + x2 - x1 ]
+      imgValues.append( values )
+    return imgValues
+
+class ImageQualityMask():
+  # Valid pixels of tile from bitmask band(ex.: UDM of Planet Labs), True is valid
+  # Pixel is masked if 'value & bits' != 0, or 'value' != 0 if bits is None
+  # The mask can have other resolution, but the same extent of image(read by nearest)
+  def __init__(self, ds, band, bits, xsize, ysize):
+    self.ds, self.bits = ds, bits
+    self.band = ds.GetRasterBand( band )
+    self.rx, self.ry = float( ds.RasterXSize ) / xsize, float( ds.RasterYSize ) / ysize
+    self.counters = { 'tilesMasked': 0 } # Of last getValid
 
   def __del__(self):
-    if self.isSrcBand:
-      self.src = None
-    del self.fs
-  
-  def _getValues2d(self, data):
-     l = list( struct.unpack( self.fs, data ) )
-     n = self.dataRead[ 2 ] #  self.dataRead[ 2 ] = xsize
-     return [ l [ i : i + n ] for i in xrange( 0, len( l ), n ) ] # [ [band1], ..., [band2] ]
+    self.band = None
+    self.ds = None
 
-  def _getValues1d(self, data):
-    return [ list( struct.unpack( self.fs, data ) ) ] # [ [band1] ]
+  @classmethod
+  def open(cls, qualityMask, ds):
+    # qualityMask: { 'name', 'band', 'bits' }, ds: image
+    # Return { 'isOk', 'mask' } or { 'isOk', 'msg' }
+    name = qualityMask['name']
+    msg = None
+    try:
+      dsMask = gdal.Open( name, GA_ReadOnly )
+    except RuntimeError:
+      msg = gdal.GetLastErrorMsg()
+    if not msg is None:
+      return { 'isOk': False, 'msg': "Quality mask '%s': %s" % ( name, msg ) }
+    band = qualityMask.get( 'band', 1 )
+    if band < 1 or band > dsMask.RasterCount:
+      return { 'isOk': False, 'msg': "Band '%d' of quality mask '%s' not exists" % ( band, name ) }
+    if not dsMask.GetRasterBand( band ).DataType in ( gdal.GDT_Byte, gdal.GDT_UInt16, gdal.GDT_Int16, gdal.GDT_UInt32, gdal.GDT_Int32 ):
+      return { 'isOk': False, 'msg': "Band '%d' of quality mask '%s' need be integer" % ( band, name ) }
+    t, tm = ds.GetGeoTransform(), dsMask.GetGeoTransform()
+    corners = lambda t, xsize, ysize: ( t[0], t[3], t[0] + xsize * t[1], t[3] + ysize * t[5] )
+    c, cm = corners( t, ds.RasterXSize, ds.RasterYSize ), corners( tm, dsMask.RasterXSize, dsMask.RasterYSize )
+    tolerance = ( abs( tm[1] ) / 2.0, abs( tm[5] ) / 2.0 )
+    for i in xrange( 4 ):
+      if abs( c[ i ] - cm[ i ] ) > tolerance[ i % 2 ]:
+        return { 'isOk': False, 'msg': "Quality mask '%s' not have the extent of image" % name }
+    mask = cls( dsMask, band, qualityMask.get( 'bits' ), ds.RasterXSize, ds.RasterYSize )
+    return { 'isOk': True, 'mask': mask }
 
-  def getValues(self, row):
-    self.dataRead[1] = self.yoff + row
-    return self._getValues( self.src.ReadRaster( *self.dataRead ) ) 
+  def getValid(self, tile):
+    xoff, yoff, xsize, ysize = tile['xoff'], tile['yoff'], tile['xsize'], tile['ysize']
+    xsizeRead, ysizeRead = tile.get( 'xsizeRead', xsize ), tile.get( 'ysizeRead', ysize ) # Reduction
+    mx1, my1 = int( math.floor( xoff * self.rx ) ), int( math.floor( yoff * self.ry ) )
+    mx2, my2 = int( math.ceil( ( xoff + xsizeRead ) * self.rx ) ), int( math.ceil( ( yoff + ysizeRead ) * self.ry ) )
+    values = self.band.ReadAsArray( mx1, my1, max( 1, mx2 - mx1 ), max( 1, my2 - my1 ), xsize, ysize )
+    valid = values == 0 if self.bits is None else ( values & self.bits ) == 0
+    self.counters = { 'tilesMasked': 0 if valid.any() else 1 }
+    return valid
 
 class CollectionAlgorithms():
   descriptions = {
@@ -182,25 +324,34 @@ class CollectionAlgorithms():
       'description': "Calculate the mask, 255 for pixels > 0",
       'arguments': "Number of one band",
       'bandsRead': 1, 'bandsOut': 1,
-      'datatype': gdal.GDT_Byte
+      'datatype': gdal.GDT_Byte, 'nodata': 0
     },
     'norm-diff': {
       'description': "Calculate normalize difference",
       'arguments': "Numbers of two bands",
       'bandsRead': 2, 'bandsOut': 1,
-      'datatype': gdal.GDT_Float32
+      'datatype': gdal.GDT_Float32, 'nodata': 0
+    },
+    'expr': {
+      'description': "Calculate expression of bands(B1, B2, ...). Ex.: (B4-B3)/(B4+B3+0.5)*1.5",
+      'arguments': "Expression, the bands are from expression",
+      'bandsRead': None, 'bandsOut': 1, # bandsRead from expression
+      'datatype': None, 'nodata': None # From algorithm or infered from expression
     }
   }
 
   def __init__(self):
-    self.runAlgorithm = None
-    self.algorithms = self.descriptions.copy()
+    self.runAlgorithm, self.runAlgorithmArray = None, None
+    self.algorithms = {}
+    self.expressions = {} # Compiled expressions
     algs = (
-      ( 'mask', self._algMask ),
-      ( 'norm-diff', self._algNormDiff )
+      ( 'mask', self._algMask, self._algMaskArray ),
+      ( 'norm-diff', self._algNormDiff, self._algNormDiffArray ),
+      ( 'expr', None, None ) # Functions from expression, see getFunctionArray
     )
     for item in algs:
-      self.algorithms[ item[0] ].update( { 'func': item[1] } )
+      self.algorithms[ item[0] ] = self.descriptions[ item[0] ].copy()
+      self.algorithms[ item[0] ].update( { 'func': item[1], 'funcArray': item[2] } )
 
   def _algMask(self, values, x):
     band1 = values[ 0 ]
@@ -213,92 +364,948 @@ class CollectionAlgorithms():
     vsum  = float( band1[ x ] + band2[ x ] )
     return 0.0 if vsum == 0.0 else vdiff / vsum
 
-  def setAlgorithm(self, name):
+  def _algMaskArray(self, values):
+    return np.where( values[ 0 ] > 0, 255, 0 ).astype( np.uint8 )
+
+  def _algNormDiffArray(self, values):
+    # Same arithmetic of scalar path (Python float is double)
+    band1 = values[ 0 ].astype( np.float64 )
+    band2 = values[ 1 ].astype( np.float64 )
+    vdiff = band1 - band2
+    vsum  = band1 + band2
+    out = np.zeros( vsum.shape, np.float64 )
+    np.divide( vdiff, vsum, out=out, where=( vsum != 0.0 ) )
+    return out
+
+  def _algExprArray(self, bandMath, dtype, nodata, values):
+    values = bandMath.evaluate( values )
+    isValid = np.isfinite( values )
+    if np.issubdtype( dtype, np.integer ):
+      info = np.iinfo( dtype )
+      values = np.clip( np.rint( np.where( isValid, values, 0 ) ), info.min, info.max )
+    out = values.astype( dtype )
+    out[ ~isValid ] = nodata
+    return out
+
+  def _getBandMath(self, expression):
+    if not expression in self.expressions:
+      bandMath = BandMath()
+      vreturn = bandMath.compile( expression )
+      if not vreturn['isOk']:
+        return vreturn
+      self.expressions[ expression ] = bandMath
+    return { 'isOk': True, 'bandMath': self.expressions[ expression ] }
+
+  def checkAlgorithm(self, algorithm):
+    # Return algorithm with bandNumbers, datatype and nodata from expression('expr')
+    name = algorithm.get( 'name' )
+    if not name in self.algorithms:
+      return { 'isOk': False, 'msg': "Type of algorithm '%s' not valid." % name }
+    if not name == 'expr':
+      t1, t2 = len( algorithm.get( 'bandNumbers', [] ) ), self.descriptions[ name ]['bandsRead']
+      if not t1 == t2:
+        msg = "Total of bands '%d' is different of permited by algorithm '%s' '%d'." % ( t1, name, t2 )
+        return { 'isOk': False, 'msg': msg }
+      return { 'isOk': True, 'algorithm': algorithm }
+
+    if algorithm.get( 'expression' ) is None:
+      return { 'isOk': False, 'msg': "Algorithm 'expr' need 'expression'" }
+    vreturn = self._getBandMath( algorithm['expression'] )
+    if not vreturn['isOk']:
+      return vreturn
+    bandMath = vreturn['bandMath']
+    datatype = algorithm.get( 'datatype' )
+    if datatype is None:
+      datatype = gdal.GDT_Byte if bandMath.isBoolean else gdal.GDT_Float32
+    elif isinstance( datatype, basestring ):
+      datatype = gdal.GetDataTypeByName( datatype )
+    if not datatype in gdal_numpy_types:
+      return { 'isOk': False, 'msg': "Data type '%s' of algorithm 'expr' not valid" % algorithm['datatype'] }
+    nodata = algorithm.get( 'nodata' )
+    if nodata is None:
+      dtype = gdal_numpy_types[ datatype ]
+      if np.issubdtype( dtype, np.integer ):
+        info = np.iinfo( dtype )
+        nodata = info.max if info.min == 0 else info.min
+      else:
+        nodata = float('nan')
+    if np.issubdtype( gdal_numpy_types[ datatype ], np.integer ) and not np.isfinite( nodata ):
+      return { 'isOk': False, 'msg': "No data '%s' of algorithm 'expr' not valid for data type" % nodata }
+    alg = algorithm.copy()
+    alg.update( { 'bandNumbers': bandMath.bandNumbers, 'datatype': datatype, 'nodata': nodata } )
+    return { 'isOk': True, 'algorithm': alg }
+
+  def getDescription(self, algorithm):
+    # algorithm from checkAlgorithm
+    description = self.descriptions[ algorithm['name'] ].copy()
+    if algorithm['name'] == 'expr':
+      description.update( {
+        'bandsRead': len( algorithm['bandNumbers'] ),
+        'datatype': algorithm['datatype'], 'nodata': algorithm['nodata']
+      } )
+    return description
+
+  def setAlgorithm(self, algorithm):
+    # algorithm: name or algorithm from checkAlgorithm
+    name = algorithm if isinstance( algorithm, basestring ) else algorithm['name']
+    if name == 'expr':
+      funcArray = self.getFunctionArray( algorithm )
+      self.runAlgorithmArray = funcArray
+      self.runAlgorithm = lambda values, x: funcArray( [ v[ x : x + 1 ] for v in values ] )[0].item()
+      return
     self.runAlgorithm = self.algorithms[ name ]['func']
+    self.runAlgorithmArray = self.algorithms[ name ]['funcArray']
+
+  def getFunctionArray(self, algorithm):
+    # Function for algorithm without set it, used by many algorithms in same loop
+    if algorithm['name'] == 'expr':
+      bandMath = self._getBandMath( algorithm['expression'] )['bandMath']
+      dtype = gdal_numpy_types[ algorithm['datatype'] ]
+      return lambda values: self._algExprArray( bandMath, dtype, algorithm['nodata'], values )
+    return self.algorithms[ algorithm['name'] ]['funcArray']
 
   def run(self, values, x):
     return self.runAlgorithm( values, x )
 
+  def runArray(self, values):
+    return self.runAlgorithmArray( values )
+
+class PipelineStage():
+  # Thread that runs func for each item of bounded queue(put waits when the queue is full)
+  # After one error, the others items are discarded and the error is returned by close
+  def __init__(self, func, depth):
+    self.func, self.msg = func, None
+    self.queue = Queue.Queue( depth )
+    self.thread = threading.Thread( target=self._run )
+    self.thread.daemon = True
+    self.thread.start()
+
+  def _run(self):
+    while True:
+      item = self.queue.get()
+      if item is None:
+        break
+      if not self.msg is None:
+        continue
+      try:
+        self.func( *item )
+      except Exception as e:
+        self.msg = str( e )
+
+  def put(self, *item):
+    if not self.msg is None:
+      raise RuntimeError( self.msg )
+    self.queue.put( item )
+
+  def close(self):
+    # Return None or message of error
+    self.queue.put( None )
+    self.thread.join()
+    return self.msg
+
+class Progress():
+  # Call func( { 'tiles', 'totalTiles', 'pixelsPerSecond', 'eta' } ) for each tile done(eta in seconds)
+  # Tiles done by previous run(checkpoint) are not used for rate
+  def __init__(self, func, totalTiles, tilesDone=0):
+    self.func, self.totalTiles, self.tiles = func, totalTiles, tilesDone
+    self.tilesRun, self.pixels, self.t0 = 0, 0, time.time()
+
+  def add(self, tile):
+    self.tiles += 1
+    self.tilesRun += 1
+    self.pixels += tile['xsize'] * tile['ysize']
+    if self.func is None:
+      return
+    seconds = time.time() - self.t0
+    pps = self.pixels / seconds if seconds > 0 else 0.0
+    eta = seconds / self.tilesRun * ( self.totalTiles - self.tiles )
+    self.func( { 'tiles': self.tiles, 'totalTiles': self.totalTiles, 'pixelsPerSecond': pps, 'eta': eta } )
+
+class Checkpoint():
+  # Tiles(x, y) of outputs written, a run killed is resumed with same key(parameters of run)
+  # JSON lines: first is { 'key' }, others are [ [ x, y ], ... ] recorded after flush of outputs
+  seconds = 30 # Interval between flushes of outputs
+
+  def __init__(self, filename, key):
+    self.filename, self.key = filename, key
+    self.tiles, self.pending = set(), [] # Recorded and written after last flush
+    self.time = time.time()
+
+  def load(self):
+    # Return True if exists checkpoint with same key
+    self.tiles.clear()
+    if not os.path.exists( self.filename ):
+      return False
+    with open( self.filename ) as f:
+      lines = f.readlines()
+    try:
+      if not json.loads( lines[0] )['key'] == self.key:
+        return False
+    except ( IndexError, ValueError, KeyError, TypeError ):
+      return False
+    for line in lines[1:]:
+      try:
+        self.tiles.update( map( tuple, json.loads( line ) ) )
+      except ValueError: # Last line incomplete(killed writing)
+        break
+    return True
+
+  def start(self):
+    self.tiles.clear()
+    self._write( 'w', { 'key': self.key } )
+
+  def _write(self, mode, record):
+    try:
+      with open( self.filename, mode ) as f:
+        f.write( "%s\n" % json.dumps( record ) )
+        f.flush()
+        os.fsync( f.fileno() )
+    except ( IOError, OSError ) as e:
+      raise RuntimeError( "Writing checkpoint '%s': %s" % ( self.filename, str( e ) ) )
+
+  def add(self, tile, flush):
+    # flush: function for write the cache of outputs(GDAL) in files
+    self.pending.append( ( tile['x'], tile['y'] ) )
+    if time.time() - self.time >= self.seconds:
+      self.save( flush )
+
+  def save(self, flush):
+    if len( self.pending ) > 0:
+      flush()
+      self._write( 'a', self.pending )
+      self.tiles.update( self.pending )
+      self.pending = []
+    self.time = time.time()
+
+  def remove(self):
+    if os.path.exists( self.filename ):
+      os.remove( self.filename )
+
+class Cutline():
+  # Mask of cutline by window of pixels, window is classified by OGR(inside, outside or edge)
+  # only windows in edge are rasterized(pixels with center inside)
+  def __init__(self, metadata):
+    self.transform = metadata['transform']
+    self.sr = osr.SpatialReference()
+    self.sr.ImportFromWkt( metadata['srs'] )
+    self.geom = ogr.CreateGeometryFromWkt( metadata['cutline'] )
+    self.dsLayer = ogr.GetDriverByName('Memory').CreateDataSource('cutline')
+    self.layer = self.dsLayer.CreateLayer( 'cutline', self.sr, ogr.wkbUnknown )
+    feat = ogr.Feature( self.layer.GetLayerDefn() )
+    feat.SetGeometry( self.geom )
+    self.layer.CreateFeature( feat )
+    feat = None
+    self.driverMem = gdal.GetDriverByName('MEM')
+
+  def _getTransform(self, x, y):
+    t = self.transform
+    return ( t[0] + x * t[1] + y * t[2], t[1], t[2], t[3] + x * t[4] + y * t[5], t[4], t[5] )
+
+  def _getGeomWindow(self, x, y, xsize, ysize):
+    # Polygon of centers of border pixels
+    t = self._getTransform( x, y )
+    ring = ogr.Geometry( ogr.wkbLinearRing )
+    for ( px, py ) in ( ( 0, 0 ), ( xsize - 1, 0 ), ( xsize - 1, ysize - 1 ), ( 0, ysize - 1 ), ( 0, 0 ) ):
+      px, py = px + 0.5, py + 0.5
+      ring.AddPoint_2D( t[0] + px * t[1] + py * t[2], t[3] + px * t[4] + py * t[5] )
+    geom = ogr.Geometry( ogr.wkbPolygon )
+    geom.AddGeometry( ring )
+    return geom
+
+  def getMask(self, x, y, xsize, ysize):
+    # Return None(all pixels outside), True(all pixels inside) or array of bool(True is inside)
+    if xsize > 1 and ysize > 1: # Polygon of window is not degenerated
+      geom = self._getGeomWindow( x, y, xsize, ysize )
+      if not self.geom.Intersects( geom ):
+        return None
+      if self.geom.Contains( geom ):
+        return True
+    ds = self.driverMem.Create( '', xsize, ysize, 1, gdal.GDT_Byte )
+    ds.SetProjection( self.sr.ExportToWkt() )
+    ds.SetGeoTransform( self._getTransform( x, y ) )
+    gdal.RasterizeLayer( ds, [ 1 ], self.layer, burn_values=[ 1 ] )
+    mask = ds.GetRasterBand(1).ReadAsArray().astype( np.bool_ )
+    ds = None
+    if not mask.any():
+      return None
+    return True if mask.all() else mask
+
 class ProcessingImage(object):
-  isKilled = False
+  isKilled = False # All instances(ex.: handler of signal), kill() is only for the run of instance
   driverMem = gdal.GetDriverByName('MEM')
   driverTif = gdal.GetDriverByName('GTiff')
+  engines = ( 'array', 'scalar' ) # 'scalar': pixel by pixel, use for verification
+  readModes = ( 'block', 'row' ) # Only for 'array' engine
+  compressions = ( 'DEFLATE', 'LZW', 'ZSTD' )
+  bigtiffs = ( 'YES', 'NO', 'IF_NEEDED', 'IF_SAFER' )
+  defaultOptions = {
+    'engine': 'array',
+    'read': 'block',
+    'workers': 1, # Processes for tiles, only for 'array' engine
+    # Output
+    'tiled': False, 'blockSize': 256,
+    'compress': None, 'predictor': None, # predictor None: by data type of output
+    'bigtiff': None, 'compressThreads': None, # compressThreads: number or 'ALL_CPUS'
+    'creationOptions': [], # Others options of GTiff or COG driver(NAME=VALUE)
+    'cog': False, # Cloud Optimized GeoTIFF with overviews
+    'statsFile': None, # Append the statistics of run(JSON lines)
+    'tileCache': None, 'tileCacheSize': 1024, # Directory and MB of cache of blocks, only for 'array' engine
+    'cutline': False, # Pixels outside of WKT region are nodata(not read and not calculated), only for 'array' engine
+    'regions': None, # FeatureCollection(GeoJSON, EPSG 4326), one output by feature, only for 'array' engine
+    'fetchWorkers': 4, # Parallel range requests of blocks, only for remote image and 'array' engine
+    'qualityMask': None, # { 'name', 'band', 'bits' } bitmask(ex.: UDM), masked pixels are nodata, only for 'array' engine
+    'reduction': 1, # Factor of reduction of resolution(ex.: 4 is 1/4), read from overviews or decimated by GDAL
+    'pipeline': 0, # Tiles in queues of read and write stages(threads), 0 is sequential, only for 'array' engine
+    'progress': None, # Function called for each tile done( { 'tiles', 'totalTiles', 'pixelsPerSecond', 'eta' } )
+    'checkpoint': False, # Record of tiles written, a run killed is resumed(same parameters), only for 'array' engine
+    'resultCache': None, 'resultCacheSize': 10240 # Directory and MB of cache of outputs(same inputs and parameters), not for regions
+  }
+  cutlineMinGap = 64 # Columns without pixels of cutline for split the tile(ex.: parts of multipolygon)
 
   def __init__(self, idWorker):
     super(ProcessingImage, self).__init__()
     self.idWorker = idWorker
     self.wAlgorithm = CollectionAlgorithms()
     self.nameImage, self.ds, self.metadata = None, None, None
-    self.bandNumbers = None
+    self.image, self.bandNumbers = None, None
+    self.pool, self.poolWorkers = None, None
+    self.regionImage = None # Footprint of image for subsets
+    self.stats = None
+    self.lockStats = threading.Lock() # Stages of pipeline add stats
+    self.isCanceled = False # kill()
+    self.sourceKey = None # From getSourceKey in run, for caches and checkpoint
+    self._resetStats( 'image' )
   
   def __del__(self):
     self._clear()
+    self._closePool()
+
+  def kill(self):
+    # Cancel the current run of this instance(checked by tile or row), outputs with checkpoint are resumed
+    # Cleared by next run
+    self.isCanceled = True
+
+  def _isKilled(self):
+    return self.isKilled or self.isCanceled
+
+  def _closePool(self):
+    if not self.pool is None:
+      self.pool.terminate()
+      self.pool.join()
+      self.pool, self.poolWorkers = None, None
+
+  def _getPool(self, workers):
+    # Persistent pool, reused by others runs
+    if not self.poolWorkers == workers:
+      self._closePool()
+      self.pool, self.poolWorkers = multiprocessing.Pool( workers ), workers
+    return self.pool
 
   def _clear(self):
+    self.regionImage = None
     self.ds = None
     if not self.metadata is None:
       self.metadata.clear()
 
-  def _processBandOut(self, outDS):
-    p = { 'ds': self.ds, 'bandNumbers': self.bandNumbers }
-    for key in ( 'xoff', 'yoff', 'xsize' ):
-      p[ key ] = self.metadata[ key ]  
+  def _resetStats(self, key):
+    # Seconds of stages and bytes, 'image': setImage, 'run': run
+    # For 'workers' > 1, read, compute and pack are the sum of seconds of workers
+    keys = {
+      'image': ( 'open', 'subset' ),
+      'run': ( 'create', 'read', 'compute', 'pack', 'write', 'finish', 'seconds', 'bytesRead', 'bytesWritten', 'bytesFiles', 'pixels', 'tiles', 'pixelsPerSecond', 'cacheHits', 'cacheMisses', 'tilesOutside', 'tilesMasked', 'tilesResumed', 'resultCached', 'fetch', 'bytesFetched', 'requests' )
+    }
+    if self.stats is None:
+      self.stats = {}
+    for k in keys[ key ]:
+      self.stats[ k ] = 0
+    if key == 'image':
+      self._resetStats( 'run' )
+
+  def _addStats(self, stats):
+    with self.lockStats:
+      for k in stats:
+        self.stats[ k ] += stats[ k ]
+
+  def _writeStats(self, filename, filenames):
+    # JSON lines
+    record = {
+      'image': self.nameImage, 'idWorker': self.idWorker, 'filenames': filenames,
+      'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'stats': self.stats
+    }
+    with open( filename, 'a' ) as f:
+      f.write( "%s\n" % json.dumps( record ) )
+
+  def _processBandOut(self, outDS, bandNumbers, nodata, progress):
+    p = {
+      'ds': self.ds, 'bandNumbers': bandNumbers,
+      'xoff': self.metadata['xoff'], 'yoff': self.metadata['yoff'],
+      'xsize': self.metadata['xsizeRead'], 'ysize': self.metadata['ysizeRead'],
+      'xsizeOut': self.metadata['xsize'], 'reduction': self.metadata['reduction']
+    }
+    # Buffers of read and write are created one time(nothing is allocated by row)
     wvi = ImageLineValues( p )
     outBand = outDS.GetRasterBand(1)
-    fs = gdal_sctruct_types[ outBand.DataType ] * p['xsize']
-    outValues = p['xsize'] * [ None ]
-    xx = xrange( p['xsize'] )
+    outBuffer = np.empty( ( 1, p['xsizeOut'] ), gdal_numpy_types[ outBand.DataType ] )
+    outValues = outBuffer[0] # View of buffer
+    run = self.wAlgorithm.run
+    xx = xrange( p['xsizeOut'] )
+    stats, rows = self.stats, 0
+    row = { 'xsize': p['xsizeOut'], 'ysize': 1 } # Tile of progress
     for y in xrange( self.metadata['ysize'] ):
-      imgValues = wvi.getValues( y ) # [ [ band 1 ], ...,[ band N ] ], Use xoff and yoff for Subset
-      if self.isKilled:
-        del imgValues[:]
+      t1 = time.time()
+      imgValues = wvi.getValues( y ) # [ row band 1, ..., row band N ], Use xoff and yoff for Subset
+      t2 = time.time()
+      if self._isKilled():
         break
       for x in xx:
-        outValues[ x ] = self.wAlgorithm.run( imgValues, x )
-      del imgValues[:]
-      data = struct.pack( fs, *outValues )
-      outBand.WriteRaster( 0, y, outDS.RasterXSize, 1, data )
-      del data
-    del outValues[:]
-    del fs
-    outBand.SetNoDataValue( 0 )
+        outValues[ x ] = run( imgValues, x )
+      t3 = time.time()
+      outBand.WriteArray( outBuffer, 0, y )
+      stats['read'] += t2 - t1
+      stats['compute'] += t3 - t2
+      stats['write'] += time.time() - t3
+      rows += 1
+      progress.add( row )
+    stats['tiles'] += rows
+    stats['bytesRead'] += rows * wvi.bytesRead
+    stats['bytesWritten'] += rows * outBuffer.nbytes
+    stats['pixels'] += rows * p['xsizeOut']
+    del outValues, outBuffer
+    outBand.SetNoDataValue( nodata )
     outBand.FlushCache()
     outBand = None
     del wvi
 
-  def _endSetImage(self, wkt):
-    def setMetadata():
-      xoff, xsize, yoff, ysize = 0, self.ds.RasterXSize, 0, self.ds.RasterYSize
-      transform = self.ds.GetGeoTransform()
-      haveSubset = False
-      if not subset is None:
-        xoff,  yoff  = subset['x_UL'], subset['y_UL']
-        xsize, ysize = subset['x_BR'] - subset['x_UL'], subset['y_BR'] - subset['y_UL']
-        lt = list( transform )
-        lt[0] += xoff * transform[1]
-        lt[3] += yoff * transform[5]
-        transform = tuple( lt )
-        haveSubset = True
-      self.metadata = {
-          'transform': transform,
-          'srs': self.ds.GetProjection(),
-          'xoff': xoff, 'yoff': yoff, 'xsize': xsize,'ysize': ysize,
-          'subset': haveSubset, 'totalbands': self.ds.RasterCount
+  def _setTileRead(self, tile):
+    # Window of source from window of output(x, y, xsize, ysize)
+    # With reduction, 'xsizeRead' and 'ysizeRead' are the window of source(partial in edges)
+    r = self.metadata['reduction']
+    tile['xoff'], tile['yoff'] = tile['x'] * r + self.metadata['xoff'], tile['y'] * r + self.metadata['yoff']
+    if r > 1:
+      tile['xsizeRead'] = min( tile['xsize'] * r, self.metadata['xsizeRead'] - tile['x'] * r )
+      tile['ysizeRead'] = min( tile['ysize'] * r, self.metadata['ysizeRead'] - tile['y'] * r )
+    return tile
+
+  def _getTiles(self, readMode):
+    def getTile(x, y, xsize, ysize):
+      # x, y: output image; xoff, yoff: source image
+      return self._setTileRead( { 'x': x, 'y': y, 'xsize': xsize, 'ysize': ysize } )
+
+    xoff, yoff = self.metadata['xoff'], self.metadata['yoff']
+    xsize, ysize = self.metadata['xsize'], self.metadata['ysize']
+    if readMode == 'row':
+      return [ getTile( 0, y, xsize, 1 ) for y in xrange( ysize ) ]
+    if self.metadata['reduction'] > 1:
+      # Tiles of output with size of source block, each one read from many blocks of source
+      ( xBlockSize, yBlockSize ) = self.bandBlockSizes
+      tiles = []
+      for y in xrange( 0, ysize, yBlockSize ):
+        for x in xrange( 0, xsize, xBlockSize ):
+          tiles.append( getTile( x, y, min( xBlockSize, xsize - x ), min( yBlockSize, ysize - y ) ) )
+      return tiles
+
+    # Blocks of source bands intersected with subset (partial blocks in edges)
+    ( xBlockSize, yBlockSize ) = self.bandBlockSizes
+    xBlocks = xrange( xoff // xBlockSize, ( xoff + xsize - 1 ) // xBlockSize + 1 )
+    yBlocks = xrange( yoff // yBlockSize, ( yoff + ysize - 1 ) // yBlockSize + 1 )
+    tiles = []
+    for yBlock in yBlocks:
+      y1 = max( yBlock * yBlockSize, yoff )
+      y2 = min( ( yBlock + 1 ) * yBlockSize, yoff + ysize )
+      for xBlock in xBlocks:
+        x1 = max( xBlock * xBlockSize, xoff )
+        x2 = min( ( xBlock + 1 ) * xBlockSize, xoff + xsize )
+        tile = getTile( x1 - xoff, y1 - yoff, x2 - x1, y2 - y1 )
+        tile['block'] = ( xBlock, yBlock )
+        tiles.append( tile )
+    return tiles
+
+  def _prefetchTiles(self, tiles, opts):
+    # Read in advance the source of tiles(see RemoteImage)
+    return { 'isOk': True }
+
+  def _getCacheConfig(self, opts):
+    if opts['tileCache'] is None:
+      return None
+    return {
+      'dir': opts['tileCache'], 'maxBytes': opts['tileCacheSize'] * 1048576,
+      'source': self.sourceKey
+    }
+
+  def _getTilesCutline(self, tiles):
+    # Tiles outside of cutline are removed, the others are trimmed to pixels inside
+    # and splited by columns without pixels inside(cutlineMinGap)
+    # 'mask' of tile: None if all pixels are inside
+    def getRuns(flags):
+      # [ ( i1, i2 ), ... ] of True values
+      idx = np.flatnonzero( flags )
+      breaks = np.flatnonzero( np.diff( idx ) > self.cutlineMinGap )
+      starts = [ idx[0] ] + list( idx[ breaks + 1 ] )
+      ends = list( idx[ breaks ] ) + [ idx[-1] ]
+      return [ ( int( starts[ i ] ), int( ends[ i ] ) + 1 ) for i in xrange( len( starts ) ) ]
+
+    cutline = Cutline( self.metadata )
+    tilesCutline = []
+    for tile in tiles:
+      tileMask = cutline.getMask( tile['x'], tile['y'], tile['xsize'], tile['ysize'] )
+      if tileMask is None:
+        self.stats['tilesOutside'] += 1
+        continue
+      if tileMask is True:
+        t = tile.copy()
+        t['mask'] = None
+        tilesCutline.append( t )
+        continue
+      columns = tileMask.any( axis=0 )
+      for ( x1, x2 ) in getRuns( columns ):
+        idx = np.flatnonzero( tileMask[ :, x1 : x2 ].any( axis=1 ) )
+        y1, y2 = int( idx[0] ), int( idx[-1] ) + 1
+        t = tile.copy()
+        t['x'] += x1
+        t['xsize'] = x2 - x1
+        t['y'] += y1
+        t['ysize'] = y2 - y1
+        self._setTileRead( t )
+        m = tileMask[ y1 : y2, x1 : x2 ]
+        t['mask'] = None if m.all() else m.copy()
+        tilesCutline.append( t )
+    return tilesCutline
+
+  def _prefetch(self, func, items, depth):
+    # Generator of ( item, func( item ) ), func runs in thread ahead of consumer(at most depth items)
+    # The thread stops when the consumer stops(break or close) or killed
+    def reader():
+      def put(value):
+        while not stop.is_set():
+          try:
+            queue.put( value, timeout=0.1 )
+            return True
+          except Queue.Full:
+            continue
+        return False
+
+      for item in items:
+        if self._isKilled():
+          break
+        try:
+          value = ( 'ok', item, func( item ) )
+        except Exception as e:
+          put( ( 'error', str( e ) ) )
+          return
+        if not put( value ):
+          return
+      put( ( 'end', ) )
+
+    queue, stop = Queue.Queue( depth ), threading.Event()
+    thread = threading.Thread( target=reader )
+    thread.daemon = True
+    thread.start()
+    try:
+      while True:
+        value = queue.get()
+        if value[0] == 'end':
+          break
+        if value[0] == 'error':
+          raise RuntimeError( value[1] )
+        yield ( value[1], value[2] )
+    finally:
+      stop.set()
+      thread.join()
+
+  def _getTilesValues(self, tiles, outputs, cacheConfig, qualityMask, pipeline=0):
+    # Bands are read one time for all outputs
+    # outValues is None for tile with all pixels masked by quality mask(bands not read)
+    # pipeline > 0: tiles are read by thread ahead of calculation
+    def readTile(tile):
+      # Return ( valid, imgValues, stats ), imgValues is None if all pixels are masked
+      t1 = time.time()
+      valid = None if wqm is None else wqm.getValid( tile )
+      if not valid is None and not valid.any():
+        stats = { 'read': time.time() - t1, 'bytesRead': valid.nbytes }
+        stats.update( wqm.counters )
+        return ( valid, None, stats )
+      imgValues = wva.getValues( tile ) # [ array band 1, ..., array band N ], Use xoff and yoff for Subset
+      stats = { 'read': time.time() - t1, 'compute': 0.0, 'pack': 0.0, 'bytesRead': sum( map( lambda v: v.nbytes, imgValues ) ) }
+      stats.update( wva.counters )
+      return ( valid, imgValues, stats )
+
+    wva = _getImageArrayValues( self.ds, self.bandNumbers, cacheConfig )
+    wqm = None if qualityMask is None else ImageQualityMask.open( qualityMask, self.ds )['mask']
+    if pipeline > 0:
+      tilesRead = self._prefetch( readTile, tiles, pipeline )
+    else:
+      tilesRead = itertools.imap( lambda tile: ( tile, readTile( tile ) ), tiles )
+    try:
+      for ( tile, ( valid, imgValues, stats ) ) in tilesRead:
+        if imgValues is None:
+          self._addStats( stats )
+          yield ( tile, None )
+          continue
+        if self._isKilled():
+          del imgValues[:]
+          break
+        outValues = []
+        for out in outputs:
+          t1 = time.time()
+          values = out['funcArray']( [ imgValues[ i ] for i in out['bandIndexes'] ] )
+          t2 = time.time()
+          values = values.astype( out['dtype'] )
+          if not valid is None:
+            values[ ~valid ] = out['nodata']
+          outValues.append( values )
+          stats['compute'] += t2 - t1
+          stats['pack'] += time.time() - t2
+        del imgValues[:]
+        self._addStats( stats )
+        yield ( tile, outValues )
+    finally:
+      if pipeline > 0:
+        tilesRead.close() # Stop the thread of read
+      wva, wqm = None, None
+
+  def _getTilesValuesPool(self, tiles, outputs, workers, cacheConfig, qualityMask):
+    task = {
+      'class': self.__class__, 'image': self.image,
+      'bandNumbers': self.bandNumbers, 'cacheConfig': cacheConfig, 'qualityMask': qualityMask,
+      'outputs': [ ( out['algorithm'], out['bandIndexes'], out['dtype'], out['nodata'] ) for out in outputs ],
+      'tile': None
+    }
+    def getTask(tile):
+      t = task.copy()
+      t['tile'] = dict( ( k, tile[ k ] ) for k in tile if not k == 'mask' ) # Mask is used by writing
+      return t
+
+    pool = self._getPool( workers )
+    chunksize = max( 1, len( tiles ) // ( workers * 4 ) )
+    # imap: results in order of tiles
+    for ( tile, ( outValues, stats ) ) in itertools.izip( tiles, pool.imap( _processTileWorker, map( getTask, tiles ), chunksize ) ):
+      if self._isKilled():
+        self._closePool() # Cancel tasks in queue
+        break
+      self._addStats( stats )
+      yield ( tile, outValues )
+
+  def _processBandOutArray(self, outputs, opts, checkpoint=None):
+    # checkpoint: tiles recorded are not processed(resume)
+    outBands = [ out['ds'].GetRasterBand(1) for out in outputs ]
+    tiles = self._getTiles( opts['read'] )
+    if opts['cutline'] and not self.metadata['cutline'] is None:
+      tiles = self._getTilesCutline( tiles )
+    totalTiles = len( tiles )
+    if not checkpoint is None and len( checkpoint.tiles ) > 0:
+      tiles = filter( lambda t: not ( t['x'], t['y'] ) in checkpoint.tiles, tiles )
+      self.stats['tilesResumed'] = totalTiles - len( tiles )
+    progress = Progress( opts['progress'], totalTiles, totalTiles - len( tiles ) )
+    vreturn = self._prefetchTiles( tiles, opts )
+    if not vreturn['isOk']:
+      return vreturn
+    cacheConfig = self._getCacheConfig( opts )
+    if opts['workers'] > 1:
+      tilesValues = self._getTilesValuesPool( tiles, outputs, opts['workers'], cacheConfig, opts['qualityMask'] )
+    else:
+      tilesValues = self._getTilesValues( tiles, outputs, cacheConfig, opts['qualityMask'], opts['pipeline'] )
+    def flushOutputs():
+      for band in outBands:
+        band.FlushCache()
+
+    def writeTile(tile, outValues):
+      # outValues is None: masked, nodata of output
+      if self._isKilled():
+        return
+      if not outValues is None:
+        t1 = time.time()
+        for i in xrange( len( outBands ) ):
+          if not tile.get( 'mask' ) is None:
+            outValues[ i ][ ~tile['mask'] ] = outputs[ i ]['nodata']
+          outBands[ i ].WriteArray( outValues[ i ], tile['x'], tile['y'] )
+        stats = {
+          'write': time.time() - t1, 'bytesWritten': sum( map( lambda v: v.nbytes, outValues ) ),
+          'pixels': tile['xsize'] * tile['ysize'], 'tiles': 1
+        }
+        self._addStats( stats )
+        del outValues[:]
+      progress.add( tile )
+      if not checkpoint is None:
+        checkpoint.add( tile, flushOutputs )
+
+    writer = None if opts['pipeline'] == 0 else PipelineStage( writeTile, opts['pipeline'] )
+    msg = None
+    try:
+      for ( tile, outValues ) in tilesValues:
+        if writer is None:
+          writeTile( tile, outValues )
+        else:
+          writer.put( tile, outValues )
+    except Exception as e: # From worker of pool(any error), reader or writer
+      msg = str( e ) if isinstance( e, RuntimeError ) else "%s: %s" % ( e.__class__.__name__, str( e ) )
+    if not writer is None:
+      msgWriter = writer.close()
+      if msg is None:
+        msg = msgWriter
+    if not checkpoint is None: # Tiles written until error or kill
+      try:
+        checkpoint.save( flushOutputs )
+      except RuntimeError as e:
+        if msg is None:
+          msg = str( e )
+    for i in xrange( len( outBands ) ):
+      outBands[ i ].SetNoDataValue( outputs[ i ]['nodata'] )
+      outBands[ i ].FlushCache()
+      outBands[ i ] = None
+    if not msg is None:
+      return { 'isOk': False, 'msg': msg }
+    return { 'isOk': True }
+
+  def _processRegionsOutArray(self, outputs, regions, opts):
+    # outputs: one by algorithm, calculated one time by tile(source blocks read one time)
+    # regions: with 'outputs'( [ ds, ... ] in order of outputs ) and 'cutline'(None or Cutline)
+    # Tiles and regions are routed by spatial index of windows of regions
+    def getBox(x1, y1, x2, y2):
+      return ( x1, y1, x2 - 1, y2 - 1 ) # Closed box of pixels
+
+    index = SpatialIndex( [ ( getBox( *regions[ i ]['window'] ), i ) for i in xrange( len( regions ) ) ] )
+    tiles = []
+    for tile in self._getTiles( opts['read'] ):
+      tile['regions'] = sorted( index.query( getBox( tile['x'], tile['y'], tile['x'] + tile['xsize'], tile['y'] + tile['ysize'] ) ) )
+      if len( tile['regions'] ) == 0:
+        self.stats['tilesOutside'] += 1
+        continue
+      tiles.append( tile )
+    progress = Progress( opts['progress'], len( tiles ) )
+    vreturn = self._prefetchTiles( tiles, opts )
+    if not vreturn['isOk']:
+      return vreturn
+    cacheConfig = self._getCacheConfig( opts )
+    if opts['workers'] > 1:
+      tilesValues = self._getTilesValuesPool( tiles, outputs, opts['workers'], cacheConfig, opts['qualityMask'] )
+    else:
+      tilesValues = self._getTilesValues( tiles, outputs, cacheConfig, opts['qualityMask'], opts['pipeline'] )
+    outBands = [ [ ds.GetRasterBand(1) for ds in region['outputs'] ] for region in regions ]
+
+    def writeTile(tile, outValues):
+      # outValues is None: masked, nodata of outputs
+      if self._isKilled():
+        return
+      if outValues is None:
+        progress.add( tile )
+        return
+      t1 = time.time()
+      bytesWritten = 0
+      for i in tile['regions']:
+        ( x1, y1, x2, y2 ) = regions[ i ]['window']
+        # Intersection of tile and region
+        ix1, iy1 = max( tile['x'], x1 ), max( tile['y'], y1 )
+        ix2, iy2 = min( tile['x'] + tile['xsize'], x2 ), min( tile['y'] + tile['ysize'], y2 )
+        mask = None
+        if not regions[ i ]['cutline'] is None:
+          mask = regions[ i ]['cutline'].getMask( ix1 - x1, iy1 - y1, ix2 - ix1, iy2 - iy1 )
+          if mask is None:
+            continue # Nodata
+        for j in xrange( len( outputs ) ):
+          values = outValues[ j ][ iy1 - tile['y'] : iy2 - tile['y'], ix1 - tile['x'] : ix2 - tile['x'] ]
+          if not mask is None and not mask is True:
+            values = values.copy()
+            values[ ~mask ] = outputs[ j ]['nodata']
+          outBands[ i ][ j ].WriteArray( values, ix1 - x1, iy1 - y1 )
+          bytesWritten += values.nbytes
+      stats = {
+        'write': time.time() - t1, 'bytesWritten': bytesWritten,
+        'pixels': tile['xsize'] * tile['ysize'], 'tiles': 1
       }
+      self._addStats( stats )
+      del outValues[:]
+      progress.add( tile )
 
+    writer = None if opts['pipeline'] == 0 else PipelineStage( writeTile, opts['pipeline'] )
+    msg = None
+    try:
+      for ( tile, outValues ) in tilesValues:
+        if writer is None:
+          writeTile( tile, outValues )
+        else:
+          writer.put( tile, outValues )
+    except Exception as e: # From worker of pool(any error), reader or writer
+      msg = str( e ) if isinstance( e, RuntimeError ) else "%s: %s" % ( e.__class__.__name__, str( e ) )
+    if not writer is None:
+      msgWriter = writer.close()
+      if msg is None:
+        msg = msgWriter
+    for i in xrange( len( outBands ) ):
+      for j in xrange( len( outBands[ i ] ) ):
+        outBands[ i ][ j ].SetNoDataValue( outputs[ j ]['nodata'] )
+        outBands[ i ][ j ].FlushCache()
+        outBands[ i ][ j ] = None
+    if not msg is None:
+      return { 'isOk': False, 'msg': msg }
+    return { 'isOk': True }
 
+  def _getCreationOptions(self, opts, datatype):
+    co = []
+    if opts['tiled']:
+      co += [ 'TILED=YES', "BLOCKXSIZE=%d" % opts['blockSize'], "BLOCKYSIZE=%d" % opts['blockSize'] ]
+    if not opts['compress'] is None:
+      co.append( "COMPRESS=%s" % opts['compress'] )
+      predictor = opts['predictor']
+      if predictor is None:
+        predictor = 3 if datatype in ( gdal.GDT_Float32, gdal.GDT_Float64 ) else 2
+      co.append( "PREDICTOR=%d" % predictor )
+    if not opts['bigtiff'] is None:
+      co.append( "BIGTIFF=%s" % opts['bigtiff'] )
+    if not opts['compressThreads'] is None:
+      co.append( "NUM_THREADS=%s" % opts['compressThreads'] )
+    return co + list( opts['creationOptions'] )
+
+  def _createCOG(self, filenameWork, filenameOut, opts, datatype):
+    # Overviews in work image(tiled and compressed as output), and copy it to COG
+    # The work image is always removed
+    predictorsCOG = { 1: 'NO', 2: 'STANDARD', 3: 'FLOATING_POINT' }
+    msg, ds = None, None
+    try:
+      ds = gdal.Open( filenameWork, GA_Update )
+      levels, size = [], max( ds.RasterXSize, ds.RasterYSize )
+      while size > opts['blockSize']:
+        levels.append( 2 ** ( len( levels ) + 1 ) )
+        size = ( size + 1 ) // 2
+      isFloat = datatype in ( gdal.GDT_Float32, gdal.GDT_Float64 )
+      resampling = 'AVERAGE' if isFloat else 'NEAREST'
+      if len( levels ) > 0:
+        ds.BuildOverviews( resampling, levels )
+      driverCOG = gdal.GetDriverByName('COG')
+      if not driverCOG is None:
+        co = [ "BLOCKSIZE=%d" % opts['blockSize'], "OVERVIEWS=FORCE_USE_EXISTING", "RESAMPLING=%s" % resampling ]
+        if not opts['compress'] is None:
+          predictor = 'YES' if opts['predictor'] is None else predictorsCOG[ opts['predictor'] ]
+          co += [ "COMPRESS=%s" % opts['compress'], "PREDICTOR=%s" % predictor ]
+        if not opts['bigtiff'] is None:
+          co.append( "BIGTIFF=%s" % opts['bigtiff'] )
+        if not opts['compressThreads'] is None:
+          co.append( "NUM_THREADS=%s" % opts['compressThreads'] )
+        co += list( opts['creationOptions'] )
+        driver = driverCOG
+      else: # GDAL < 3.1
+        o = opts.copy()
+        o['tiled'] = True
+        co = self._getCreationOptions( o, datatype ) + [ 'COPY_SRC_OVERVIEWS=YES' ]
+        driver = self.driverTif
+      dsOut = driver.CreateCopy( filenameOut, ds, 0, co )
+      dsOut = None
+    except RuntimeError:
+      msg = gdal.GetLastErrorMsg()
+    finally:
+      ds = None
+      if os.path.exists( filenameWork ):
+        self.driverTif.Delete( filenameWork )
+    if not msg is None:
+      return { 'isOk': False, 'msg': "Creating COG '%s': %s" % ( filenameOut, msg ) }
+    return { 'isOk': True }
+
+  def _getMetadata(self, subset):
+    xoff, xsize, yoff, ysize = 0, self.ds.RasterXSize, 0, self.ds.RasterYSize
+    transform = self.ds.GetGeoTransform()
+    haveSubset, cutline = False, None
+    if not subset is None:
+      xoff,  yoff  = subset['x_UL'], subset['y_UL']
+      xsize, ysize = subset['x_BR'] - subset['x_UL'], subset['y_BR'] - subset['y_UL']
+      lt = list( transform )
+      lt[0] += xoff * transform[1]
+      lt[3] += yoff * transform[5]
+      transform = tuple( lt )
+      haveSubset, cutline = True, subset['wkt']
+    return {
+        'transform': transform,
+        'srs': self.ds.GetProjection(),
+        'xoff': xoff, 'yoff': yoff, 'xsize': xsize,'ysize': ysize,
+        'xsizeRead': xsize, 'ysizeRead': ysize, 'reduction': 1,
+        'subset': haveSubset, 'cutline': cutline, 'totalbands': self.ds.RasterCount
+    }
+
+  def _getMetadataReduction(self, metadata, reduction):
+    # Output with 1/reduction of resolution, window of source in 'xsizeRead' and 'ysizeRead'
+    if reduction == 1:
+      return metadata
+    m = metadata.copy()
+    t = metadata['transform']
+    m.update( {
+      'transform': ( t[0], t[1] * reduction, t[2] * reduction, t[3], t[4] * reduction, t[5] * reduction ),
+      'xsize': ( metadata['xsize'] + reduction - 1 ) // reduction,
+      'ysize': ( metadata['ysize'] + reduction - 1 ) // reduction,
+      'reduction': reduction
+    } )
+    return m
+
+  def _getRegionImage(self):
+    if self.regionImage is None:
+      self.regionImage = RegionImage( self.ds )
+    return self.regionImage
+
+  def _endSetImage(self, wkt):
+    t1 = time.time()
     if not wkt is None:
-      ri = RegionImage( self.ds )
-      vreturn = ri.getSubset( wkt )
+      vreturn = self._getRegionImage().getSubset( wkt )
       if not vreturn['isOk']:
         return vreturn
       subset = vreturn['subset']
     else:
       subset = None
 
-    setMetadata()
+    self.metadata = self._getMetadata( subset )
+    self.stats['subset'] = time.time() - t1
     return { 'isOk': True }
   
+  def setSubset(self, wkt):
+    # Change the subset of image already setted, the dataset is not opened again
+    if self.ds is None:
+      return { 'isOk': False, 'msg': "Need set image for setting subset" }
+    return self._endSetImage( wkt )
+
+  def _getRegions(self, featureCollection):
+    # Subset of each feature(EPSG 4326) and the union of subsets
+    # Region: { 'id', 'isOk', 'msg', 'metadata', 'window'( x1, y1, x2, y2 ) of union }
+    def getId(i, feature):
+      value = feature.get( 'id' )
+      if value is None:
+        value = ( feature.get( 'properties' ) or {} ).get( 'id', i + 1 )
+      return re.sub( '[^0-9A-Za-z_.-]', '_', str( value ) )
+
+    features = featureCollection.get( 'features' ) if isinstance( featureCollection, dict ) else None
+    if not isinstance( features, list ) or len( features ) == 0:
+      return { 'isOk': False, 'msg': "Regions need be a FeatureCollection with features" }
+    ri = self._getRegionImage()
+    regions, subsets = [], []
+    for i in xrange( len( features ) ):
+      region = { 'id': getId( i, features[ i ] ), 'isOk': False, 'msg': None, 'metadata': None, 'window': None }
+      regions.append( region )
+      geom = ogr.CreateGeometryFromJson( json.dumps( features[ i ].get( 'geometry' ) ) )
+      if geom is None:
+        region['msg'] = "Geometry of feature '%s' not valid" % region['id']
+        continue
+      wkt = geom.ExportToWkt()
+      geom.Destroy()
+      vreturn = ri.getSubset( wkt )
+      if not vreturn['isOk']:
+        region['msg'] = vreturn['msg']
+        continue
+      region['isOk'], region['metadata'] = True, self._getMetadata( vreturn['subset'] )
+      subsets.append( vreturn['subset'] )
+    if len( subsets ) == 0:
+      return { 'isOk': False, 'msg': "None region intersect with image '%s'" % self.nameImage }
+    union = { 'wkt': None }
+    for k in ( 'x_UL', 'y_UL' ):
+      union[ k ] = min( map( lambda s: s[ k ], subsets ) )
+    for k in ( 'x_BR', 'y_BR' ):
+      union[ k ] = max( map( lambda s: s[ k ], subsets ) )
+    metadata = self._getMetadata( union )
+    for region in filter( lambda r: r['isOk'], regions ):
+      m = region['metadata']
+      x1, y1 = m['xoff'] - metadata['xoff'], m['yoff'] - metadata['yoff']
+      region['window'] = ( x1, y1, x1 + m['xsize'], y1 + m['ysize'] )
+    return { 'isOk': True, 'regions': regions, 'metadata': metadata }
+
+  #@classmethod
+  #def getSourceKey(cls, image):
+    # Identify the source for TileCache, checkpoint and ResultCache
+    # return { 'isOk': True, 'key': "..." } or { 'isOk': False, 'msg' }
+
   #def setImage(self, image, subset):
     # self._clear()
     #...
@@ -306,111 +1313,585 @@ class ProcessingImage(object):
     # ...
     # return self._endSetImage(subset) 
 
-  def run(self, algorithm):
-    def getNameOut():
+  def run(self, algorithm, options=None):
+    # algorithm: { 'name', 'bandNumbers' } or { 'name': 'expr', 'expression'[, 'datatype', 'nodata'] }
+    #            or list of algorithms, the bands of list are read one time
+    def getNameOut(alg, idRegion=None):
       subset = "_subset" if self.metadata ['subset'] else ""
-      bands = "-".join( map( lambda i: "B%d" % i, self.bandNumbers ) )
-      d = ( self.nameImage, subset, algorithm['name'], bands, self.idWorker )
+      if not idRegion is None:
+        subset = "_region%s" % idRegion
+      if self.metadata['reduction'] > 1:
+        subset += "_reduction%d" % self.metadata['reduction']
+      bands = "-".join( map( lambda i: "B%d" % i, alg['bandNumbers'] ) )
+      name = alg['name']
+      if name == 'expr':
+        name = "expr-%s" % hashlib.md5( alg['expression'] ).hexdigest()[:8]
+      d = ( self.nameImage, subset, name, bands, self.idWorker )
       return "%s%s_%s_%s_work%d.tif" % d
 
-    def createDSOut():
-      def removeOut():
-        if os.path.exists( filenameOut ):
-          os.remove( filenameOut )
-        aux = "%s.aux.xml" % filenameOut
+    def getNameWork(filenameOut):
+      # For COG, the work image is copied to output
+      return "%s.tmp.tif" % os.path.splitext( filenameOut )[0] if opts['cog'] else filenameOut
+
+    def getRunKey(keysOpts):
+      # Key from source(changes of files change the key), algorithms, window and options of run
+      keysMetadata = ( 'xoff', 'yoff', 'xsize', 'ysize', 'reduction', 'cutline' )
+      record = {
+        'source': self.sourceKey, 'algorithms': algorithms,
+        'options': dict( ( k, opts[ k ] ) for k in keysOpts ),
+        'metadata': dict( ( k, self.metadata[ k ] ) for k in keysMetadata )
+      }
+      qualityMask = opts['qualityMask']
+      if not qualityMask is None and os.path.exists( qualityMask['name'] ):
+        st = os.stat( qualityMask['name'] )
+        record['qualityMask'] = ( repr( st.st_mtime ), st.st_size )
+      return hashlib.md5( json.dumps( record, sort_keys=True, default=str ) ).hexdigest()
+
+    def getCheckpoint():
+      keysOpts = ( 'read', 'cutline', 'qualityMask' ) + keysOptsOut # Tiles by read mode
+      filename = "%s.checkpoint" % getNameWork( getNameOut( algorithms[0] ) )
+      return Checkpoint( filename, getRunKey( keysOpts ) )
+
+    def openDSOut(filenameOut):
+      # Output of run killed(checkpoint)
+      filenameWork = getNameWork( filenameOut )
+      if not os.path.exists( filenameWork ):
+        return None
+      try:
+        return gdal.Open( filenameWork, GA_Update )
+      except RuntimeError:
+        return None
+
+    def createDSOut(alg, filenameOut, metadata):
+      def removeOut(filename):
+        if os.path.exists( filename ):
+          os.remove( filename )
+        aux = "%s.aux.xml" % filename
         if os.path.exists( aux ):
           os.remove( aux )
 
-      dataAlg = CollectionAlgorithms.descriptions[ algorithm['name'] ]
-      removeOut()
+      dataAlg = self.wAlgorithm.getDescription( alg )
+      filenameWork = getNameWork( filenameOut )
+      removeOut( filenameOut )
+      removeOut( filenameWork )
       d = (
-        filenameOut, self.metadata['xsize'], self.metadata['ysize'],
+        filenameWork, metadata['xsize'], metadata['ysize'],
         dataAlg['bandsOut'], dataAlg['datatype']
       )
+      if opts['cog']: # Work image tiled and compressed as output(overviews added before copy to COG)
+        o = opts.copy()
+        o['tiled'] = True
+        if o['bigtiff'] is None:
+          o['bigtiff'] = 'IF_SAFER'
+        co = self._getCreationOptions( o, dataAlg['datatype'] )
+      else:
+        co = self._getCreationOptions( opts, dataAlg['datatype'] )
       ds = None
       try:
-        ds = self.driverTif.Create( *d )
+        ds = self.driverTif.Create( *d, options=co )
       except RuntimeError:
         return None
-      ds.SetProjection( self.metadata['srs'] )
-      ds.SetGeoTransform( self.metadata['transform'] )
+      ds.SetProjection( metadata['srs'] )
+      ds.SetGeoTransform( metadata['transform'] )
+      ds.GetRasterBand(1).SetNoDataValue( dataAlg['nodata'] ) # Blocks not writed(cutline) are nodata
       return ds
 
-    def checkBandNumbersAlgorithm():
-      for i in xrange( len( algorithm['bandNumbers'] ) ):
-        bn = algorithm['bandNumbers'][ i ]
+    def checkBandNumbersAlgorithm(alg):
+      for i in xrange( len( alg['bandNumbers'] ) ):
+        bn = alg['bandNumbers'][ i ]
         if bn > self.metadata['totalbands']:
           msg = "Band '%d' is greater than total of bands '%d'" % ( bn, self.metadata['totalbands'] )
           return { 'isOk': False, 'msg': msg }
       return { 'isOk': True }
 
-    def checkBandBlockSizes(bands):
+    def checkBandBlockSizes(bands, bandNumbers):
       bandBlockSizes = map( lambda b: b.GetBlockSize(), bands )
       sizeX, sizeY = bandBlockSizes[ 0 ][ 0 ], bandBlockSizes[ 0 ][ 1 ]
       for i in xrange( 1, len( bandBlockSizes ) ):
         if sizeX != bandBlockSizes[ i ][ 0 ] or sizeY != bandBlockSizes[ i ][ 1 ]:
-          msg = ",".join( map( lambda b: str(b), self.bandNumbers ) )
+          msg = ",".join( map( lambda b: str(b), bandNumbers ) )
           msg = "Bands '%s' of image '%s' have different block sizes" % ( msg, self.nameImage )
           return { 'isOk': False, 'msg': msg }
       return { 'isOk': True }
 
-    def checkBandDatatypes(bands):
+    def checkBandDatatypes(bands, bandNumbers):
       datatypes = map( lambda b: b.DataType, bands )
       datatype = datatypes[0]
       for i in xrange( 1, len( datatypes) ):
         if datatype != datatypes[ i ]:
-          msg = ",".join( map( lambda b: str(b), self.bandNumbers ) )
+          msg = ",".join( map( lambda b: str(b), bandNumbers ) )
           msg = "Bands '%s' of image '%s' have different data types" % ( msg, self.nameImage )
           return { 'isOk': False, 'msg': msg }
       return { 'isOk': True }
 
-    vreturn = checkBandNumbersAlgorithm()
-    if not vreturn['isOk']:
-      return vreturn
-    self.bandNumbers = algorithm['bandNumbers']
+    def closeOutputs(outputs):
+      for out in outputs:
+        out['ds'] = None
+
+    def runRegions():
+      # One output by region and algorithm, the bands are read one time for all regions
+      # Return { 'isOk', 'regions': [ { 'id', 'isOk', 'msg', 'filenames' }, ... ] }
+      def closeRegions():
+        for region in regions:
+          if 'outputs' in region:
+            del region['outputs'][:]
+
+      vreturn = self._getRegions( opts['regions'] )
+      if not vreturn['isOk']:
+        return vreturn
+      regions, metadataImage = vreturn['regions'], self.metadata
+      regionsOk = filter( lambda r: r['isOk'], regions )
+      self._resetStats( 'run' )
+      tRun = time.time()
+      self.metadata = vreturn['metadata'] # Union of regions
+      outputs = []
+      for alg in algorithms:
+        outputs.append( {
+          'algorithm': alg,
+          'bandIndexes': map( lambda bn: self.bandNumbers.index( bn ), alg['bandNumbers'] ),
+          'nodata': self.wAlgorithm.getDescription( alg )['nodata'],
+          'funcArray': self.wAlgorithm.getFunctionArray( alg )
+        } )
+      for region in regionsOk:
+        region['outputs'], region['filenames'] = [], []
+        for out in outputs:
+          filenameOut = getNameOut( out['algorithm'], region['id'] )
+          if filenameOut in region['filenames']:
+            closeRegions()
+            self.metadata = metadataImage
+            return { 'isOk': False, 'msg': "Algorithm '%s' is repeated" % filenameOut }
+          ds = createDSOut( out['algorithm'], filenameOut, region['metadata'] )
+          if ds is None:
+            closeRegions()
+            self.metadata = metadataImage
+            return { 'isOk': False, 'msg': "Creating output image from '%s'" % self.nameImage }
+          region['outputs'].append( ds )
+          region['filenames'].append( filenameOut )
+        region['cutline'] = Cutline( region['metadata'] ) if opts['cutline'] else None
+      for i in xrange( len( outputs ) ):
+        outputs[ i ]['datatype'] = regionsOk[0]['outputs'][ i ].GetRasterBand(1).DataType
+        outputs[ i ]['dtype'] = gdal_numpy_types[ outputs[ i ]['datatype'] ]
+      self.stats['create'] = time.time() - tRun
+
+      vreturn = self._processRegionsOutArray( outputs, regionsOk, opts )
+      closeRegions()
+      self.metadata = metadataImage
+      if not vreturn['isOk']:
+        return vreturn
+      if self._isKilled():
+        return { 'isOk': False, 'msg': "Processing of '%s' was canceled" % self.nameImage }
+      t1 = time.time()
+      filenames = []
+      for region in regionsOk:
+        for i in xrange( len( outputs ) ):
+          if opts['cog']:
+            vreturn = self._createCOG( getNameWork( region['filenames'][ i ] ), region['filenames'][ i ], opts, outputs[ i ]['datatype'] )
+            if not vreturn['isOk']:
+              return vreturn
+          filenames.append( region['filenames'][ i ] )
+      self.stats['finish'] = time.time() - t1
+      self.stats['seconds'] = time.time() - tRun
+      self.stats['bytesFiles'] = sum( map( lambda f: os.path.getsize( f ), filenames ) )
+      if self.stats['seconds'] > 0:
+        self.stats['pixelsPerSecond'] = self.stats['pixels'] / self.stats['seconds']
+      if not opts['statsFile'] is None:
+        self._writeStats( opts['statsFile'], filenames )
+      for region in regions:
+        for k in ( 'metadata', 'window', 'outputs', 'cutline' ):
+          if k in region:
+            del region[ k ]
+        if not 'filenames' in region:
+          region['filenames'] = []
+      return { 'isOk': True, 'regions': regions, 'stats': self.stats.copy() }
+
+    def runImage():
+      # One output by algorithm, metadata of output(reduction) in self.metadata
+      # With checkpoint, the outputs of run killed are opened and only missing tiles are processed
+      # With result cache, the outputs of run with same key are restored and not processed
+      def getResult(filenames):
+        self.stats['seconds'] = time.time() - tRun
+        self.stats['bytesFiles'] = sum( map( lambda f: os.path.getsize( f ), filenames ) )
+        if self.stats['seconds'] > 0:
+          self.stats['pixelsPerSecond'] = self.stats['pixels'] / self.stats['seconds']
+        if not opts['statsFile'] is None:
+          self._writeStats( opts['statsFile'], filenames )
+        stats = self.stats.copy()
+        if isList:
+          return { 'isOk': True, 'filenames': filenames, 'stats': stats }
+        return { 'isOk': True, 'filename': filenames[0], 'stats': stats }
+
+      self._resetStats( 'run' )
+      tRun = time.time()
+      resultCache, filenames = None, map( getNameOut, algorithms )
+      if not opts['resultCache'] is None and len( set( filenames ) ) == len( filenames ):
+        resultCache = ResultCache( opts['resultCache'], opts['resultCacheSize'] * 1048576 )
+        keyResult = getRunKey( ( 'cutline', 'qualityMask' ) + keysOptsOut )
+        if resultCache.get( keyResult, filenames ):
+          self.stats['resultCached'] = 1
+          return getResult( filenames )
+      checkpoint, dsResume = None, []
+      if opts['checkpoint']:
+        checkpoint = getCheckpoint()
+        if checkpoint.load():
+          dsResume = map( lambda alg: openDSOut( getNameOut( alg ) ), algorithms )
+          if None in dsResume: # Output not exists or corrupted(process killed), new run
+            dsResume = []
+      isResume = len( dsResume ) > 0
+      outputs = []
+      for alg in algorithms:
+        filenameOut = getNameOut( alg )
+        if filenameOut in map( lambda out: out['filename'], outputs ):
+          closeOutputs( outputs )
+          return { 'isOk': False, 'msg': "Algorithm '%s' is repeated" % filenameOut }
+        ds = dsResume.pop( 0 ) if isResume else createDSOut( alg, filenameOut, self.metadata )
+        if ds is None:
+          closeOutputs( outputs )
+          msg = "Creating output image from '%s'" % self.nameImage
+          return { 'isOk': False, 'msg': msg }
+        outputs.append( {
+          'algorithm': alg, 'filename': filenameOut, 'ds': ds,
+          'bandIndexes': map( lambda bn: self.bandNumbers.index( bn ), alg['bandNumbers'] ),
+          'datatype': ds.GetRasterBand(1).DataType,
+          'dtype': gdal_numpy_types[ ds.GetRasterBand(1).DataType ],
+          'nodata': self.wAlgorithm.getDescription( alg )['nodata'],
+          'funcArray': self.wAlgorithm.getFunctionArray( alg )
+        } )
+
+      if not checkpoint is None and not isResume:
+        try:
+          checkpoint.start()
+        except RuntimeError as e:
+          closeOutputs( outputs )
+          return { 'isOk': False, 'msg': str( e ) }
+      self.stats['create'] = time.time() - tRun
+
+      if opts['engine'] == 'scalar':
+        progress = Progress( opts['progress'], self.metadata['ysize'] * len( outputs ) )
+        for out in outputs:
+          self.wAlgorithm.setAlgorithm( out['algorithm'] )
+          self._processBandOut( out['ds'], out['algorithm']['bandNumbers'], out['nodata'], progress )
+      else:
+        vreturn = self._processBandOutArray( outputs, opts, checkpoint )
+        if not vreturn['isOk']:
+          closeOutputs( outputs )
+          return vreturn
+      if self._isKilled():
+        closeOutputs( outputs )
+        msg = "Processing of '%s' was canceled" % self.nameImage
+        if not checkpoint is None:
+          msg += ", resume with same parameters"
+        return { 'isOk': False, 'msg': msg }
+
+      t1 = time.time()
+      closeOutputs( outputs )
+      if opts['cog']:
+        for out in outputs:
+          vreturn = self._createCOG( getNameWork( out['filename'] ), out['filename'], opts, out['datatype'] )
+          if not vreturn['isOk']:
+            return vreturn
+      if not checkpoint is None:
+        checkpoint.remove()
+      if not resultCache is None:
+        resultCache.put( keyResult, filenames )
+      self.stats['finish'] = time.time() - t1
+      return getResult( filenames )
+
+    self.isCanceled = False
+    opts = self.defaultOptions.copy()
+    if not options is None:
+      opts.update( options )
+    if not opts['engine'] in self.engines:
+      msg = "Engine '%s' not valid. Valids engines: %s" % ( opts['engine'], " or ".join( self.engines ) )
+      return { 'isOk': False, 'msg': msg }
+    if not opts['read'] in self.readModes:
+      msg = "Read mode '%s' not valid. Valids modes: %s" % ( opts['read'], " or ".join( self.readModes ) )
+      return { 'isOk': False, 'msg': msg }
+    if opts['workers'] < 1:
+      msg = "Total of workers '%d' need be greater than 0" % opts['workers']
+      return { 'isOk': False, 'msg': msg }
+    if not opts['compress'] is None and not opts['compress'] in self.compressions:
+      msg = "Compress '%s' not valid. Valids compress: %s" % ( opts['compress'], " or ".join( self.compressions ) )
+      return { 'isOk': False, 'msg': msg }
+    if not opts['predictor'] is None and not opts['predictor'] in ( 1, 2, 3 ):
+      msg = "Predictor '%s' not valid. Valids values: 1 or 2 or 3" % opts['predictor']
+      return { 'isOk': False, 'msg': msg }
+    if not opts['bigtiff'] is None and not opts['bigtiff'] in self.bigtiffs:
+      msg = "BIGTIFF '%s' not valid. Valids values: %s" % ( opts['bigtiff'], " or ".join( self.bigtiffs ) )
+      return { 'isOk': False, 'msg': msg }
+    if opts['blockSize'] < 16 or not opts['blockSize'] % 16 == 0:
+      msg = "Block size '%d' need be multiple of 16" % opts['blockSize']
+      return { 'isOk': False, 'msg': msg }
+    if opts['cutline'] and opts['engine'] == 'scalar':
+      return { 'isOk': False, 'msg': "Cutline is only for 'array' engine" }
+    if not opts['regions'] is None and opts['engine'] == 'scalar':
+      return { 'isOk': False, 'msg': "Regions is only for 'array' engine" }
+    if opts['fetchWorkers'] < 1:
+      msg = "Total of workers for fetch '%d' need be greater than 0" % opts['fetchWorkers']
+      return { 'isOk': False, 'msg': msg }
+    if not opts['qualityMask'] is None and opts['engine'] == 'scalar':
+      return { 'isOk': False, 'msg': "Quality mask is only for 'array' engine" }
+    if opts['reduction'] < 1:
+      msg = "Reduction '%d' need be greater than 0" % opts['reduction']
+      return { 'isOk': False, 'msg': msg }
+    if opts['reduction'] > 1 and not opts['regions'] is None:
+      return { 'isOk': False, 'msg': "Regions is only for full resolution" }
+    if opts['pipeline'] < 0:
+      msg = "Pipeline '%d' need be greater or equal than 0" % opts['pipeline']
+      return { 'isOk': False, 'msg': msg }
+    if opts['workers'] > 1 and opts['engine'] == 'scalar':
+      return { 'isOk': False, 'msg': "Workers greater than 1 is only for 'array' engine" }
+    if opts['pipeline'] > 0 and opts['engine'] == 'scalar':
+      return { 'isOk': False, 'msg': "Pipeline is only for 'array' engine" }
+    if opts['checkpoint'] and opts['engine'] == 'scalar':
+      return { 'isOk': False, 'msg': "Checkpoint is only for 'array' engine" }
+    if opts['checkpoint'] and not opts['regions'] is None:
+      return { 'isOk': False, 'msg': "Checkpoint is not for regions" }
+    if not opts['resultCache'] is None and not opts['regions'] is None:
+      return { 'isOk': False, 'msg': "Result cache is not for regions" }
+    if not opts['resultCache'] is None and opts['resultCacheSize'] < 1:
+      msg = "Size of result cache '%d' need be greater than 0" % opts['resultCacheSize']
+      return { 'isOk': False, 'msg': msg }
+    if not opts['tileCache'] is None and opts['tileCacheSize'] < 1:
+      msg = "Size of tile cache '%d' need be greater than 0" % opts['tileCacheSize']
+      return { 'isOk': False, 'msg': msg }
+
+    keysOptsOut = ( 'tiled', 'blockSize', 'compress', 'predictor', 'bigtiff', 'creationOptions', 'cog' ) # Options of outputs
+    isList = isinstance( algorithm, list )
+    algorithms = []
+    for alg in ( algorithm if isList else [ algorithm ] ):
+      vreturn = self.wAlgorithm.checkAlgorithm( alg )
+      if not vreturn['isOk']:
+        return vreturn
+      algorithms.append( vreturn['algorithm'] )
+    if len( algorithms ) == 0:
+      return { 'isOk': False, 'msg': "Need at least one algorithm for running" }
+    self.bandNumbers = [] # Bands of all algorithms
+    for alg in algorithms:
+      vreturn = checkBandNumbersAlgorithm( alg )
+      if not vreturn['isOk']:
+        return vreturn
+      bands = map( lambda b: self.ds.GetRasterBand( b ), alg['bandNumbers'] )
+      vreturn = checkBandDatatypes( bands, alg['bandNumbers'] )
+      del bands[:]
+      if not vreturn['isOk']:
+        return vreturn
+      for bn in alg['bandNumbers']:
+        if not bn in self.bandNumbers:
+          self.bandNumbers.append( bn )
 
     bands = map( lambda b: self.ds.GetRasterBand( b ), self.bandNumbers )
     self.bandBlockSizes = bands[0].GetBlockSize()
     self.datatype = bands[0].DataType
-    bandTotal = len( bands )
-    if bandTotal > 1: 
-      vreturn = checkBandBlockSizes( bands )
+    if len( bands ) > 1: 
+      vreturn = checkBandBlockSizes( bands, self.bandNumbers )
       if not vreturn['isOk']:
         del bands[:]
         return vreturn
-      vreturn = checkBandDatatypes( bands )
+    del bands[:]
+
+    self.sourceKey = None
+    if not opts['tileCache'] is None or opts['checkpoint'] or not opts['resultCache'] is None:
+      vreturn = self.getSourceKey( self.image )
       if not vreturn['isOk']:
-        del bands[:]
         return vreturn
-    del bands[:]
+      self.sourceKey = vreturn['key']
 
-    filenameOut = getNameOut()
-    ds = createDSOut()
-    if ds is None:
-      msg = "Creating output image from '%s'" % self.nameImage
-      return { 'isOk': False, 'msg': msg }
-    
-    self.wAlgorithm.setAlgorithm( algorithm['name'] )
-    self._processBandOut( ds )
+    if not opts['qualityMask'] is None:
+      vreturn = ImageQualityMask.open( opts['qualityMask'], self.ds )
+      if not vreturn['isOk']:
+        return vreturn
+      del vreturn['mask']
 
-    ds = None
-    return { 'isOk': True, 'filename': filenameOut }
+    if not opts['regions'] is None:
+      return runRegions()
+
+    metadataImage = self.metadata # Restored after run
+    self.metadata = self._getMetadataReduction( metadataImage, opts['reduction'] )
+    try:
+      return runImage()
+    finally:
+      self.metadata = metadataImage
 
 class LocalImage(ProcessingImage):
   def __init__(self, idWorker):
     super(LocalImage, self).__init__( idWorker )
+
+  @classmethod
+  def openDataset(cls, image):
+    msg = None
+    try:
+      ds = gdal.Open( image['name'], GA_ReadOnly )
+    except RuntimeError:
+      msg = gdal.GetLastErrorMsg()
+    if not msg is None:
+      return { 'isOk': False, 'msg': msg }
+
+    return { 'isOk': True, 'ds': ds }
+
+  @classmethod
+  def getSourceKey(cls, image):
+    # Changes of file change the key
+    filename = os.path.abspath( image['name'] )
+    try:
+      st = os.stat( filename )
+    except OSError as e:
+      return { 'isOk': False, 'msg': "Image '%s': %s" % ( image['name'], e.strerror ) }
+    return { 'isOk': True, 'key': "local:%s:%s:%d" % ( filename, repr( st.st_mtime ), st.st_size ) }
     
   def setImage(self, image, subset):
     self._clear()
+    self._resetStats( 'image' )
     self.nameImage = os.path.splitext(os.path.basename( image['name'] ) )[0]
+    t1 = time.time()
+    vreturn = self.openDataset( image )
+    self.stats['open'] = time.time() - t1
+    if not vreturn['isOk']:
+      return vreturn
+    self.ds, self.image = vreturn['ds'], image
+
+    return self._endSetImage( subset )
+
+class RemoteImage(ProcessingImage):
+  # GeoTIFF served by HTTP(range requests), image: { 'name': URL }
+  # Before processing, the blocks of tiles are read by coalesced and parallel range requests
+  # and the dataset is opened again as sparse file(/vsisparse/): blocks from local file and
+  # others bytes(header, blocks not read) from /vsicurl/
+  def __init__(self, idWorker):
+    super(RemoteImage, self).__init__( idWorker )
+    self.dirFetch = None
+
+  def _clear(self):
+    super(RemoteImage, self)._clear()
+    self._removeFetch()
+
+  def _removeFetch(self):
+    if self.dirFetch is None:
+      return
+    for name in os.listdir( self.dirFetch ):
+      os.remove( os.path.join( self.dirFetch, name ) )
+    os.rmdir( self.dirFetch )
+    self.dirFetch = None
+
+  @classmethod
+  def openDataset(cls, image):
+    # 'sparse': XML of sparse file, from _prefetchTiles
+    # Not list the directory of URL, the option is restored after open(local images use it)
+    name = "/vsisparse/%s" % image['sparse'] if 'sparse' in image else "/vsicurl/%s" % image['name']
+    readdir = gdal.GetConfigOption( 'GDAL_DISABLE_READDIR_ON_OPEN' )
+    gdal.SetConfigOption( 'GDAL_DISABLE_READDIR_ON_OPEN', 'EMPTY_DIR' )
     msg = None
     try:
-      self.ds = gdal.Open( image['name'], GA_ReadOnly )
+      ds = gdal.Open( name, GA_ReadOnly )
     except RuntimeError:
       msg = gdal.GetLastErrorMsg()
+    finally:
+      gdal.SetConfigOption( 'GDAL_DISABLE_READDIR_ON_OPEN', readdir )
     if not msg is None:
       return { 'isOk': False, 'msg': msg }
 
+    return { 'isOk': True, 'ds': ds }
+
+  @classmethod
+  def getSourceKey(cls, image):
+    # Changes of file(Last-Modified and size) change the key
+    st = gdal.VSIStatL( "/vsicurl/%s" % image['name'] )
+    if st is None: # Not reachable or status of error
+      return { 'isOk': False, 'msg': "Not found '%s'" % image['name'] }
+    return { 'isOk': True, 'key': "remote:%s:%s:%d" % ( image['name'], repr( st.mtime ), st.size ) }
+
+  def _getBlockRanges(self, tiles, opts):
+    # [ ( offset, size ), ... ] of blocks of bands(TIFF), blocks in tile cache are not read
+    ( xBlockSize, yBlockSize ) = self.bandBlockSizes
+    blocks = set()
+    for tile in tiles:
+      for yBlock in xrange( tile['yoff'] // yBlockSize, ( tile['yoff'] + tile['ysize'] - 1 ) // yBlockSize + 1 ):
+        for xBlock in xrange( tile['xoff'] // xBlockSize, ( tile['xoff'] + tile['xsize'] - 1 ) // xBlockSize + 1 ):
+          blocks.add( ( xBlock, yBlock ) )
+    cacheConfig = self._getCacheConfig( opts )
+    cache = None if cacheConfig is None else _getTileCache( cacheConfig )
+    ranges = set() # Pixel interleaved: same block for all bands
+    for bn in self.bandNumbers:
+      band = self.ds.GetRasterBand( bn )
+      for block in blocks:
+        if not cache is None and cache.has( TileCache.getKey( cacheConfig['source'], bn, block, self.bandBlockSizes ) ):
+          continue
+        offset = band.GetMetadataItem( "BLOCK_OFFSET_%d_%d" % block, 'TIFF' )
+        size = band.GetMetadataItem( "BLOCK_SIZE_%d_%d" % block, 'TIFF' )
+        if offset is None or size is None: # Not TIFF or empty block, read by /vsicurl/
+          continue
+        ranges.add( ( int( offset ), int( size ) ) )
+      band = None
+    return list( ranges )
+
+  def _writeSparse(self, ranges, length):
+    # ranges: [ ( offset, data ), ... ] sorted and not overlapped
+    # Return filename of XML
+    def getRegion(filename, relative, offsetDest, offsetSrc, size):
+      return (
+        "  <SubfileRegion>\n"
+        "    <Filename relative=\"%d\">%s</Filename>\n"
+        "    <DestinationOffset>%d</DestinationOffset>\n"
+        "    <SourceOffset>%d</SourceOffset>\n"
+        "    <RegionLength>%d</RegionLength>\n"
+        "  </SubfileRegion>\n" ) % ( relative, escape( filename ), offsetDest, offsetSrc, size )
+
+    self._removeFetch()
+    self.dirFetch = tempfile.mkdtemp( prefix='remoteimage_' )
+    filenameData = os.path.join( self.dirFetch, 'blocks.bin' )
+    filenameXml = os.path.join( self.dirFetch, 'sparse.xml' )
+    url = "/vsicurl/%s" % self.image['name']
+    regions, offsetData, offset = [], 0, 0
+    with open( filenameData, 'wb' ) as f:
+      for ( o, data ) in ranges:
+        if o > offset: # Header and blocks not read
+          regions.append( getRegion( url, 0, offset, offset, o - offset ) )
+        f.write( data )
+        regions.append( getRegion( os.path.basename( filenameData ), 1, o, offsetData, len( data ) ) )
+        offsetData += len( data )
+        offset = o + len( data )
+    if offset < length:
+      regions.append( getRegion( url, 0, offset, offset, length - offset ) )
+    with open( filenameXml, 'w' ) as f:
+      f.write( "<VSISparseFile>\n  <Length>%d</Length>\n%s</VSISparseFile>\n" % ( length, ''.join( regions ) ) )
+    return filenameXml
+
+  def _prefetchTiles(self, tiles, opts):
+    t1 = time.time()
+    image = dict( ( k, self.image[ k ] ) for k in self.image if not k == 'sparse' )
+    self.image = image
+    if self.metadata['reduction'] > 1: # GDAL read from overviews, not from blocks of full resolution
+      return { 'isOk': True }
+    ranges = self._getBlockRanges( tiles, opts )
+    if len( ranges ) == 0:
+      return { 'isOk': True }
+    st = gdal.VSIStatL( "/vsicurl/%s" % image['name'] )
+    if st is None:
+      return { 'isOk': False, 'msg': "Not found size of '%s'" % image['name'] }
+    reader = RangeReader( image['name'], opts['fetchWorkers'] )
+    vreturn = reader.read( ranges )
+    if not vreturn['isOk']:
+      return vreturn
+    imageSparse = image.copy()
+    imageSparse['sparse'] = self._writeSparse( vreturn['ranges'], st.size )
+    vreturn = self.openDataset( imageSparse )
+    if not vreturn['isOk']:
+      return vreturn
+    self.ds, self.image = vreturn['ds'], imageSparse
+    stats = { 'fetch': time.time() - t1, 'bytesFetched': reader.counters['bytes'], 'requests': reader.counters['requests'] }
+    self._addStats( stats )
+    return { 'isOk': True }
+
+  def setImage(self, image, subset):
+    self._clear()
+    self._resetStats( 'image' )
+    self.nameImage = os.path.splitext( os.path.basename( image['name'].split( '?' )[0] ) )[0]
+    t1 = time.time()
+    vreturn = self.openDataset( image )
+    self.stats['open'] = time.time() - t1
+    if not vreturn['isOk']:
+      return vreturn
+    self.ds, self.image = vreturn['ds'], image
+
     return self._endSetImage( subset )
 
 class PLScene(ProcessingImage):
@@ -418,27 +1899,108 @@ class PLScene(ProcessingImage):
   
   def __init__(self, idWorker):
     super(PLScene, self).__init__( idWorker )
-    
-  def setImage(self, image, subset):
-    if self.PL_API_KEY is None:
-      msg = "API KEY for Planet Labs is not defined in host"
-      return { 'isOk': False, 'msg': msg }
 
-    self._clear()
-    self.nameImage = image['name']
+  @classmethod
+  def openDataset(cls, image):
     opts = [
       ( 'VERSION', 'V0' ),
-      ( 'API_KEY', self.PL_API_KEY ),
-      ( 'SCENE', self.nameImage ),
+      ( 'API_KEY', cls.PL_API_KEY ),
+      ( 'SCENE', image['name'] ),
       ( 'PRODUCT_TYPE', image['PRODUCT_TYPE'] )
     ]
     open_opts = map( lambda x: "%s=%s" % ( x[0], x[1] ), opts )
     msg = None
     try:
-      self.ds = gdal.OpenEx( 'PLScenes:', gdal.OF_RASTER, open_options=open_opts )
+      ds = gdal.OpenEx( 'PLScenes:', gdal.OF_RASTER, open_options=open_opts )
     except RuntimeError:
       msg = gdal.GetLastErrorMsg()
     if not msg is None:
       return { 'isOk': False, 'msg': msg }
 
+    return { 'isOk': True, 'ds': ds }
+
+  @classmethod
+  def getSourceKey(cls, image):
+    return { 'isOk': True, 'key': "PLScenes:%s:%s" % ( image['name'], image['PRODUCT_TYPE'] ) }
+    
+  def setImage(self, image, subset):
+    if self.PL_API_KEY is None:
+      msg = "API KEY for Planet Labs is not defined in host"
+      return { 'isOk': False, 'msg': msg }
+
+    self._clear()
+    self._resetStats( 'image' )
+    self.nameImage = image['name']
+    t1 = time.time()
+    vreturn = self.openDataset( image )
+    self.stats['open'] = time.time() - t1
+    if not vreturn['isOk']:
+      return vreturn
+    self.ds, self.image = vreturn['ds'], image
+
     return self._endSetImage( subset )
+
+# Cache by process, the total of bytes of cache is calculated one time
+_tileCaches = {}
+
+def _getTileCache(cacheConfig):
+  key = ( cacheConfig['dir'], cacheConfig['maxBytes'] )
+  if not key in _tileCaches:
+    _tileCaches[ key ] = TileCache( cacheConfig['dir'], cacheConfig['maxBytes'] )
+  return _tileCaches[ key ]
+
+def _getImageArrayValues(ds, bandNumbers, cacheConfig):
+  # cacheConfig: None or { 'dir', 'maxBytes', 'source' }
+  if cacheConfig is None:
+    return ImageArrayValues( ds, bandNumbers )
+  return ImageArrayValuesCache( ds, bandNumbers, _getTileCache( cacheConfig ), cacheConfig['source'] )
+
+# Worker of pool(ProcessingImage.run with 'workers' > 1)
+# Each process open its dataset, read tile and calculate the algorithm
+_workerData = { 'source': None, 'ds': None, 'wva': None, 'wqm': None, 'wAlgorithm': None }
+
+def _processTileWorker(task):
+  # Return ( None, stats ) for tile with all pixels masked by quality mask
+  cacheConfig, qualityMask = task['cacheConfig'], task['qualityMask']
+  source = (
+    task['class'], task['image'], tuple( task['bandNumbers'] ),
+    None if cacheConfig is None else tuple( sorted( cacheConfig.items() ) ),
+    None if qualityMask is None else tuple( sorted( qualityMask.items() ) )
+  )
+  if not _workerData['source'] == source:
+    _workerData['wva'], _workerData['wqm'], _workerData['ds'] = None, None, None
+    vreturn = task['class'].openDataset( task['image'] )
+    if not vreturn['isOk']:
+      raise RuntimeError( vreturn['msg'] )
+    _workerData['ds'] = vreturn['ds']
+    _workerData['wva'] = _getImageArrayValues( _workerData['ds'], task['bandNumbers'], cacheConfig )
+    if not qualityMask is None:
+      vreturn = ImageQualityMask.open( qualityMask, _workerData['ds'] )
+      if not vreturn['isOk']:
+        raise RuntimeError( vreturn['msg'] )
+      _workerData['wqm'] = vreturn['mask']
+    _workerData['wAlgorithm'] = CollectionAlgorithms()
+    _workerData['source'] = source
+  t1 = time.time()
+  valid = None if _workerData['wqm'] is None else _workerData['wqm'].getValid( task['tile'] )
+  if not valid is None and not valid.any():
+    stats = { 'read': time.time() - t1, 'bytesRead': valid.nbytes }
+    stats.update( _workerData['wqm'].counters )
+    return ( None, stats )
+  imgValues = _workerData['wva'].getValues( task['tile'] )
+  stats = { 'read': time.time() - t1, 'compute': 0.0, 'pack': 0.0, 'bytesRead': sum( map( lambda v: v.nbytes, imgValues ) ) }
+  stats.update( _workerData['wva'].counters )
+  outValues = []
+  for ( algorithm, bandIndexes, dtype, nodata ) in task['outputs']:
+    funcArray = _workerData['wAlgorithm'].getFunctionArray( algorithm )
+    t1 = time.time()
+    values = funcArray( [ imgValues[ i ] for i in bandIndexes ] )
+    t2 = time.time()
+    values = values.astype( dtype )
+    if not valid is None:
+      values[ ~valid ] = nodata
+    outValues.append( values )
+    stats['compute'] += t2 - t1
+    stats['pack'] += time.time() - t2
+  del imgValues[:]
+  return ( outValues, stats )
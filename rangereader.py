@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+Name                 : Range reader
+Description          : Read byte ranges of remote file(HTTP), adjacent ranges
+                       are coalesced and requests are parallel
+Arguments            : URL and list of ranges(offset, size)
+
+                       -------------------
+begin                : 2016-08-11
+copyright            : (C) 2016 by Luiz Motta
+email                : motta dot luiz at gmail.com
+
+ ***************************************************************************/
+"""
+
+import threading, Queue
+
+from downloadscenes import HttpClient
+
+class RangeReader():
+  # One HttpClient by thread(connections reused between requests)
+  # Ranges with gap less than maxGap are read in one request(bytes of gap are discarded)
+  maxGap = 16384
+  maxRequest = 16777216 # Max bytes by request, except for one range greater than it
+
+  def __init__(self, url, workers=4, timeout=60):
+    self.url, self.workers, self.timeout = url, workers, timeout
+    self.counters = { 'requests': 0, 'bytes': 0 }
+
+  @classmethod
+  def coalesce(cls, ranges):
+    # ranges: [ ( offset, size ), ... ]
+    # Return [ ( offset, size ), ... ] sorted and merged
+    merged = []
+    for ( offset, size ) in sorted( set( ranges ) ):
+      if size <= 0:
+        continue
+      if len( merged ) > 0:
+        ( o, s ) = merged[-1]
+        end = max( o + s, offset + size )
+        if offset <= o + s + cls.maxGap and end - o <= cls.maxRequest:
+          merged[-1] = ( o, end - o )
+          continue
+      merged.append( ( offset, size ) )
+    return merged
+
+  def _read(self, client, offset, size):
+    # Return { 'isOk', 'data' } or { 'isOk', 'msg'[, 'noRange'] }
+    end = offset + size - 1
+    vreturn = client.request( 'GET', self.url, { 'Range': "bytes=%d-%d" % ( offset, end ) } )
+    if not vreturn['isOk']:
+      return vreturn
+    response, status = vreturn['response'], vreturn['status']
+    if status == 200: # Server not accept Range, the body(whole file) is not read
+      client.close()
+      return { 'isOk': False, 'noRange': True, 'msg': "GET %s: server not accept Range" % self.url }
+    data = response.read()
+    if not status == 206:
+      return { 'isOk': False, 'msg': "GET %s(bytes %d-%d): status %d" % ( self.url, offset, end, status ) }
+    if not len( data ) == size:
+      return { 'isOk': False, 'msg': "GET %s(bytes %d-%d): read %d bytes" % ( self.url, offset, end, len( data ) ) }
+    return { 'isOk': True, 'data': data }
+
+  def _readWhole(self, merged):
+    # One request without Range, only the bytes of merged ranges are kept
+    # Return { 'isOk', 'ranges': [ data, ... ] } or { 'isOk', 'msg' }
+    client = HttpClient( None, self.timeout )
+    try:
+      vreturn = client.request( 'GET', self.url )
+      if not vreturn['isOk']:
+        return vreturn
+      response, status = vreturn['response'], vreturn['status']
+      if not status == 200:
+        response.read()
+        return { 'isOk': False, 'msg': "GET %s: status %d" % ( self.url, status ) }
+      datas = [ [] for r in merged ]
+      i, position = 0, 0
+      while i < len( merged ):
+        data = response.read( HttpClient.sizeChunk )
+        if data == '':
+          return { 'isOk': False, 'msg': "GET %s: read %d bytes" % ( self.url, position ) }
+        end = position + len( data )
+        j = i
+        while j < len( merged ) and merged[ j ][0] < end:
+          ( offset, size ) = merged[ j ]
+          if offset + size > position:
+            datas[ j ].append( data[ max( offset - position, 0 ) : offset + size - position ] )
+          j += 1
+        while i < len( merged ) and merged[ i ][0] + merged[ i ][1] <= end:
+          i += 1
+        position = end
+      self.counters['requests'] += 1
+      return { 'isOk': True, 'ranges': map( ''.join, datas ) }
+    finally:
+      client.close() # Not read the rest of file
+
+  def read(self, ranges):
+    # Return { 'isOk', 'ranges': [ ( offset, data ), ... ](coalesced) } or { 'isOk', 'msg' }
+    # If the server not accept Range, the file is read one time(_readWhole)
+    def worker():
+      client = HttpClient( None, self.timeout )
+      while True:
+        item = queue.get()
+        if item is None:
+          break
+        ( i, offset, size ) = item
+        if noRange.is_set():
+          results[ i ] = { 'isOk': False, 'noRange': True }
+          continue
+        try:
+          results[ i ] = self._read( client, offset, size )
+        except Exception as e:
+          results[ i ] = { 'isOk': False, 'msg': str( e ) }
+        if results[ i ].get( 'noRange' ):
+          noRange.set()
+      client.close()
+
+    merged = self.coalesce( ranges )
+    results = [ None ] * len( merged )
+    queue, noRange = Queue.Queue(), threading.Event()
+    for i in xrange( len( merged ) ):
+      queue.put( ( i, merged[ i ][0], merged[ i ][1] ) )
+    threads = [ threading.Thread( target=worker ) for i in xrange( min( self.workers, len( merged ) ) ) ]
+    for thread in threads:
+      thread.daemon = True
+      thread.start()
+      queue.put( None )
+    for thread in threads:
+      thread.join()
+    if noRange.is_set():
+      self.counters['requests'] += len( filter( lambda r: 'data' in r, results ) )
+      vreturn = self._readWhole( merged )
+      if not vreturn['isOk']:
+        return vreturn
+      results = map( lambda data: { 'isOk': True, 'data': data }, vreturn['ranges'] )
+    else:
+      self.counters['requests'] += len( merged )
+    for r in results:
+      if not r['isOk']:
+        return r
+    self.counters['bytes'] += sum( map( lambda r: len( r['data'] ), results ) )
+    return { 'isOk': True, 'ranges': [ ( merged[ i ][0], results[ i ]['data'] ) for i in xrange( len( merged ) ) ] }
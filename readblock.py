@@ -2,9 +2,10 @@
 # -*- coding: utf-8 -*-
 """
 /***************************************************************************
-Name                 : Test Read and Write block
-Description          : Create new image, add 100 for each pixel
-Arguments            : Georeferencing Inage
+Name                 : Test Read block
+Description          : Compare throughput of read by row and read by block
+                       (ProcessingImage with 'array' engine)
+Arguments            : Georeferencing Inage, algorithm and bands
 
                        -------------------
 begin                : 2016-08-11
@@ -23,128 +24,98 @@ email                : motta dot luiz at gmail.com
  ***************************************************************************/
 """
 
-import os, struct
+import os, sys, argparse, datetime
 
 from osgeo import gdal
-from gdalconst import GA_ReadOnly
 
+from processingimage import RegionImage, CollectionAlgorithms, ProcessingImage, LocalImage
 
-gdal_sctruct_types = {
-  gdal.GDT_Byte: 'B',
-  gdal.GDT_UInt16: 'H',
-  gdal.GDT_Int16: 'h',
-  gdal.GDT_UInt32: 'I',
-  gdal.GDT_Int32: 'i',
-  gdal.GDT_Float32: 'f',
-  gdal.GDT_Float64: 'd'
-}
+def run(filenameIn, algorithm, wkt, repeat):
+  def runReadMode(readMode):
+    worker = LocalImage( 1 )
+    vreturn = worker.setImage( { 'name': filenameIn }, wkt )
+    if not vreturn['isOk']:
+      return vreturn
+    # Clean block cache of GDAL, each mode read from file
+    cacheMax = gdal.GetCacheMax()
+    gdal.SetCacheMax( 0 )
+    gdal.SetCacheMax( cacheMax )
+    t1 = datetime.datetime.now()
+    vreturn = worker.run( algorithm, { 'engine': 'array', 'read': readMode } )
+    seconds = ( datetime.datetime.now() - t1 ).total_seconds()
+    if not vreturn['isOk']:
+      return vreturn
+    pixels = worker.metadata['xsize'] * worker.metadata['ysize']
+    del worker
+    return { 'isOk': True, 'seconds': seconds, 'pixels': pixels, 'filename': vreturn['filename'] }
 
-def run(filenameIn):
-  def sum100(value):
-    return value + 100
-  
-  def setBlockOutValue(dataRead, xOff, yOff, func):
-    def getBlocksSizeValid(off, blockSize, bandSize):
-      valid = blockSize
-      if ( off + 1 ) * blockSize > bandSize:
-        valid = bandSize - off * blockSize
-      return valid
-  
-    values = list( struct.unpack( fsRead, dataRead) )
-    yBlocksSizeValid = getBlocksSizeValid( yOff, yBlockSize, yBandSize )
-    xBlocksSizeValid = getBlocksSizeValid( xOff, xBlockSize, xBandSize )
-    for yOffValid in xrange( yBlocksSizeValid ):
-      for xOffValid in xrange( xBlocksSizeValid ):
-        i = xOffValid + yOffValid * xBlockSize
-        outValues[ i ] = func( values[ i ] )
-  
-  def getMetadataImages():
-    def GetMetadataBandBlock(band):
-      f = lambda b: ( [ b.XSize, b.YSize ], band.GetBlockSize() )
-      ( xBandSize, yBandSize ), ( xBlockSize, yBlockSize ) = f( band )
-      xNumBlocks = ( xBandSize + xBlockSize - 1 ) / xBlockSize
-      yNumBlocks = ( yBandSize + yBlockSize - 1 ) / yBlockSize
-      
-      return {
-        'xBandSize':  xBandSize,  'yBandSize':  yBandSize,
-        'xBlockSize': xBlockSize, 'yBlockSize': yBlockSize,
-        'xNumBlocks': ( xBandSize + xBlockSize - 1 ) / xBlockSize,
-        'yNumBlocks': ( yBandSize + yBlockSize - 1 ) / yBlockSize
-      }
-    
-    dsIn = gdal.Open( filenameIn, GA_ReadOnly )
-    transform = dsIn.GetGeoTransform()
-    srs = dsIn.GetProjection()
-    bandIn = dsIn.GetRasterBand( 1 )
-    datatype = bandIn.DataType
-
-    name = os.path.splitext( os.path.basename( filenameIn ) )[0]
-    filenameOut = "%s_out.tif" % name
-    driverTif = gdal.GetDriverByName('GTiff')
-    d = ( filenameOut, xsize, xsize, 1, datatype )
-    dsOut = driverTif.Create( *d )
-    dsOut.SetProjection( srs )
-    dsOut.SetGeoTransform( transform )
-    bandOut = dsOut.GetRasterBand( 1 )
-
-    metadataIn =  { 'dsIn':  dsIn,  'bandIn':  bandIn  }
-    metadataIn.update( GetMetadataBandBlock( bandIn ) )
-    metadataOut = { 'dsOut': dsOut, 'bandOut': bandOut }
-    metadataOut.update( GetMetadataBandBlock( bandOut ) )
-    
-    return { 'in': metadataIn, 'out': metadataOut }
-    
-  sizeImageBlock = lambda b: ( [ b.XSize, b.YSize ], b.GetBlockSize() )
-  ( xBandSize, yBandSize ), ( xBlockSize, yBlockSize ) = sizeImageBlock( band )
-  xNumBlocks = ( xBandSize + xBlockSize - 1 ) / xBlockSize
-  yNumBlocks = ( yBandSize + yBlockSize - 1 ) / yBlockSize
-  
-  fsRead = gdal_sctruct_types[ datatype ] * xBlockSize * yBlockSize
-  xx = xrange( xNumBlocks )
-  
-  filenameOut = "/home/lmotta/data/plscenes/data/20141007_192530_0812_sub_out.tif"
-  outDS = createDSOut()
-  outBand = outDS.GetRasterBand( 1 )
-  ( xsize, ysize ) = outBand.GetBlockSize()
-  fsWrite   = gdal_sctruct_types[ datatype ] * xsize * ysize
-  outValues = xsize * ysize * [ 0 ]
-  for yOff in xrange( yNumBlocks  ):
-    for xOff in xx:
-      data = band.ReadBlock( xOff, yOff )
-      setBlockOutValue( data, xOff, yOff, sum100)
-      del data
-      data = struct.pack( fsWrite, *outValues )
-      outBand.WriteBlock( xOff, yOff, data )
-      del data
-  
-  del outValues[:]
-  band.FlushCache()
-  band = None
-  ds = None
-  outBand.FlushCache()
-  outBand = None
-  outDS = None
+  # Read discarded for page cache of OS(all modes read the file warm)
+  # Order of modes alternated in each repeat, the best time by mode is used
+  vreturn = runReadMode( ProcessingImage.readModes[0] )
+  if not vreturn['isOk']:
+    print "Error: %s" % vreturn['msg']
+    return 1
+  results = {}
+  for i in xrange( repeat ):
+    readModes = ProcessingImage.readModes if i % 2 == 0 else ProcessingImage.readModes[::-1]
+    for readMode in readModes:
+      vreturn = runReadMode( readMode )
+      if not vreturn['isOk']:
+        print "Error: %s" % vreturn['msg']
+        return 1
+      if not readMode in results or vreturn['seconds'] < results[ readMode ]['seconds']:
+        results[ readMode ] = vreturn
+  for readMode in ProcessingImage.readModes:
+    r = results[ readMode ]
+    pps = r['pixels'] / r['seconds'] if r['seconds'] > 0 else 0.0
+    print "%-10s %12.3f s %16.0f pixels/s" % ( readMode, r['seconds'], pps )
+  if results['block']['seconds'] > 0:
+    print "Speedup block/row: %.2f" % ( results['row']['seconds'] / results['block']['seconds'] )
+  return 0
 
 def main():
-  def removeFile(filename):
-    if os.path.exists( filename ):
-      os.remove( filename )
-    name = os.path.splitext( os.path.basename( filename ) )[0]    
-    aux = "%s.aux.xml" % name
-    if os.path.exists( aux ):
-      os.remove( aux )
-
-  d = "Image processing (create imagem sum 100 ) - Test with ReadBlock and Write Block."
+  a_d = CollectionAlgorithms.descriptions
+  d = "Image processing - Compare throughput of read by row and read by block."
   parser = argparse.ArgumentParser(description=d )
   d = "Input file name of image"
   parser.add_argument('filenameIn', metavar='filenameIn', type=str, help=d )
+  d = "Name of algorithm: %s" % ','.join( a_d.keys() )
+  parser.add_argument('algorithm', metavar='algorithm', type=str, help=d )
+  d = "Number of bands(separated by comma and no spaces). Ex.: 1,2. For 'expr', the expression(between double quotes)"
+  parser.add_argument('bands', metavar='bands', type=str, help=d )
+  d = "WKT(between double quotes) for region. Use EPSG 4326 for SRS"
+  parser.add_argument('-w', metavar='WKT_Region', dest='wkt4326', type=str, help=d)
+  d = "Repeat of each read mode, the best time is used (default 3)"
+  parser.add_argument('-n', metavar='repeat', dest='repeat', type=int, default=3, help=d)
 
   args = parser.parse_args()
   if not os.path.exists( args.filenameIn ):
     print "Missing file '%s'." % args.filenameIn
     return 1
-  removeFile( args.filenameIn )
-  run( args.filenameIn )
+  if args.repeat < 1:
+    print "Repeat '%d' need be greater than 0" % args.repeat
+    return 1
+  if not args.algorithm in a_d.keys():
+    print "Type of algorithm '%s' not valid." % args.algorithm
+    return 1
+  if args.algorithm == 'expr':
+    algorithm = { 'name': 'expr', 'expression': args.bands }
+  else:
+    values = args.bands.split(',')
+    for i in xrange( len( values ) ):
+      if not values[ i ].isdigit():
+        print "Band '%s' is not a number." % values[ i ]
+        return 1
+    algorithm = { 'name': args.algorithm, 'bandNumbers': map( lambda s: int(s), values ) }
+  vreturn = CollectionAlgorithms().checkAlgorithm( algorithm )
+  if not vreturn['isOk']:
+    print vreturn['msg']
+    return 1
+  if not args.wkt4326 is None and not RegionImage.isValidGeom( args.wkt4326 ):
+    print "The WKT '%s' not valid." % args.wkt4326
+    return 1
+
+  return run( args.filenameIn, algorithm, args.wkt4326, args.repeat )
 
 if __name__ == "__main__":
     sys.exit( main() )
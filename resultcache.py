@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+Name                 : Result cache
+Description          : Cache in disk of outputs of runs(key from inputs and
+                       parameters), size bounded with LRU eviction, shared by processes
+Arguments            : Directory of cache and max size in bytes
+
+                       -------------------
+begin                : 2016-08-11
+copyright            : (C) 2016 by Luiz Motta
+email                : motta dot luiz at gmail.com
+
+ ***************************************************************************/
+"""
+
+import os, errno, fcntl, json, time, shutil
+
+class ResultCache():
+  # Each key is one directory with the files of outputs(hard links or copies)
+  # Index(JSON) with files, bytes and last access of keys, changed only with lock of file
+  # The outputs are restored by hard link(or copy), outputs must not be changed in place
+  # Eviction until lowWater of maxBytes
+  lowWater = 0.9
+  nameIndex = 'index.json'
+
+  def __init__(self, dirCache, maxBytes):
+    self.dirCache, self.maxBytes = dirCache, maxBytes
+    self.fileIndex = os.path.join( dirCache, self.nameIndex )
+    self.fileLock = os.path.join( dirCache, '.lock' )
+    self.counters = { 'hits': 0, 'misses': 0, 'puts': 0, 'evictions': 0 }
+    if not os.path.exists( dirCache ):
+      try:
+        os.makedirs( dirCache )
+      except OSError as e:
+        if not e.errno == errno.EEXIST: # Created by other process
+          raise
+
+  def _getDir(self, key):
+    return os.path.join( self.dirCache, key[:2], key )
+
+  def _readIndex(self):
+    # { key: { 'files', 'bytes', 'access' } }
+    try:
+      with open( self.fileIndex ) as f:
+        return json.load( f )
+    except ( IOError, ValueError ): # Not exists or corrupted, outputs are recreated
+      return {}
+
+  def _writeIndex(self, index):
+    filenameWork = "%s.%d.tmp" % ( self.fileIndex, os.getpid() )
+    with open( filenameWork, 'w' ) as f:
+      json.dump( index, f )
+    os.rename( filenameWork, self.fileIndex )
+
+  def _removeKey(self, index, key):
+    shutil.rmtree( self._getDir( key ), ignore_errors=True )
+    del index[ key ]
+
+  def _evict(self, index):
+    total = sum( map( lambda e: e['bytes'], index.values() ) )
+    if total <= self.maxBytes:
+      return
+    for key in sorted( index.keys(), key=lambda k: index[ k ]['access'] ): # Older access first
+      if total <= self.lowWater * self.maxBytes:
+        break
+      total -= index[ key ]['bytes']
+      self._removeKey( index, key )
+      self.counters['evictions'] += 1
+
+  @staticmethod
+  def _place(source, target):
+    # Hard link, copy if other file system
+    if os.path.exists( target ):
+      if os.path.samefile( source, target ):
+        return
+      os.remove( target )
+    try:
+      os.link( source, target )
+    except OSError:
+      shutil.copy2( source, target )
+
+  def _runLocked(self, func):
+    with open( self.fileLock, 'a' ) as f:
+      fcntl.flock( f, fcntl.LOCK_EX )
+      try:
+        return func()
+      finally:
+        fcntl.flock( f, fcntl.LOCK_UN )
+
+  def get(self, key, filenames):
+    # filenames: outputs, in same order of put
+    # Return True if outputs are restored from cache
+    def get():
+      index = self._readIndex()
+      entry = index.get( key )
+      if entry is None or not len( entry['files'] ) == len( filenames ):
+        return False
+      sources = map( lambda f: os.path.join( self._getDir( key ), f ), entry['files'] )
+      if not all( map( os.path.exists, sources ) ): # Removed outside of cache
+        self._removeKey( index, key )
+        self._writeIndex( index )
+        return False
+      for ( source, target ) in zip( sources, filenames ):
+        self._place( source, target )
+      entry['access'] = time.time()
+      self._writeIndex( index )
+      return True
+
+    try:
+      isOk = self._runLocked( get )
+    except ( IOError, OSError ): # Cache is optional, the outputs are created
+      isOk = False
+    self.counters['hits' if isOk else 'misses'] += 1
+    return isOk
+
+  def put(self, key, filenames):
+    def put():
+      index = self._readIndex()
+      if key in index:
+        self._removeKey( index, key )
+      dirKey = self._getDir( key )
+      if not os.path.exists( dirKey ):
+        os.makedirs( dirKey )
+      files = []
+      for filename in filenames:
+        name = os.path.basename( filename )
+        self._place( filename, os.path.join( dirKey, name ) )
+        files.append( name )
+      index[ key ] = {
+        'files': files, 'access': time.time(),
+        'bytes': sum( map( lambda f: os.path.getsize( f ), filenames ) )
+      }
+      self._evict( index )
+      self._writeIndex( index )
+
+    try:
+      self._runLocked( put )
+    except ( IOError, OSError ):
+      shutil.rmtree( self._getDir( key ), ignore_errors=True )
+      return
+    self.counters['puts'] += 1
+
+  def clear(self):
+    def clear():
+      index = self._readIndex()
+      for key in index.keys():
+        self._removeKey( index, key )
+      self._writeIndex( index )
+
+    self._runLocked( clear )
@@ -0,0 +1,447 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+Name                 : Service processing image
+Description          : Resident service of processing image, jobs by HTTP(JSON)
+                       in queue with priority, run by warm processes with LRU
+                       of opened images
+Arguments            : Port of service or job for submit(client)
+
+                       -------------------
+begin                : 2016-08-11
+copyright            : (C) 2016 by Luiz Motta
+email                : motta dot luiz at gmail.com
+
+ ***************************************************************************/
+"""
+
+import sys, argparse, json, datetime, time, multiprocessing, threading, heapq, httplib, urlparse
+import BaseHTTPServer, SocketServer
+from collections import OrderedDict
+
+from processingimage import ProcessingImage
+from batchprocessingimage import processing_types, checkJob, getAlgorithm, getSeconds
+from consoleprocessingimage import addArgumentsOutput, getOptionsOutput, addArgumentsCache, getOptionsCache
+
+def _runWorker(idWorker, tasks, results, maxImages):
+  # Process of service, keep the last images opened(LRU), the subset not open the image again
+  # task: { 'id', 'job', 'options' }, result: ( id, record )
+  def getImageProcessing(job):
+    # Return ( imageProcessing, seconds of open ), imageProcessing is None if error
+    key = ( job['type'], job['name'], job['product_type'] )
+    imageProcessing = images.pop( key, None )
+    if not imageProcessing is None:
+      images[ key ] = imageProcessing # Last used
+      return { 'isOk': True, 'imageProcessing': imageProcessing, 'open': 0.0 }
+    t1 = datetime.datetime.now()
+    imageProcessing = processing_types[ job['type'] ]( idWorker )
+    vreturn = imageProcessing.setImage( { 'name': job['name'], 'PRODUCT_TYPE': job['product_type'] }, None )
+    if not vreturn['isOk']:
+      return vreturn
+    images[ key ] = imageProcessing
+    while len( images ) > maxImages:
+      images.popitem( last=False ) # Close the dataset(older used)
+    return { 'isOk': True, 'imageProcessing': imageProcessing, 'open': getSeconds( t1 ) }
+
+  def runJob(job, options):
+    times = {}
+    vreturn = getImageProcessing( job )
+    if not vreturn['isOk']:
+      return { 'isOk': False, 'msg': vreturn['msg'], 'times': times }
+    imageProcessing, times['open'] = vreturn['imageProcessing'], vreturn['open']
+    t1 = datetime.datetime.now()
+    vreturn = imageProcessing.setSubset( job['wkt'] )
+    times['subset'] = getSeconds( t1 )
+    if not vreturn['isOk']:
+      return { 'isOk': False, 'msg': vreturn['msg'], 'times': times }
+    if not job['quality_mask'] is None:
+      options['qualityMask'] = dict( options.get( 'qualityMask' ) or { 'band': 1, 'bits': None }, name=job['quality_mask'] )
+    t1 = datetime.datetime.now()
+    vreturn = imageProcessing.run( getAlgorithm( job ), options )
+    times['run'] = getSeconds( t1 )
+    vreturn['times'] = times
+    return vreturn
+
+  images = OrderedDict() # ( type, name, product_type ): ProcessingImage
+  while True:
+    task = tasks.get()
+    if task is None:
+      break
+    try:
+      vreturn = runJob( task['job'], task['options'] )
+    except Exception as e:
+      vreturn = { 'isOk': False, 'msg': str( e ), 'times': {} }
+    vreturn['idWorker'] = idWorker
+    results.put( ( task['id'], vreturn ) )
+  images.clear()
+
+class ProcessingService():
+  # Jobs in queue by priority(lower first, same priority in order of submit)
+  # Dispatcher send a job to one free process(queue of tasks by process), collector receive the results
+  # Monitor check the processes, the job of dead process is failed and the process is started again
+  # Records: { 'id', 'status', 'priority', 'job', 'result', 'times' }
+  # status: 'queued', 'running', 'done', 'failed' or 'canceled'
+  maxRecords = 10000 # Records of jobs finished, older are removed
+  secondsMonitor = 2
+  keysOptions = filter( lambda k: not k in ( 'workers', 'progress', 'statsFile' ), ProcessingImage.defaultOptions.keys() ) # Options by job
+
+  def __init__(self, workers, options, maxImages=8):
+    self.workers, self.options, self.maxImages = workers, options, maxImages
+    self.records, self.queue = OrderedDict(), [] # queue: heap of ( priority, id )
+    self.lastId, self.isStopped = 0, False
+    self.condition = threading.Condition()
+    self.results = multiprocessing.Queue()
+    self.processes, self.tasks, self.running = {}, {}, {} # By idWorker, running: idJob
+    self.free, self.threads = [], [] # free: idWorker
+
+  def _startProcess(self, idWorker):
+    self.tasks[ idWorker ] = multiprocessing.Queue()
+    process = multiprocessing.Process( target=_runWorker, args=( idWorker, self.tasks[ idWorker ], self.results, self.maxImages ) )
+    process.start()
+    self.processes[ idWorker ] = process
+    self.free.append( idWorker )
+
+  def start(self):
+    for i in xrange( self.workers ):
+      self._startProcess( i + 1 )
+    for target in ( self._dispatch, self._collect, self._monitor ):
+      thread = threading.Thread( target=target )
+      thread.daemon = True
+      thread.start()
+      self.threads.append( thread )
+
+  def stop(self):
+    # Jobs in queue are canceled, running jobs are finished
+    with self.condition:
+      self.isStopped = True
+      while len( self.queue ) > 0:
+        ( priority, idJob ) = heapq.heappop( self.queue )
+        self.records[ idJob ]['status'] = 'canceled'
+      self.condition.notify_all()
+    for idWorker in self.processes.keys():
+      self.tasks[ idWorker ].put( None )
+    for process in self.processes.values():
+      process.join()
+
+  def _dispatch(self):
+    while True:
+      with self.condition:
+        while not self.isStopped and ( len( self.free ) == 0 or len( self.queue ) == 0 ):
+          self.condition.wait()
+        if self.isStopped:
+          return
+        ( priority, idJob ) = heapq.heappop( self.queue )
+        record = self.records[ idJob ]
+        record['status'], record['times']['start'] = 'running', time.time()
+        idWorker = self.free.pop( 0 )
+        self.running[ idWorker ] = idJob
+        task = { 'id': idJob, 'job': record['job'], 'options': record['options'] }
+        self.tasks[ idWorker ].put( task )
+
+  def _finish(self, idJob, result):
+    # Inside of condition
+    record = self.records[ idJob ]
+    times = record['times']
+    times['end'] = time.time()
+    times.update( result.pop( 'times' ) )
+    times['queue'], times['total'] = times['start'] - times['submit'], times['end'] - times['submit']
+    record['status'] = 'done' if result['isOk'] else 'failed'
+    record['result'] = result
+    self._removeRecords()
+    self.condition.notify_all()
+
+  def _collect(self):
+    while True:
+      ( idJob, result ) = self.results.get()
+      with self.condition:
+        idWorker = result['idWorker']
+        if not self.running.get( idWorker ) == idJob: # Job failed by monitor
+          continue
+        del self.running[ idWorker ]
+        self.free.append( idWorker )
+        self._finish( idJob, result )
+
+  def _monitor(self):
+    while True:
+      time.sleep( self.secondsMonitor )
+      with self.condition:
+        if self.isStopped:
+          return
+        for ( idWorker, process ) in self.processes.items():
+          if process.is_alive():
+            continue
+          process.join()
+          if idWorker in self.free:
+            self.free.remove( idWorker )
+          idJob = self.running.pop( idWorker, None )
+          if not idJob is None:
+            msg = "Process of worker %d died(exit code %s)" % ( idWorker, process.exitcode )
+            self._finish( idJob, { 'isOk': False, 'msg': msg, 'idWorker': idWorker, 'times': {} } )
+          self._startProcess( idWorker )
+          self.condition.notify_all()
+
+  def _removeRecords(self):
+    finished = filter( lambda k: self.records[ k ]['status'] in ( 'done', 'failed', 'canceled' ), self.records.keys() )
+    for idJob in finished[ : max( 0, len( finished ) - self.maxRecords ) ]:
+      del self.records[ idJob ]
+
+  def submit(self, job, priority=0, options=None):
+    # Return { 'isOk', 'id' } or { 'isOk', 'msg' }
+    if not isinstance( priority, int ):
+      return { 'isOk': False, 'msg': "Priority '%s' is not a integer" % priority }
+    opts = self.options.copy()
+    if not options is None:
+      keys = filter( lambda k: not k in self.keysOptions, options.keys() )
+      if len( keys ) > 0:
+        return { 'isOk': False, 'msg': "Options '%s' not valid for job" % ",".join( keys ) }
+      opts.update( options )
+    with self.condition:
+      if self.isStopped:
+        return { 'isOk': False, 'msg': "Service is stopped" }
+      self.lastId += 1
+      idJob = self.lastId
+      vreturn = checkJob( dict( job, id=idJob ) )
+      if not vreturn['isOk']:
+        return vreturn
+      self.records[ idJob ] = {
+        'id': idJob, 'status': 'queued', 'priority': priority, 'job': vreturn['job'], 'options': opts,
+        'result': None, 'times': { 'submit': time.time() }
+      }
+      heapq.heappush( self.queue, ( priority, idJob ) )
+      self.condition.notify_all()
+    return { 'isOk': True, 'id': idJob }
+
+  def get(self, idJob, wait=0):
+    # wait: seconds for job finish
+    # Return record(without options) or None
+    end = time.time() + wait
+    with self.condition:
+      while idJob in self.records and self.records[ idJob ]['status'] in ( 'queued', 'running' ):
+        seconds = end - time.time()
+        if seconds <= 0:
+          break
+        self.condition.wait( seconds )
+      record = self.records.get( idJob )
+      if record is None:
+        return None
+      record = dict( ( k, record[ k ] ) for k in record if not k == 'options' )
+      record['times'] = record['times'].copy() # Changed by collector
+      return record
+
+  def cancel(self, idJob):
+    # Only jobs in queue
+    with self.condition:
+      record = self.records.get( idJob )
+      if record is None:
+        return { 'isOk': False, 'msg': "Job '%d' not found" % idJob }
+      if not record['status'] == 'queued':
+        return { 'isOk': False, 'msg': "Job '%d' is %s" % ( idJob, record['status'] ) }
+      self.queue.remove( ( record['priority'], idJob ) )
+      heapq.heapify( self.queue )
+      record['status'] = 'canceled'
+      self.condition.notify_all()
+    return { 'isOk': True }
+
+  def status(self):
+    with self.condition:
+      total = {}
+      for record in self.records.values():
+        total[ record['status'] ] = total.get( record['status'], 0 ) + 1
+      return { 'workers': self.workers, 'free': len( self.free ), 'queued': len( self.queue ), 'jobs': total }
+
+class ServiceHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  # POST /jobs { job, 'priority', 'options' } -> { 'id' }
+  # GET /jobs/<id>[?wait=seconds] -> record, DELETE /jobs/<id> -> cancel(job in queue)
+  # GET /status -> total of jobs by status
+  def log_message(self, format, *args):
+    pass
+
+  def _send(self, status, data):
+    body = json.dumps( data )
+    self.send_response( status )
+    self.send_header( 'Content-Type', 'application/json' )
+    self.send_header( 'Content-Length', str( len( body ) ) )
+    self.end_headers()
+    self.wfile.write( body )
+
+  def _getIdJob(self, path):
+    parts = path.strip('/').split('/')
+    if not len( parts ) == 2 or not parts[0] == 'jobs' or not parts[1].isdigit():
+      return None
+    return int( parts[1] )
+
+  def do_POST(self):
+    if not self.path.rstrip('/') == '/jobs':
+      return self._send( 404, { 'isOk': False, 'msg': "Not found '%s'" % self.path } )
+    try:
+      length = int( self.headers.get( 'Content-Length', 0 ) )
+      job = json.loads( self.rfile.read( length ) )
+      if not isinstance( job, dict ):
+        raise ValueError( "Job is not a object" )
+    except ValueError as e:
+      return self._send( 400, { 'isOk': False, 'msg': str( e ) } )
+    priority, options = job.pop( 'priority', 0 ), job.pop( 'options', None )
+    vreturn = self.server.service.submit( job, priority, options )
+    self._send( 202 if vreturn['isOk'] else 400, vreturn )
+
+  def do_GET(self):
+    url = urlparse.urlparse( self.path )
+    if url.path.rstrip('/') == '/status':
+      return self._send( 200, self.server.service.status() )
+    idJob = self._getIdJob( url.path )
+    if idJob is None:
+      return self._send( 404, { 'isOk': False, 'msg': "Not found '%s'" % self.path } )
+    try:
+      wait = float( urlparse.parse_qs( url.query ).get( 'wait', [ 0 ] )[0] )
+    except ValueError:
+      return self._send( 400, { 'isOk': False, 'msg': "Parameter 'wait' is not a number" } )
+    record = self.server.service.get( idJob, min( wait, self.server.maxWait ) )
+    if record is None:
+      return self._send( 404, { 'isOk': False, 'msg': "Job '%d' not found" % idJob } )
+    self._send( 200, record )
+
+  def do_DELETE(self):
+    idJob = self._getIdJob( self.path )
+    if idJob is None:
+      return self._send( 404, { 'isOk': False, 'msg': "Not found '%s'" % self.path } )
+    vreturn = self.server.service.cancel( idJob )
+    self._send( 200 if vreturn['isOk'] else 409, vreturn )
+
+class ServiceServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+  maxWait = 300 # Seconds of wait of GET of job
+
+  def __init__(self, address, service):
+    BaseHTTPServer.HTTPServer.__init__( self, address, ServiceHandler )
+    self.service = service
+
+class ServiceClient():
+  # Client of service(local), one connection by request
+  def __init__(self, host='localhost', port=8150, timeout=None):
+    self.host, self.port, self.timeout = host, port, timeout
+
+  def _request(self, method, path, data=None):
+    # Return { 'isOk', 'status', 'data' } or { 'isOk', 'msg' }
+    conn = httplib.HTTPConnection( self.host, self.port, timeout=self.timeout )
+    try:
+      body = None if data is None else json.dumps( data )
+      conn.request( method, path, body, { 'Content-Type': 'application/json' } )
+      response = conn.getresponse()
+      return { 'isOk': True, 'status': response.status, 'data': json.loads( response.read() ) }
+    except ( IOError, httplib.HTTPException, ValueError ) as e:
+      return { 'isOk': False, 'msg': "%s %s: %s" % ( method, path, str( e ) ) }
+    finally:
+      conn.close()
+
+  def submit(self, job, priority=None, options=None):
+    # priority None: 'priority' of job(default 0)
+    data = dict( job, priority=job.get( 'priority', 0 ) if priority is None else priority )
+    if not options is None:
+      data['options'] = options
+    vreturn = self._request( 'POST', '/jobs', data )
+    if not vreturn['isOk']:
+      return vreturn
+    return vreturn['data']
+
+  def get(self, idJob, wait=0):
+    vreturn = self._request( 'GET', "/jobs/%d?wait=%s" % ( idJob, wait ) )
+    if not vreturn['isOk']:
+      return vreturn
+    return vreturn['data']
+
+  def wait(self, idJob):
+    # Return the record of job finished
+    while True:
+      record = self.get( idJob, ServiceServer.maxWait )
+      if not record.get( 'status' ) in ( 'queued', 'running' ):
+        return record
+
+  def cancel(self, idJob):
+    vreturn = self._request( 'DELETE', "/jobs/%d" % idJob )
+    if not vreturn['isOk']:
+      return vreturn
+    return vreturn['data']
+
+def serve(args):
+  options = getOptionsOutput( args )
+  if options is None:
+    return 1
+  optionsCache = getOptionsCache( args )
+  if optionsCache is None:
+    return 1
+  options.update( optionsCache )
+  options.update( { 'engine': args.engine, 'read': args.read } )
+  if args.workers < 1:
+    print "Total of workers '%d' need be greater than 0" % args.workers
+    return 1
+  if args.images < 1:
+    print "Total of images opened '%d' need be greater than 0" % args.images
+    return 1
+
+  service = ProcessingService( args.workers, options, args.images )
+  service.start()
+  server = ServiceServer( ( args.host, args.port ), service )
+  sys.stderr.write( "Service in %s:%d, workers %d\n" % ( args.host, args.port, args.workers ) )
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  server.server_close()
+  service.stop()
+  return 0
+
+def submit(args):
+  try:
+    with open( args.job ) as f:
+      job = json.load( f )
+  except ( IOError, ValueError ) as e:
+    print "Reading job '%s': %s" % ( args.job, str( e ) )
+    return 1
+  client = ServiceClient( args.host, args.port )
+  vreturn = client.submit( job, args.priority )
+  if not vreturn['isOk']:
+    print "Error: %s" % vreturn['msg']
+    return 1
+  record = client.wait( vreturn['id'] ) if args.wait else vreturn
+  print json.dumps( record )
+  return 0 if record.get( 'status' ) in ( None, 'done' ) else 1
+
+def main():
+  d = "Service of image processing local, remote(HTTP GeoTIFF) or server(Planet Labs)."
+  parser = argparse.ArgumentParser(description=d )
+  d = "Host of service (default localhost)"
+  parser.add_argument('--host', metavar='host', dest='host', type=str, default='localhost', help=d)
+  d = "Port of service (default 8150)"
+  parser.add_argument('--port', metavar='port', dest='port', type=int, default=8150, help=d)
+  subparsers = parser.add_subparsers( dest='command' )
+
+  d = "Run the service"
+  parserServe = subparsers.add_parser( 'serve', help=d )
+  d = "Total of processes for jobs (default 1)"
+  parserServe.add_argument('-j', metavar='workers', dest='workers', type=int, default=1, help=d)
+  d = "Total of images opened by process(LRU) (default 8)"
+  parserServe.add_argument('-i', metavar='images', dest='images', type=int, default=8, help=d)
+  d = "Engine of processing: %s (default '%s')" % ( " or ".join( ProcessingImage.engines ), ProcessingImage.defaultOptions['engine'] )
+  parserServe.add_argument('-e', metavar='engine', dest='engine', type=str, default=ProcessingImage.defaultOptions['engine'], help=d)
+  d = "Read mode for 'array' engine: %s (default '%s')" % ( " or ".join( ProcessingImage.readModes ), ProcessingImage.defaultOptions['read'] )
+  parserServe.add_argument('-r', metavar='read_mode', dest='read', type=str, default=ProcessingImage.defaultOptions['read'], help=d)
+  addArgumentsOutput( parserServe )
+  addArgumentsCache( parserServe )
+
+  d = "Submit one job(JSON file, fields of manifest of batch, 'priority' and 'options')"
+  parserSubmit = subparsers.add_parser( 'submit', help=d )
+  d = "JSON file of job"
+  parserSubmit.add_argument('job', metavar='job', type=str, help=d )
+  d = "Priority of job, lower first (default 'priority' of job or 0)"
+  parserSubmit.add_argument('-p', metavar='priority', dest='priority', type=int, default=None, help=d)
+  d = "Wait the result of job"
+  parserSubmit.add_argument('-w', dest='wait', action='store_true', help=d)
+
+  args = parser.parse_args()
+  if args.command == 'serve':
+    return serve( args )
+  return submit( args )
+
+if __name__ == "__main__":
+    sys.exit( main() )
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+Name                 : Spatial index
+Description          : R-tree packed by Sort-Tile-Recursive(STR) of bounding boxes,
+                       static index(built one time) for many queries
+Arguments            : List of ( bbox, value ), bbox = ( minX, minY, maxX, maxY )
+
+                       -------------------
+begin                : 2016-08-11
+copyright            : (C) 2016 by Luiz Motta
+email                : motta dot luiz at gmail.com
+
+ ***************************************************************************/
+"""
+
+import math
+
+class SpatialIndex():
+  # Node: ( bbox, children, isLeaf ), children: [ ( bbox, value or node ), ... ]
+  # Boxes are closed, boxes that touch intersect
+  def __init__(self, items, capacity=16):
+    self.capacity = capacity
+    self.total = len( items )
+    self.root = None
+    if self.total > 0:
+      self.root = self._build( [ ( tuple( bbox ), value ) for ( bbox, value ) in items ], True )
+
+  @staticmethod
+  def _getBBox(entries):
+    return (
+      min( e[0][0] for e in entries ), min( e[0][1] for e in entries ),
+      max( e[0][2] for e in entries ), max( e[0][3] for e in entries )
+    )
+
+  @staticmethod
+  def intersects(bbox1, bbox2):
+    return not ( bbox1[2] < bbox2[0] or bbox2[2] < bbox1[0] or bbox1[3] < bbox2[1] or bbox2[3] < bbox1[1] )
+
+  def _pack(self, entries):
+    # Sort-Tile-Recursive: slabs by X, and nodes by Y inside of slab
+    n = self.capacity
+    totalNodes = int( math.ceil( len( entries ) / float( n ) ) )
+    sizeSlab = int( math.ceil( math.sqrt( totalNodes ) ) ) * n
+    entries = sorted( entries, key=lambda e: e[0][0] + e[0][2] )
+    groups = []
+    for i in xrange( 0, len( entries ), sizeSlab ):
+      slab = sorted( entries[ i : i + sizeSlab ], key=lambda e: e[0][1] + e[0][3] )
+      for j in xrange( 0, len( slab ), n ):
+        groups.append( slab[ j : j + n ] )
+    return groups
+
+  def _build(self, entries, isLeaf):
+    # entries: [ ( bbox, value ), ... ] for leafs or [ ( bbox, node ), ... ]
+    nodes = [ ( self._getBBox( group ), group, isLeaf ) for group in self._pack( entries ) ]
+    if len( nodes ) == 1:
+      return nodes[0]
+    return self._build( [ ( node[0], node ) for node in nodes ], False )
+
+  def query(self, bbox):
+    # Return the values with bounding box intersecting bbox(order is not of items)
+    values = []
+    if self.root is None:
+      return values
+    stack = [ self.root ]
+    while len( stack ) > 0:
+      ( nodeBBox, children, isLeaf ) = stack.pop()
+      if not self.intersects( nodeBBox, bbox ):
+        continue
+      if isLeaf:
+        values.extend( [ value for ( b, value ) in children if self.intersects( b, bbox ) ] )
+      else:
+        stack.extend( [ child for ( b, child ) in children ] )
+    return values
+
+  def __len__(self):
+    return self.total
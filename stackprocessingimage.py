@@ -0,0 +1,395 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+Name                 : Stack processing image
+Description          : Temporal reductions(max, median, count, latest, ...) of
+                       algorithm over many scenes of same region, tile by tile
+Arguments            : Scenes(in order of time), WKT of region and algorithm
+
+                       -------------------
+begin                : 2016-08-11
+copyright            : (C) 2016 by Luiz Motta
+email                : motta dot luiz at gmail.com
+
+ ***************************************************************************/
+"""
+
+import os, sys, argparse, datetime, math, time, warnings, hashlib
+
+import numpy as np
+
+from osgeo import gdal, ogr
+from processingimage import RegionImage, CollectionAlgorithms, LocalImage, gdal_numpy_types
+
+class StackImage():
+  # Scenes are aligned in grid of region(SRS and resolution of first scene)
+  # Scenes in same grid are read by window, the others by warped VRT(nearest)
+  # Each tile has values of all scenes: memory is tile size x total of scenes
+  reductions = ( 'max', 'min', 'mean', 'median', 'count', 'latest' )
+  driverTif = gdal.GetDriverByName('GTiff')
+  defaultOptions = {
+    'tileSize': 256,
+    'reductions': [ 'max' ],
+    'prefix': 'stack', # Name of outputs: <prefix>_<reduction>_<algorithm>.tif
+    'creationOptions': []
+  }
+
+  def __init__(self):
+    self.wAlgorithm = CollectionAlgorithms()
+    self.scenes, self.grid = [], None
+    self.stats = None
+
+  def __del__(self):
+    self._clear()
+
+  def _clear(self):
+    for scene in self.scenes:
+      scene['source'], scene['mask'] = None, None
+    del self.scenes[:]
+    self.grid = None
+
+  def _getGrid(self, ds, wkt4326):
+    # Envelope of region in SRS of scene, snapped to pixels of scene
+    wktSRS = ds.GetProjectionRef()
+    ct = RegionImage.getTransformation( RegionImage.wkt4326, wktSRS )
+    if ct is None:
+      return { 'isOk': False, 'msg': "Fail when creating SRS of '%s'" % ds.GetDescription() }
+    geom = ogr.CreateGeometryFromWkt( wkt4326 )
+    if not geom.Transform( ct ) == 0:
+      geom.Destroy()
+      return { 'isOk': False, 'msg': "Fail when transforming region to SRS of '%s'" % ds.GetDescription() }
+    ( minX, maxX, minY, maxY ) = geom.GetEnvelope()
+    geom.Destroy()
+    t = ds.GetGeoTransform()
+    x1, x2 = int( math.floor( ( minX - t[0] ) / t[1] ) ), int( math.ceil( ( maxX - t[0] ) / t[1] ) )
+    y1, y2 = int( math.floor( ( maxY - t[3] ) / t[5] ) ), int( math.ceil( ( minY - t[3] ) / t[5] ) )
+    grid = {
+      'srs': wktSRS,
+      'transform': ( t[0] + x1 * t[1], t[1], 0.0, t[3] + y1 * t[5], 0.0, t[5] ),
+      'xsize': x2 - x1, 'ysize': y2 - y1
+    }
+    return { 'isOk': True, 'grid': grid }
+
+  def _getSource(self, ds):
+    # Source of dataset in grid: { 'ds', 'xoff', 'yoff', 'alpha' }
+    # 'alpha': None for window of dataset, or band of valid pixels of warped VRT
+    g, t = self.grid['transform'], ds.GetGeoTransform()
+    srGrid, sr = RegionImage.getSRS( self.grid['srs'] ), RegionImage.getSRS( ds.GetProjectionRef() )
+    if not sr is None and sr.IsSame( srGrid ) and t[1] == g[1] and t[5] == g[5] and t[2] == 0.0 and t[4] == 0.0:
+      xoff, yoff = ( g[0] - t[0] ) / t[1], ( g[3] - t[3] ) / t[5]
+      if abs( xoff - round( xoff ) ) < 1e-6 and abs( yoff - round( yoff ) ) < 1e-6:
+        return { 'ds': ds, 'xoff': int( round( xoff ) ), 'yoff': int( round( yoff ) ), 'alpha': None }
+    bounds = ( g[0], g[3] + self.grid['ysize'] * g[5], g[0] + self.grid['xsize'] * g[1], g[3] )
+    try:
+      vrt = gdal.Warp( '', ds, format='VRT', dstSRS=self.grid['srs'], outputBounds=bounds,
+                       xRes=g[1], yRes=abs( g[5] ), resampleAlg='near', dstAlpha=True )
+    except RuntimeError:
+      return None
+    return { 'ds': vrt, 'xoff': 0, 'yoff': 0, 'alpha': vrt.RasterCount, 'dsSource': ds } # VRT use the dataset
+
+  @staticmethod
+  def _readSource(source, bandNumbers, tile):
+    # Return ( [ array band1, ..., array bandN ], inside ), inside is True for pixels of dataset
+    ds, x, y, xsize, ysize = source['ds'], tile['x'], tile['y'], tile['xsize'], tile['ysize']
+    if not source['alpha'] is None:
+      values = [ ds.GetRasterBand( bn ).ReadAsArray( x, y, xsize, ysize ) for bn in bandNumbers ]
+      return ( values, ds.GetRasterBand( source['alpha'] ).ReadAsArray( x, y, xsize, ysize ) > 0 )
+    # Window of dataset, partial or outside
+    x1, y1 = max( x + source['xoff'], 0 ), max( y + source['yoff'], 0 )
+    x2, y2 = min( x + source['xoff'] + xsize, ds.RasterXSize ), min( y + source['yoff'] + ysize, ds.RasterYSize )
+    inside = np.zeros( ( ysize, xsize ), np.bool_ )
+    values = []
+    for bn in bandNumbers:
+      band = ds.GetRasterBand( bn )
+      v = np.zeros( ( ysize, xsize ), gdal_numpy_types[ band.DataType ] )
+      if x1 < x2 and y1 < y2:
+        tx, ty = x1 - x - source['xoff'], y1 - y - source['yoff']
+        v[ ty : ty + y2 - y1, tx : tx + x2 - x1 ] = band.ReadAsArray( x1, y1, x2 - x1, y2 - y1 )
+      values.append( v )
+      band = None
+    if x1 < x2 and y1 < y2:
+      inside[ y1 - y - source['yoff'] : y2 - y - source['yoff'], x1 - x - source['xoff'] : x2 - x - source['xoff'] ] = True
+    return ( values, inside )
+
+  def setScenes(self, images, wkt4326):
+    # images: [ { 'name', 'qualityMask'(optional: { 'name', 'band', 'bits' }) }, ... ] in order of time
+    # Return { 'isOk', 'scenes': [ { 'name', 'isOk', 'msg' }, ... ] }, scenes not intersected are skipped
+    def openDataset(name):
+      vreturn = LocalImage.openDataset( { 'name': name } )
+      if not vreturn['isOk']:
+        return { 'isOk': False, 'msg': "Image '%s': %s" % ( name, vreturn['msg'] ) }
+      return vreturn
+
+    self._clear()
+    results = []
+    for image in images:
+      result = { 'name': image['name'], 'isOk': False, 'msg': None }
+      results.append( result )
+      vreturn = openDataset( image['name'] )
+      if not vreturn['isOk']:
+        result['msg'] = vreturn['msg']
+        continue
+      ds = vreturn['ds']
+      vreturn = RegionImage( ds ).getSubset( wkt4326 )
+      if not vreturn['isOk']:
+        result['msg'] = vreturn['msg']
+        continue
+      if self.grid is None:
+        vreturn = self._getGrid( ds, wkt4326 )
+        if not vreturn['isOk']:
+          return vreturn
+        self.grid = vreturn['grid']
+      source = self._getSource( ds )
+      if source is None:
+        result['msg'] = "Image '%s' not aligned with grid: %s" % ( image['name'], gdal.GetLastErrorMsg() )
+        continue
+      scene = { 'name': image['name'], 'source': source, 'mask': None }
+      qualityMask = image.get( 'qualityMask' )
+      if not qualityMask is None:
+        vreturn = openDataset( qualityMask['name'] )
+        if not vreturn['isOk']:
+          result['msg'] = vreturn['msg']
+          continue
+        mask = self._getSource( vreturn['ds'] )
+        if mask is None:
+          result['msg'] = "Quality mask '%s' not aligned with grid" % qualityMask['name']
+          continue
+        mask.update( { 'band': qualityMask.get( 'band', 1 ), 'bits': qualityMask.get( 'bits' ) } )
+        scene['mask'] = mask
+      self.scenes.append( scene )
+      result['isOk'] = True
+    if len( self.scenes ) == 0:
+      return { 'isOk': False, 'msg': "None scene intersect with region" }
+    return { 'isOk': True, 'scenes': results }
+
+  def _getTiles(self, tileSize):
+    tiles = []
+    for y in xrange( 0, self.grid['ysize'], tileSize ):
+      for x in xrange( 0, self.grid['xsize'], tileSize ):
+        tiles.append( { 'x': x, 'y': y, 'xsize': min( tileSize, self.grid['xsize'] - x ), 'ysize': min( tileSize, self.grid['ysize'] - y ) } )
+    return tiles
+
+  @staticmethod
+  def _reduce(reduction, values, valid):
+    # values: ( scenes, rows, columns ) with NaN for not valid
+    with warnings.catch_warnings(): # All-NaN slices are NaN
+      warnings.simplefilter( 'ignore', RuntimeWarning )
+      if reduction == 'count':
+        return valid.sum( axis=0 ).astype( np.uint16 )
+      if reduction == 'max':
+        return np.nanmax( values, axis=0 )
+      if reduction == 'min':
+        return np.nanmin( values, axis=0 )
+      if reduction == 'mean':
+        return np.nanmean( values, axis=0 )
+      if reduction == 'median':
+        return np.nanmedian( values, axis=0 )
+    # latest: last valid scene of order
+    total = values.shape[0]
+    index = total - 1 - np.argmax( valid[ ::-1 ], axis=0 )
+    rows, columns = np.indices( index.shape )
+    return values[ index, rows, columns ] # NaN if none valid
+
+  def run(self, algorithm, options=None):
+    # algorithm: { 'name', 'bandNumbers' } or { 'name': 'expr', 'expression' }, value of each scene
+    # Return { 'isOk', 'filenames', 'stats' }
+    def getNameOut(reduction):
+      bands = "-".join( map( lambda i: "B%d" % i, alg['bandNumbers'] ) )
+      name = alg['name'] if not alg['name'] == 'expr' else "expr-%s" % hashlib.md5( alg['expression'] ).hexdigest()[:8]
+      return "%s_%s_%s_%s.tif" % ( opts['prefix'], reduction, name, bands )
+
+    def createDSOut(filename, reduction):
+      if os.path.exists( filename ):
+        os.remove( filename )
+      datatype = gdal.GDT_UInt16 if reduction == 'count' else gdal.GDT_Float32
+      try:
+        ds = self.driverTif.Create( filename, self.grid['xsize'], self.grid['ysize'], 1, datatype, options=opts['creationOptions'] )
+      except RuntimeError:
+        return None
+      ds.SetProjection( self.grid['srs'] )
+      ds.SetGeoTransform( self.grid['transform'] )
+      if not reduction == 'count':
+        ds.GetRasterBand(1).SetNoDataValue( float('nan') )
+      return ds
+
+    def getValid(scene, tile):
+      # Inside of scene, not nodata of bands and not masked by quality mask
+      ( values, inside ) = self._readSource( scene['source'], alg['bandNumbers'], tile )
+      for ( bn, v ) in zip( alg['bandNumbers'], values ):
+        nodata = scene['source']['ds'].GetRasterBand( bn ).GetNoDataValue()
+        if not nodata is None:
+          inside &= ~np.isnan( v ) if math.isnan( nodata ) else v != nodata
+      mask = scene['mask']
+      if not mask is None and inside.any():
+        ( m, insideMask ) = self._readSource( mask, [ mask['band'] ], tile )
+        m = m[0]
+        inside &= insideMask & ( ( m == 0 ) if mask['bits'] is None else ( ( m & mask['bits'] ) == 0 ) )
+      return ( values, inside )
+
+    opts = self.defaultOptions.copy()
+    if not options is None:
+      opts.update( options )
+    if self.grid is None:
+      return { 'isOk': False, 'msg': "Need set scenes for running" }
+    for reduction in opts['reductions']:
+      if not reduction in self.reductions:
+        msg = "Reduction '%s' not valid. Valids reductions: %s" % ( reduction, " or ".join( self.reductions ) )
+        return { 'isOk': False, 'msg': msg }
+    vreturn = self.wAlgorithm.checkAlgorithm( algorithm )
+    if not vreturn['isOk']:
+      return vreturn
+    alg = vreturn['algorithm']
+    for scene in self.scenes:
+      totalBands = scene['source']['ds'].RasterCount - ( 0 if scene['source']['alpha'] is None else 1 )
+      if max( alg['bandNumbers'] ) > totalBands:
+        return { 'isOk': False, 'msg': "Band '%d' is greater than total of bands of '%s'" % ( max( alg['bandNumbers'] ), scene['name'] ) }
+    funcArray = self.wAlgorithm.getFunctionArray( alg )
+
+    self.stats = { 'read': 0.0, 'compute': 0.0, 'write': 0.0, 'seconds': 0.0, 'tiles': 0, 'scenes': len( self.scenes ), 'bytesRead': 0 }
+    tRun = time.time()
+    outputs = []
+    for reduction in opts['reductions']:
+      filename = getNameOut( reduction )
+      ds = createDSOut( filename, reduction )
+      if ds is None:
+        return { 'isOk': False, 'msg': "Creating output image '%s'" % filename }
+      outputs.append( { 'reduction': reduction, 'filename': filename, 'ds': ds, 'band': ds.GetRasterBand(1) } )
+
+    for tile in self._getTiles( opts['tileSize'] ):
+      values = np.full( ( len( self.scenes ), tile['ysize'], tile['xsize'] ), np.nan, np.float32 )
+      for i in xrange( len( self.scenes ) ):
+        t1 = time.time()
+        ( imgValues, valid ) = getValid( self.scenes[ i ], tile )
+        t2 = time.time()
+        self.stats['read'] += t2 - t1
+        self.stats['bytesRead'] += sum( map( lambda v: v.nbytes, imgValues ) )
+        if valid.any():
+          result = funcArray( imgValues )
+          # Only pixels invalid in input(alpha, nodata of bands) or not finite, the nodata of algorithm
+          # is a value of result(ex.: 0 of mask and norm-diff)
+          valid &= np.isfinite( result )
+          values[ i ][ valid ] = result[ valid ]
+          del result
+        self.stats['compute'] += time.time() - t2
+        del imgValues[:]
+      t1 = time.time()
+      valid = ~np.isnan( values )
+      outValues = [ self._reduce( out['reduction'], values, valid ) for out in outputs ]
+      t2 = time.time()
+      for i in xrange( len( outputs ) ):
+        outputs[ i ]['band'].WriteArray( outValues[ i ], tile['x'], tile['y'] )
+      self.stats['compute'] += t2 - t1
+      self.stats['write'] += time.time() - t2
+      self.stats['tiles'] += 1
+      del values, valid, outValues[:]
+
+    for out in outputs:
+      out['band'].FlushCache()
+      out['band'], out['ds'] = None, None
+    self.stats['seconds'] = time.time() - tRun
+    return { 'isOk': True, 'filenames': map( lambda out: out['filename'], outputs ), 'stats': self.stats.copy() }
+
+def run(images, wkt4326, algorithm, options):
+  def printTime(title, t1=None):
+    tn = datetime.datetime.now()
+    st = tn.strftime('%Y-%m-%d %H:%M:%S')
+    stimes = st if t1 is None else "%s %s" % ( st, str( tn - t1 ) )
+    print "%-70s %s" % ( title, stimes )
+    return tn
+
+  stack = StackImage()
+  t1 = printTime( "Setting %d scenes" % len( images ) )
+  vreturn = stack.setScenes( images, wkt4326 )
+  if not vreturn['isOk']:
+    print "Error: %s" % vreturn['msg']
+    return 1
+  for scene in vreturn['scenes']:
+    if not scene['isOk']:
+      print "Scene '%s' skipped: %s" % ( scene['name'], scene['msg'] )
+  printTime( "Grid %d x %d" % ( stack.grid['xsize'], stack.grid['ysize'] ), t1 )
+  t1 = printTime( "Running '%s' (%s)" % ( algorithm['name'], ",".join( options['reductions'] ) ) )
+  vreturn = stack.run( algorithm, options )
+  if not vreturn['isOk']:
+    print "Error: %s" % vreturn['msg']
+    return 1
+  for filename in vreturn['filenames']:
+    print "Create '%s'" % filename
+  stats = vreturn['stats']
+  printTime( "Scenes %d Tiles %d" % ( stats['scenes'], stats['tiles'] ), t1 )
+  keys = ( 'read', 'compute', 'write' )
+  print "Seconds: %s - MBytes read %.1f" % ( " ".join( map( lambda k: "%s %.3f" % ( k, stats[ k ] ), keys ) ), stats['bytesRead'] / 1048576.0 )
+  return 0
+
+def main():
+  a_d = CollectionAlgorithms.descriptions
+  d = "Temporal reductions of algorithm over scenes of same region(tile by tile)."
+  parser = argparse.ArgumentParser(description=d )
+  d = "Scenes in order of time(the last is the latest), 'scene.tif' or 'scene.tif,udm.tif' for quality mask"
+  parser.add_argument('scenes', metavar='scene', type=str, nargs='+', help=d )
+  d = "WKT(between double quotes) for region. Use EPSG 4326 for SRS"
+  parser.add_argument('-w', metavar='WKT_Region', dest='wkt4326', type=str, required=True, help=d)
+  d = "Name of algorithm: %s (default 'norm-diff')" % ','.join( a_d.keys() )
+  parser.add_argument('-a', metavar='algorithm', dest='algorithm', type=str, default='norm-diff', help=d)
+  d = "Number of bands(separated by comma and no spaces). Ex.: 4,3. For 'expr', the expression(between double quotes)"
+  parser.add_argument('-b', metavar='bands', dest='bands', type=str, required=True, help=d)
+  d = "Reductions(separated by comma): %s (default 'max')" % ",".join( StackImage.reductions )
+  parser.add_argument('-r', metavar='reductions', dest='reductions', type=str, default='max', help=d)
+  d = "Size of tile (default %d)" % StackImage.defaultOptions['tileSize']
+  parser.add_argument('-t', metavar='tile_size', dest='tileSize', type=int, default=StackImage.defaultOptions['tileSize'], help=d)
+  d = "Prefix of outputs (default '%s')" % StackImage.defaultOptions['prefix']
+  parser.add_argument('-o', metavar='prefix', dest='prefix', type=str, default=StackImage.defaultOptions['prefix'], help=d)
+  d = "Bits of quality mask for masking(ex.: 3 or 0x03), default any bit"
+  parser.add_argument('--q-bits', metavar='bits', dest='qualityMaskBits', type=str, help=d)
+  d = "Creation option of output(NAME=VALUE), can be repeated"
+  parser.add_argument('--co', metavar='option', dest='creationOptions', action='append', default=[], help=d)
+
+  args = parser.parse_args()
+  if not RegionImage.isValidGeom( args.wkt4326 ):
+    print "The WKT '%s' not valid." % args.wkt4326
+    return 1
+  if args.tileSize < 1:
+    print "Size of tile '%d' need be greater than 0" % args.tileSize
+    return 1
+  reductions = args.reductions.split(',')
+  for reduction in reductions:
+    if not reduction in StackImage.reductions:
+      print "Reduction '%s' not valid. Valids reductions: %s" % ( reduction, " or ".join( StackImage.reductions ) )
+      return 1
+  bits = args.qualityMaskBits
+  if not bits is None:
+    try:
+      bits = int( bits, 0 )
+    except ValueError:
+      print "Bits '%s' of quality mask not valid" % bits
+      return 1
+  if args.algorithm == 'expr':
+    algorithm = { 'name': 'expr', 'expression': args.bands }
+  else:
+    values = args.bands.split(',')
+    for v in values:
+      if not v.isdigit():
+        print "Band '%s' is not a number." % v
+        return 1
+    algorithm = { 'name': args.algorithm, 'bandNumbers': map( lambda s: int(s), values ) }
+  vreturn = CollectionAlgorithms().checkAlgorithm( algorithm )
+  if not vreturn['isOk']:
+    print vreturn['msg']
+    return 1
+  images = []
+  for item in args.scenes:
+    names = item.split(',')
+    for name in names:
+      if not os.path.exists( name ):
+        print "Not found '%s'" % name
+        return 1
+    image = { 'name': names[0] }
+    if len( names ) > 1:
+      image['qualityMask'] = { 'name': names[1], 'band': 1, 'bits': bits }
+    images.append( image )
+
+  options = { 'reductions': reductions, 'tileSize': args.tileSize, 'prefix': args.prefix, 'creationOptions': args.creationOptions }
+  return run( images, args.wkt4326, algorithm, options )
+
+if __name__ == "__main__":
+    sys.exit( main() )
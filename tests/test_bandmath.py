@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import os, sys, time, unittest
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+import numpy as np
+from bandmath import BandMath
+
+class TestBandMath(unittest.TestCase):
+  def _evaluate(self, expression, values):
+    bandMath = BandMath()
+    vreturn = bandMath.compile( expression )
+    self.assertTrue( vreturn['isOk'], vreturn.get( 'msg' ) )
+    return bandMath, bandMath.evaluate( map( np.array, values ) )
+
+  def test_bands_and_division(self):
+    bandMath, result = self._evaluate( '(B4-B3)/(B4+B3)', [ [ 1, 2 ], [ 3, 2 ] ] )
+    self.assertEqual( bandMath.bandNumbers, [ 3, 4 ] )
+    self.assertFalse( bandMath.isBoolean )
+    np.testing.assert_allclose( result, [ 0.5, 0.0 ] )
+
+  def test_conditional_and_logical(self):
+    bandMath, result = self._evaluate( 'B1 if 0 < B1 < 3 and not B2 == 0 else -1', [ [ 1, 2, 5 ], [ 1, 0, 1 ] ] )
+    np.testing.assert_allclose( result, [ 1, -1, -1 ] )
+    bandMath, result = self._evaluate( 'B1 > 1 or B2 > 1', [ [ 1, 2 ], [ 0, 0 ] ] )
+    self.assertTrue( bandMath.isBoolean )
+    np.testing.assert_array_equal( result, [ 0, 1 ] )
+
+  def test_functions_and_constants(self):
+    bandMath, result = self._evaluate( 'clip(B1 * pi, 0, 4) + max(B1, 2)', [ [ 0.5, 2 ] ] )
+    np.testing.assert_allclose( result, [ 0.5 * np.pi + 2, 4 + 2 ] )
+
+  def test_constant_result_shape(self):
+    bandMath, result = self._evaluate( 'B1 * 0 + 1', [ [ [ 1, 2 ], [ 3, 4 ] ] ] )
+    self.assertEqual( result.shape, ( 2, 2 ) )
+
+  def test_division_by_zero(self):
+    bandMath, result = self._evaluate( 'B1 / B2', [ [ 1 ], [ 0 ] ] )
+    self.assertTrue( np.isinf( result[0] ) )
+
+  def test_power_of_numbers(self):
+    # Numbers are float, not big integers(compile and evaluate return quickly)
+    t1 = time.time()
+    self.assertFalse( BandMath().compile( '2**9**9**9' )['isOk'] ) # Without bands
+    bandMath, result = self._evaluate( 'B1 + 9**9**9', [ [ 1.0 ] ] )
+    self.assertTrue( np.isinf( result[0] ) )
+    self.assertTrue( time.time() - t1 < 1 )
+    self.assertFalse( BandMath().compile( "B1 + 1%s" % ( '0' * 400 ) )['isOk'] )
+
+  def test_not_permited(self):
+    for expression in ( '__import__("os")', 'B1.real', 'B1[0]', 'lambda x: B1', 'X1 + B1', 'sqrt', 'where(B1, x=1)', '1 + 2', 'B1 +', 'B1 + 1j' ):
+      vreturn = BandMath().compile( expression )
+      self.assertFalse( vreturn['isOk'], expression )
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+import os, sys, json, hashlib, shutil, tempfile, threading, unittest
+import BaseHTTPServer, SocketServer
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+from downloadscenes import HttpClient, DownloadState, downloadScene
+
+class HandlerCatalog(BaseHTTPServer.BaseHTTPRequestHandler):
+  # Stand-in of catalog: assets of scenes(JSON), activation(POST) and files with Range
+  # /catalog/<scene>/assets/, /activate/<scene>/<asset>, /files/<name>
+  protocol_version = 'HTTP/1.1'
+  files = {} # name: data
+  assets = {} # scene: { asset: { 'name', 'md5', 'polls' } }, polls: assets requests until active
+  requests = [] # ( method, path, range )
+  lock = threading.Lock()
+
+  def _send(self, status, data, headers=None):
+    self.send_response( status )
+    self.send_header( 'Content-Length', str( len( data ) ) )
+    for k in ( headers or {} ):
+      self.send_header( k, headers[ k ] )
+    self.end_headers()
+    self.wfile.write( data )
+
+  def _getAssets(self, scene):
+    base = "http://%s:%d" % self.server.server_address
+    assets = {}
+    for ( asset, a ) in self.assets[ scene ].items():
+      http = {
+        'status': 'active' if a['polls'] == 0 else 'inactive',
+        'location': "%s/files/%s" % ( base, a['name'] ), 'size': len( self.files[ a['name'] ] ),
+        'md5_digest': a.get( 'md5' ) or hashlib.md5( self.files[ a['name'] ] ).hexdigest(),
+        '_links': { 'activate': "%s/activate/%s/%s" % ( base, scene, asset ) }
+      }
+      if a.get( 'activated' ) and a['polls'] > 0:
+        a['polls'] -= 1
+      assets[ asset ] = { 'files': { 'http': http } }
+    return assets
+
+  def do_GET(self):
+    parts = self.path.strip( '/' ).split( '/' )
+    header = self.headers.getheader( 'Range' )
+    with self.lock:
+      self.requests.append( ( 'GET', self.path, header ) )
+      if parts[0] == 'catalog':
+        return self._send( 200, json.dumps( self._getAssets( parts[1] ) ) )
+    data = self.files[ parts[1] ]
+    if header is None:
+      return self._send( 200, data )
+    offset = int( header.split( '=' )[1].split( '-' )[0] )
+    if offset >= len( data ):
+      return self._send( 416, '' )
+    headers = { 'Content-Range': "bytes %d-%d/%d" % ( offset, len( data ) - 1, len( data ) ) }
+    self._send( 206, data[ offset : ], headers )
+
+  def do_POST(self):
+    parts = self.path.strip( '/' ).split( '/' )
+    with self.lock:
+      self.requests.append( ( 'POST', self.path, None ) )
+      self.assets[ parts[1] ][ parts[2] ]['activated'] = True
+    self._send( 202, '' )
+
+  def log_message(self, format, *args):
+    pass
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+
+class TestDownload(unittest.TestCase):
+  def setUp(self):
+    HandlerCatalog.files.clear()
+    HandlerCatalog.assets.clear()
+    del HandlerCatalog.requests[:]
+    self.server = Server( ( '127.0.0.1', 0 ), HandlerCatalog )
+    self.thread = threading.Thread( target=self.server.serve_forever )
+    self.thread.start()
+    self.base = "http://127.0.0.1:%d" % self.server.server_address[1]
+    self.dirWork = tempfile.mkdtemp()
+    self.client = HttpClient( None, 10 )
+
+  def tearDown(self):
+    self.client.close()
+    self.server.shutdown()
+    self.server.server_close()
+    self.thread.join()
+    shutil.rmtree( self.dirWork, ignore_errors=True )
+
+  def _addFile(self, name, size):
+    data = ''.join( chr( ( i * 7 ) % 256 ) for i in xrange( size ) )
+    HandlerCatalog.files[ name ] = data
+    return data
+
+  def _getRequests(self, prefix):
+    return filter( lambda r: r[1].startswith( prefix ), HandlerCatalog.requests )
+
+  def _options(self):
+    return {
+      'apiKey': None, 'catalog': "%s/catalog/" % self.base, 'dir': self.dirWork, 'geomId': None,
+      'state': os.path.join( self.dirWork, 'download_state.json' ),
+      'poll': 0.01, 'timeoutActivate': 5, 'timeout': 10
+    }
+
+  def test_resume(self):
+    data = self._addFile( 'a.tif', 100000 )
+    filename = os.path.join( self.dirWork, 'a.tif' )
+    with open( "%s.part" % filename, 'wb' ) as f:
+      f.write( data[ : 30000 ] )
+    vreturn = self.client.download( "%s/files/a.tif" % self.base, filename, len( data ), hashlib.md5( data ).hexdigest() )
+    self.assertTrue( vreturn['isOk'], vreturn.get( 'msg' ) )
+    self.assertTrue( vreturn['resumed'] )
+    self.assertEqual( vreturn['bytesRead'], 70000 )
+    self.assertEqual( self._getRequests( '/files/' )[-1][2], 'bytes=30000-' )
+    with open( filename, 'rb' ) as f:
+      self.assertEqual( f.read(), data )
+    self.assertFalse( os.path.exists( "%s.part" % filename ) )
+
+  def test_md5_mismatch(self):
+    data = self._addFile( 'a.tif', 1000 )
+    filename = os.path.join( self.dirWork, 'a.tif' )
+    with open( "%s.part" % filename, 'wb' ) as f:
+      f.write( 'x' * 500 ) # Corrupted part
+    url = "%s/files/a.tif" % self.base
+    vreturn = self.client.download( url, filename, len( data ), hashlib.md5( data ).hexdigest() )
+    self.assertFalse( vreturn['isOk'] )
+    self.assertFalse( os.path.exists( "%s.part" % filename ) ) # Removed, next download from start
+    vreturn = self.client.download( url, filename, len( data ), hashlib.md5( data ).hexdigest() )
+    self.assertTrue( vreturn['isOk'], vreturn.get( 'msg' ) )
+    self.assertFalse( vreturn['resumed'] )
+    with open( filename, 'rb' ) as f:
+      self.assertEqual( f.read(), data )
+
+  def test_part_greater_than_file(self):
+    # Range not satisfiable(416), the part is removed and downloaded again
+    data = self._addFile( 'a.tif', 1000 )
+    filename = os.path.join( self.dirWork, 'a.tif' )
+    with open( "%s.part" % filename, 'wb' ) as f:
+      f.write( 'x' * 2000 )
+    vreturn = self.client.download( "%s/files/a.tif" % self.base, filename, len( data ) )
+    self.assertTrue( vreturn['isOk'], vreturn.get( 'msg' ) )
+    self.assertEqual( map( lambda r: r[2], self._getRequests( '/files/' ) ), [ 'bytes=2000-', None ] )
+    self.assertEqual( os.path.getsize( filename ), len( data ) )
+
+  def test_size_mismatch(self):
+    self._addFile( 'a.tif', 1000 )
+    filename = os.path.join( self.dirWork, 'a.tif' )
+    vreturn = self.client.download( "%s/files/a.tif" % self.base, filename, 2000 )
+    self.assertFalse( vreturn['isOk'] )
+    self.assertFalse( os.path.exists( filename ) )
+    self.assertTrue( os.path.exists( "%s.part" % filename ) ) # Kept for resume
+
+  def test_state_skip(self):
+    self._addFile( 's1_udm', 100 )
+    self._addFile( 's1_analytic', 2000 )
+    HandlerCatalog.assets['s1'] = { 'udm': { 'name': 's1_udm', 'polls': 0 }, 'analytic': { 'name': 's1_analytic', 'polls': 0 } }
+    options = self._options()
+    vreturn = downloadScene( self.client, { 'scene': 's1', 'geometry': None }, DownloadState( options['state'] ), options )
+    self.assertTrue( vreturn['isOk'], vreturn.get( 'msg' ) )
+    self.assertEqual( map( lambda r: r['skipped'], vreturn['assets'] ), [ False, False ] )
+    self.assertEqual( len( self._getRequests( '/files/' ) ), 2 )
+    # New state from file(new run)
+    vreturn = downloadScene( self.client, { 'scene': 's1', 'geometry': None }, DownloadState( options['state'] ), options )
+    self.assertTrue( vreturn['isOk'], vreturn.get( 'msg' ) )
+    self.assertEqual( map( lambda r: r['skipped'], vreturn['assets'] ), [ True, True ] )
+    self.assertEqual( len( self._getRequests( '/files/' ) ), 2 )
+    # File removed, downloaded again
+    os.remove( os.path.join( self.dirWork, 's1_udm.tif' ) )
+    vreturn = downloadScene( self.client, { 'scene': 's1', 'geometry': None }, DownloadState( options['state'] ), options )
+    self.assertEqual( map( lambda r: r['skipped'], vreturn['assets'] ), [ False, True ] )
+
+  def test_activation(self):
+    self._addFile( 's1_udm', 100 )
+    self._addFile( 's1_analytic', 200 )
+    HandlerCatalog.assets['s1'] = { 'udm': { 'name': 's1_udm', 'polls': 0 }, 'analytic': { 'name': 's1_analytic', 'polls': 3 } }
+    options = self._options()
+    vreturn = downloadScene( self.client, { 'scene': 's1', 'geometry': None }, DownloadState( options['state'] ), options )
+    self.assertTrue( vreturn['isOk'], vreturn.get( 'msg' ) )
+    self.assertEqual( len( self._getRequests( '/activate/s1/analytic' ) ), 1 )
+    self.assertTrue( len( self._getRequests( '/catalog/' ) ) >= 4 ) # Polls of assets
+    self.assertTrue( os.path.exists( os.path.join( self.dirWork, 's1_analytic.tif' ) ) )
+
+  def test_activation_timeout(self):
+    self._addFile( 's1_udm', 100 )
+    self._addFile( 's1_analytic', 200 )
+    HandlerCatalog.assets['s1'] = { 'udm': { 'name': 's1_udm', 'polls': 0 }, 'analytic': { 'name': 's1_analytic', 'polls': 1000 } }
+    options = self._options()
+    options['timeoutActivate'] = 0.1
+    state = DownloadState( options['state'] )
+    vreturn = downloadScene( self.client, { 'scene': 's1', 'geometry': None }, state, options )
+    self.assertFalse( vreturn['isOk'] )
+    self.assertEqual( state.scenes['s1']['analytic']['status'], 'failed' )
+    self.assertFalse( state.isDone( 's1', 'analytic' ) )
+
+if __name__ == '__main__':
+  unittest.main()
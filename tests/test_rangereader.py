@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+import os, sys, threading, unittest
+import BaseHTTPServer, SocketServer
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+from rangereader import RangeReader
+
+class TestCoalesce(unittest.TestCase):
+  def test_sorted_and_duplicates(self):
+    ranges = [ ( 100000, 10 ), ( 0, 10 ), ( 0, 10 ) ]
+    self.assertEqual( RangeReader.coalesce( ranges ), [ ( 0, 10 ), ( 100000, 10 ) ] )
+
+  def test_gap(self):
+    gap = RangeReader.maxGap
+    self.assertEqual( RangeReader.coalesce( [ ( 0, 10 ), ( 10 + gap, 5 ) ] ), [ ( 0, 15 + gap ) ] )
+    self.assertEqual( RangeReader.coalesce( [ ( 0, 10 ), ( 11 + gap, 5 ) ] ), [ ( 0, 10 ), ( 11 + gap, 5 ) ] )
+
+  def test_overlap_and_inside(self):
+    self.assertEqual( RangeReader.coalesce( [ ( 0, 100 ), ( 50, 100 ), ( 60, 10 ) ] ), [ ( 0, 150 ) ] )
+
+  def test_max_request(self):
+    size = RangeReader.maxRequest // 2
+    ranges = [ ( 0, size ), ( size, size ), ( 2 * size, size ) ]
+    self.assertEqual( RangeReader.coalesce( ranges ), [ ( 0, 2 * size ), ( 2 * size, size ) ] )
+    # One range greater than maxRequest is not splited
+    self.assertEqual( RangeReader.coalesce( [ ( 0, 3 * size ) ] ), [ ( 0, 3 * size ) ] )
+
+  def test_empty(self):
+    self.assertEqual( RangeReader.coalesce( [] ), [] )
+    self.assertEqual( RangeReader.coalesce( [ ( 10, 0 ) ] ), [] )
+
+class HandlerWhole(BaseHTTPServer.BaseHTTPRequestHandler):
+  # Server without Range, always the whole file
+  data = ''.join( chr( i % 251 ) for i in xrange( 3 * 1048576 + 123 ) )
+
+  def do_GET(self):
+    self.send_response( 200 )
+    self.send_header( 'Content-Length', str( len( self.data ) ) )
+    self.end_headers()
+    self.wfile.write( self.data )
+
+  def handle(self):
+    try:
+      BaseHTTPServer.BaseHTTPRequestHandler.handle( self )
+    except IOError: # Client closed after the ranges
+      pass
+
+  def finish(self):
+    try:
+      BaseHTTPServer.BaseHTTPRequestHandler.finish( self )
+    except IOError:
+      pass
+
+  def log_message(self, format, *args):
+    pass
+
+class HandlerRange(HandlerWhole):
+  # Server with Range(bytes=a-b), connections are reused(HTTP/1.1)
+  protocol_version = 'HTTP/1.1'
+  ranges = [] # ( offset, size ) of requests
+  lock = threading.Lock()
+
+  def do_GET(self):
+    header = self.headers.getheader( 'Range' )
+    if header is None:
+      return HandlerWhole.do_GET( self )
+    ( a, b ) = map( int, header.split( '=' )[1].split( '-' ) )
+    b = min( b, len( self.data ) - 1 )
+    with self.lock:
+      self.ranges.append( ( a, b - a + 1 ) )
+    self.send_response( 206 )
+    self.send_header( 'Content-Length', str( b - a + 1 ) )
+    self.send_header( 'Content-Range', "bytes %d-%d/%d" % ( a, b, len( self.data ) ) )
+    self.end_headers()
+    self.wfile.write( self.data[ a : b + 1 ] )
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+
+class TestReadWithRange(unittest.TestCase):
+  handler = HandlerRange
+
+  def setUp(self):
+    self.server = Server( ( '127.0.0.1', 0 ), self.handler )
+    self.thread = threading.Thread( target=self.server.serve_forever )
+    self.thread.start()
+    self.url = "http://127.0.0.1:%d/image.tif" % self.server.server_address[1]
+    del HandlerRange.ranges[:]
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+    self.thread.join()
+
+  def test_read(self):
+    data = HandlerRange.data
+    ranges = [ ( 0, 10 ), ( 5, 100 ), ( 50000, 10 ), ( 1048570, 20 ), ( 2 * 1048576, 70000 ), ( len( data ) - 23, 23 ) ]
+    merged = RangeReader.coalesce( ranges )
+    reader = RangeReader( self.url, 3, 10 )
+    vreturn = reader.read( ranges )
+    self.assertTrue( vreturn['isOk'], vreturn.get( 'msg' ) )
+    self.assertEqual( map( lambda r: ( r[0], len( r[1] ) ), vreturn['ranges'] ), merged )
+    for ( offset, values ) in vreturn['ranges']:
+      self.assertEqual( values, data[ offset : offset + len( values ) ] )
+    self.assertEqual( sorted( HandlerRange.ranges ), merged ) # One request by coalesced range
+    self.assertEqual( reader.counters['requests'], len( merged ) )
+    self.assertEqual( reader.counters['bytes'], sum( map( lambda r: r[1], merged ) ) )
+
+  def test_range_after_end(self):
+    reader = RangeReader( self.url, 2, 10 )
+    vreturn = reader.read( [ ( len( HandlerRange.data ) - 10, 100 ) ] )
+    self.assertFalse( vreturn['isOk'] ) # Size of data is different
+
+class TestReadWithoutRange(unittest.TestCase):
+  def setUp(self):
+    self.server = Server( ( '127.0.0.1', 0 ), HandlerWhole )
+    self.thread = threading.Thread( target=self.server.serve_forever )
+    self.thread.start()
+    self.url = "http://127.0.0.1:%d/image.tif" % self.server.server_address[1]
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.server.server_close()
+    self.thread.join()
+
+  def test_read(self):
+    data = HandlerWhole.data
+    ranges = [ ( 0, 10 ), ( 5, 100 ), ( 1048570, 20 ), ( 2 * 1048576, 70000 ), ( len( data ) - 23, 23 ) ]
+    reader = RangeReader( self.url, 3, 10 )
+    vreturn = reader.read( ranges )
+    self.assertTrue( vreturn['isOk'], vreturn.get( 'msg' ) )
+    self.assertEqual( map( lambda r: ( r[0], len( r[1] ) ), vreturn['ranges'] ), RangeReader.coalesce( ranges ) )
+    for ( offset, values ) in vreturn['ranges']:
+      self.assertEqual( values, data[ offset : offset + len( values ) ] )
+
+  def test_range_after_end(self):
+    reader = RangeReader( self.url, 2, 10 )
+    vreturn = reader.read( [ ( len( HandlerWhole.data ) - 10, 100 ) ] )
+    self.assertFalse( vreturn['isOk'] )
+
+if __name__ == '__main__':
+  unittest.main()
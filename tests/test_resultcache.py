@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import os, sys, shutil, tempfile, unittest
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+from resultcache import ResultCache
+
+class TestResultCache(unittest.TestCase):
+  def setUp(self):
+    self.dirWork = tempfile.mkdtemp()
+    self.dirCache = os.path.join( self.dirWork, 'cache' )
+
+  def tearDown(self):
+    shutil.rmtree( self.dirWork, ignore_errors=True )
+
+  def _write(self, name, size):
+    filename = os.path.join( self.dirWork, name )
+    with open( filename, 'wb' ) as f:
+      f.write( 'x' * size )
+    return filename
+
+  def test_get_put(self):
+    cache = ResultCache( self.dirCache, 1048576 )
+    filenames = [ self._write( 'a.tif', 100 ), self._write( 'b.tif', 200 ) ]
+    self.assertFalse( cache.get( 'key1', filenames ) )
+    cache.put( 'key1', filenames )
+    for filename in filenames:
+      os.remove( filename )
+    self.assertTrue( cache.get( 'key1', filenames ) )
+    self.assertEqual( map( os.path.getsize, filenames ), [ 100, 200 ] )
+    self.assertFalse( cache.get( 'key2', filenames ) )
+    self.assertFalse( cache.get( 'key1', filenames[:1] ) ) # Total of outputs is different
+    self.assertEqual( cache.counters['hits'], 1 )
+    self.assertEqual( cache.counters['misses'], 3 )
+
+  def test_removed_outside(self):
+    cache = ResultCache( self.dirCache, 1048576 )
+    filenames = [ self._write( 'a.tif', 100 ) ]
+    cache.put( 'key1', filenames )
+    shutil.rmtree( cache._getDir( 'key1' ) )
+    self.assertFalse( cache.get( 'key1', filenames ) )
+    self.assertFalse( 'key1' in cache._readIndex() )
+
+  def test_evict(self):
+    cache = ResultCache( self.dirCache, 250 )
+    for key in ( 'key1', 'key2' ):
+      cache.put( key, [ self._write( "%s.tif" % key, 100 ) ] )
+    index = cache._readIndex()
+    index['key1']['access'], index['key2']['access'] = 2000, 1000
+    cache._writeIndex( index )
+    cache.put( 'key3', [ self._write( 'key3.tif', 100 ) ] ) # key2 is the older access
+    index = cache._readIndex()
+    self.assertEqual( sorted( index.keys() ), [ 'key1', 'key3' ] )
+    self.assertFalse( os.path.exists( cache._getDir( 'key2' ) ) )
+    self.assertEqual( cache.counters['evictions'], 1 )
+
+  def test_clear(self):
+    cache = ResultCache( self.dirCache, 1048576 )
+    cache.put( 'key1', [ self._write( 'a.tif', 100 ) ] )
+    cache.clear()
+    self.assertEqual( cache._readIndex(), {} )
+    self.assertFalse( os.path.exists( cache._getDir( 'key1' ) ) )
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import os, sys, time, unittest
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+try:
+  import serviceprocessingimage
+  from serviceprocessingimage import ProcessingService
+except ImportError: # GDAL(osgeo) not installed
+  serviceprocessingimage = None
+
+def _runWorkerFake(idWorker, tasks, results, maxImages):
+  # Job with name 'die.tif' kill the process(fields of job are from checkJob)
+  while True:
+    task = tasks.get()
+    if task is None:
+      break
+    if task['job']['name'] == 'die.tif':
+      os._exit( 3 )
+    time.sleep( 0.05 )
+    results.put( ( task['id'], { 'isOk': True, 'times': {}, 'idWorker': idWorker } ) )
+
+@unittest.skipIf( serviceprocessingimage is None, "GDAL not installed" )
+class TestProcessingService(unittest.TestCase):
+  job = { 'type': 'local', 'name': 'image.tif', 'algorithm': 'mask', 'bands': '1' }
+
+  def setUp(self):
+    self.runWorker = serviceprocessingimage._runWorker
+    serviceprocessingimage._runWorker = _runWorkerFake # Processes by fork
+    self.secondsMonitor = ProcessingService.secondsMonitor
+    ProcessingService.secondsMonitor = 0.1
+    self.service = ProcessingService( 1, {} )
+
+  def tearDown(self):
+    self.service.stop()
+    serviceprocessingimage._runWorker = self.runWorker
+    ProcessingService.secondsMonitor = self.secondsMonitor
+
+  def _submit(self, priority, name=None):
+    job = self.job if name is None else dict( self.job, name=name )
+    vreturn = self.service.submit( job, priority )
+    self.assertTrue( vreturn['isOk'], vreturn.get( 'msg' ) )
+    return vreturn['id']
+
+  def test_priority_order(self):
+    # Lower priority first, same priority in order of submit
+    ids = [ self._submit( p ) for p in ( 5, 1, 5, 0 ) ]
+    self.assertTrue( self.service.cancel( ids[2] )['isOk'] )
+    self.service.start()
+    records = map( lambda i: self.service.get( i, 10 ), ids )
+    self.assertEqual( map( lambda r: r['status'], records ), [ 'done', 'done', 'canceled', 'done' ] )
+    starts = dict( ( r['id'], r['times']['start'] ) for r in records if r['status'] == 'done' )
+    self.assertEqual( sorted( starts, key=starts.get ), [ ids[3], ids[1], ids[0] ] )
+
+  def test_priority_not_integer(self):
+    self.assertFalse( self.service.submit( self.job, 'high' )['isOk'] )
+
+  def test_dead_worker(self):
+    self.service.start()
+    idDie = self._submit( 0, 'die.tif' )
+    idNext = self._submit( 1 )
+    record = self.service.get( idDie, 10 )
+    self.assertEqual( record['status'], 'failed' )
+    self.assertTrue( 'died' in record['result']['msg'] )
+    self.assertEqual( self.service.get( idNext, 10 )['status'], 'done' ) # Worker started again
+    self.assertEqual( self.service.status()['free'], 1 )
+
+if __name__ == '__main__':
+  unittest.main()
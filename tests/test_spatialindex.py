@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+import os, sys, random, unittest
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+from spatialindex import SpatialIndex
+
+class TestSpatialIndex(unittest.TestCase):
+  def test_empty(self):
+    index = SpatialIndex( [] )
+    self.assertEqual( len( index ), 0 )
+    self.assertEqual( index.query( ( 0, 0, 10, 10 ) ), [] )
+
+  def test_touch(self):
+    # Boxes are closed
+    index = SpatialIndex( [ ( ( 0, 0, 9, 9 ), 'a' ), ( ( 10, 0, 19, 9 ), 'b' ) ] )
+    self.assertEqual( sorted( index.query( ( 9, 0, 10, 0 ) ) ), [ 'a', 'b' ] )
+    self.assertEqual( index.query( ( 20, 10, 30, 30 ) ), [] )
+
+  def test_brute_force(self):
+    rnd = random.Random( 1 )
+    items = []
+    for i in xrange( 500 ):
+      x, y = rnd.randint( 0, 1000 ), rnd.randint( 0, 1000 )
+      items.append( ( ( x, y, x + rnd.randint( 0, 50 ), y + rnd.randint( 0, 50 ) ), i ) )
+    index = SpatialIndex( items, capacity=4 )
+    self.assertEqual( len( index ), len( items ) )
+    for j in xrange( 100 ):
+      x, y = rnd.randint( -50, 1050 ), rnd.randint( -50, 1050 )
+      bbox = ( x, y, x + rnd.randint( 0, 200 ), y + rnd.randint( 0, 200 ) )
+      expected = [ v for ( b, v ) in items if SpatialIndex.intersects( b, bbox ) ]
+      self.assertEqual( sorted( index.query( bbox ) ), expected )
+
+if __name__ == '__main__':
+  unittest.main()
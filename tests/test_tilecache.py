@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import os, sys, shutil, tempfile, unittest
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+import numpy as np
+from tilecache import TileCache
+
+class TestTileCache(unittest.TestCase):
+  def setUp(self):
+    self.dirCache = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree( self.dirCache, ignore_errors=True )
+
+  def _setAccess(self, cache, key, seconds):
+    filename = cache._getFilename( key )
+    os.utime( filename, ( seconds, seconds ) )
+
+  def test_get_put(self):
+    cache = TileCache( self.dirCache, 1048576 )
+    key = TileCache.getKey( 'scene', 1, ( 2, 3 ), ( 256, 256 ) )
+    self.assertIsNone( cache.get( key ) )
+    values = np.arange( 16, dtype=np.uint16 ).reshape( 4, 4 )
+    cache.put( key, values )
+    self.assertTrue( cache.has( key ) )
+    np.testing.assert_array_equal( cache.get( key ), values )
+    self.assertEqual( cache.counters['hits'], 1 )
+    self.assertEqual( cache.counters['misses'], 1 )
+    self.assertEqual( cache.counters['puts'], 1 )
+
+  def test_lru_eviction(self):
+    values = np.zeros( ( 64, 64 ), np.float64 ) # 32KB
+    cache = TileCache( self.dirCache, 1048576 )
+    cache.put( 'probe', values )
+    sizeFile = os.path.getsize( cache._getFilename( 'probe' ) )
+    cache.clear()
+    cache = TileCache( self.dirCache, 3 * sizeFile )
+    keys = [ 'k%d' % i for i in xrange( 3 ) ]
+    for i in xrange( len( keys ) ):
+      cache.put( keys[ i ], values )
+      self._setAccess( cache, keys[ i ], 1000 + i )
+    cache.get( keys[0] ) # Last access
+    cache.put( 'k3', values ) # Total greater than maxBytes
+    self.assertFalse( cache.has( 'k1' ) )
+    self.assertTrue( cache.has( 'k0' ) )
+    self.assertTrue( cache.has( 'k3' ) )
+    self.assertTrue( cache.counters['evictions'] >= 1 )
+    self.assertTrue( cache._getTotalBytes() <= cache.lowWater * cache.maxBytes )
+
+  def test_total_bytes_from_directory(self):
+    cache = TileCache( self.dirCache, 1048576 )
+    cache.put( 'a', np.ones( 100 ) )
+    self.assertEqual( TileCache( self.dirCache, 1048576 ).totalBytes, cache.totalBytes )
+
+if __name__ == '__main__':
+  unittest.main()
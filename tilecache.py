@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+Name                 : Tile cache
+Description          : Cache in disk of blocks of bands(read-through),
+                       size bounded with LRU eviction, shared by processes
+Arguments            : Directory of cache and max size in bytes
+
+                       -------------------
+begin                : 2016-08-11
+copyright            : (C) 2016 by Luiz Motta
+email                : motta dot luiz at gmail.com
+
+ ***************************************************************************/
+"""
+
+import os, errno, fcntl, hashlib
+
+import numpy as np
+
+class TileCache():
+  # Each block is one file(.npy), the time of modification is the last access
+  # Writing in temporary file and rename(atomic), processes can share the directory
+  # Eviction until lowWater of maxBytes, only one process by time(lock of file)
+  lowWater = 0.9
+  extension = '.npy'
+
+  def __init__(self, dirCache, maxBytes):
+    self.dirCache, self.maxBytes = dirCache, maxBytes
+    self.fileLock = os.path.join( dirCache, '.lock' )
+    self.counters = { 'hits': 0, 'misses': 0, 'puts': 0, 'evictions': 0 }
+    if not os.path.exists( dirCache ):
+      try:
+        os.makedirs( dirCache )
+      except OSError as e:
+        if not e.errno == errno.EEXIST: # Created by other process
+          raise
+    self.totalBytes = self._getTotalBytes() # Estimate, corrected in eviction
+
+  def _getFiles(self):
+    # [ ( mtime, size, filename ), ... ]
+    files = []
+    for ( root, dirs, names ) in os.walk( self.dirCache ):
+      for name in names:
+        if not name.endswith( self.extension ):
+          continue
+        filename = os.path.join( root, name )
+        try:
+          st = os.stat( filename )
+        except OSError: # Removed by other process
+          continue
+        files.append( ( st.st_mtime, st.st_size, filename ) )
+    return files
+
+  def _getTotalBytes(self):
+    return sum( map( lambda f: f[1], self._getFiles() ) )
+
+  def _getFilename(self, key):
+    h = hashlib.md5( key ).hexdigest()
+    return os.path.join( self.dirCache, h[:2], "%s%s" % ( h, self.extension ) )
+
+  def _evict(self):
+    with open( self.fileLock, 'a' ) as f:
+      try:
+        fcntl.flock( f, fcntl.LOCK_EX | fcntl.LOCK_NB )
+      except IOError: # Other process is evicting
+        return
+      try:
+        files = sorted( self._getFiles() ) # Older access first
+        self.totalBytes = sum( map( lambda f: f[1], files ) )
+        for ( mtime, size, filename ) in files:
+          if self.totalBytes <= self.lowWater * self.maxBytes:
+            break
+          try:
+            os.remove( filename )
+          except OSError:
+            continue
+          self.totalBytes -= size
+          self.counters['evictions'] += 1
+      finally:
+        fcntl.flock( f, fcntl.LOCK_UN )
+
+  @staticmethod
+  def getKey(source, bandNumber, block, blockSize):
+    # source: identify the dataset, ex.: scene and product type
+    return "%s|%d|%d,%d|%dx%d" % ( source, bandNumber, block[0], block[1], blockSize[0], blockSize[1] )
+
+  def get(self, key):
+    # Return the array or None
+    filename = self._getFilename( key )
+    try:
+      values = np.load( filename )
+      os.utime( filename, None ) # Access for LRU
+    except ( IOError, OSError, ValueError ): # Not exists, removed or writing
+      self.counters['misses'] += 1
+      return None
+    self.counters['hits'] += 1
+    return values
+
+  def has(self, key):
+    # Not count hit or miss, the block can be evicted after
+    return os.path.exists( self._getFilename( key ) )
+
+  def put(self, key, values):
+    filename = self._getFilename( key )
+    dirname = os.path.dirname( filename )
+    filenameWork = "%s.%d.tmp" % ( filename, os.getpid() )
+    try:
+      if not os.path.exists( dirname ):
+        os.makedirs( dirname )
+      with open( filenameWork, 'wb' ) as f:
+        np.save( f, values )
+      os.rename( filenameWork, filename )
+    except ( IOError, OSError ): # Cache is optional, the values are from dataset
+      if os.path.exists( filenameWork ):
+        os.remove( filenameWork )
+      return
+    self.counters['puts'] += 1
+    self.totalBytes += os.path.getsize( filename )
+    if self.totalBytes > self.maxBytes:
+      self._evict()
+
+  def clear(self):
+    for ( mtime, size, filename ) in self._getFiles():
+      try:
+        os.remove( filename )
+      except OSError:
+        continue
+    self.totalBytes = 0